@@ -0,0 +1,10 @@
+"""
+TITLE:           STIG_Modules
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) Optional helper modules used by STIG_config_builder.py. Nothing in this
+                package is imported until the script reaches a code path that needs it,
+                so the interactive and File Mode workflows behave exactly as before when
+                these features are left disabled.
+"""
@@ -0,0 +1,498 @@
+"""
+TITLE:           batch_cli.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) The non-interactive (batch) entry point of STIG_config_builder.py. When
+                the script is started with command line arguments it skips the mode
+                prompt and the 9 questions, reads every device from the chosen source,
+                and generates all of the STIG configs in one pass.
+
+USAGE:          From the ./Scripts directory:
+                python STIG_config_builder.py --csv File_Mode/multidevice_example.csv
+                python STIG_config_builder.py --netbox netbox_devices.json [more.json ...]
+                python STIG_config_builder.py --nautobot nautobot_devices.json
+                python STIG_config_builder.py --netbox https://netbox.example.com/api/dcim/devices/ --token XXXX
+                python STIG_config_builder.py --netbox http://127.0.0.1:8080/api/dcim/devices/ --cache-ttl 0
+                python STIG_config_builder.py --yaml inventory.yml --set networkType=OVERLAY
+                python STIG_config_builder.py --csv big_inventory.csv --job-store
+                python STIG_config_builder.py --resume <JOB_ID>
+                python STIG_config_builder.py --csv fleet.csv --shard 2/4     <--- see shards.py
+                python STIG_config_builder.py --csv estate.csv --parse-workers 8   <--- see csv_chunks.py
+                python STIG_config_builder.py --csv fleet.csv --validate      <--- check only
+                python STIG_config_builder.py --csv fleet.csv --secret-vault  <--- see secret_vault.py
+                python STIG_config_builder.py --csv fleet.csv --hash-secrets  <--- see secret_hashing.py
+                python STIG_config_builder.py --csv fleet.csv --lint-strict   <--- see config_lint.py
+                python STIG_config_builder.py --csv fleet.csv --fill-placeholders  <--- see placeholder_values.py
+                python STIG_config_builder.py --csv fleet.csv --snmp-collectors    <--- see snmp_collectors.py
+                python STIG_config_builder.py --csv fleet.csv --server-latency     <--- see server_latency.py
+                python STIG_config_builder.py --watch                             <--- see drop_watch.py
+                python STIG_config_builder.py --webhook --webhook-port 8081       <--- see webhook_receiver.py
+                python STIG_config_builder.py --csv fleet.csv --metrics           <--- see run_metrics.py
+"""
+
+import argparse, os
+
+
+def parse_set_options(set_options, parser):
+    """
+    NOTE: Turns repeated '--set FIELD=VALUE' options into a {field: value} dict of
+    defaults, used for any value the inventory source does not provide.
+    """
+    from STIG_Modules.device_schema import canonical_field
+    from STIG_Modules.inventory_adapters import ADAPTER_EXTRA_FIELDS
+    defaults = {}
+    for option in set_options or []:
+        key, separator, value = option.partition("=")
+        field = canonical_field(key) or (key.strip() if key.strip() in ADAPTER_EXTRA_FIELDS else None)
+        if not separator or field is None:
+            parser.error(f"--set expects FIELD=VALUE with a known device field, got: {option}")
+        defaults[field] = value
+    return defaults
+
+def build_parser(settings):
+    parser = argparse.ArgumentParser(
+        prog="STIG_config_builder.py",
+        description="Generate STIG configs for every device in a csv file or inventory source. "
+                    "Run without any arguments for the interactive menu.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--csv", metavar="FILE", help="a multi-device csv file (legacy or header layout)")
+    source.add_argument("--netbox", metavar="EXPORT_OR_URL", nargs="+",
+                        help="NetBox device export file(s) (JSON), or the /api/dcim/devices/ URL")
+    source.add_argument("--nautobot", metavar="EXPORT_OR_URL", nargs="+",
+                        help="Nautobot device export file(s) (JSON), or the /api/dcim/devices/ URL")
+    source.add_argument("--yaml", metavar="FILE", help="a YAML inventory file")
+    source.add_argument("--watch", action="store_true",
+                        help="keep watching the drop folder and run every csv file uploaded into it")
+    source.add_argument("--webhook", action="store_true",
+                        help="receive NetBox/Nautobot device webhooks and regenerate each changed device")
+    parser.add_argument("--parse-workers", metavar="N", type=int, default=settings["csv_parse_workers"],
+                        help="processes that parse a --csv file of csv_parallel_min_size bytes or more "
+                             "(default: one per CPU; 1 reads it in this process)")
+    parser.set_defaults(parse_min_size=settings["csv_parallel_min_size"])
+    parser.add_argument("--token", default=os.environ.get("STIG_INVENTORY_TOKEN"),
+                        help="API token for a NetBox/Nautobot URL (default: $STIG_INVENTORY_TOKEN)")
+    parser.add_argument("--inventory-cache", metavar="FILE", default=settings["inventory_cache_db"],
+                        help="device cache for a NetBox/Nautobot URL (default: %(default)s)")
+    parser.add_argument("--no-inventory-cache", action="store_const", const=None, dest="inventory_cache",
+                        help="pull every device from the URL and do not cache them")
+    parser.add_argument("--cache-ttl", metavar="SECONDS", type=int, default=settings["inventory_cache_ttl"],
+                        help="reuse the device cache without asking the API if it is newer than this (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="concurrent page requests to a NetBox/Nautobot URL (default: %(default)s)")
+    parser.add_argument("--set", metavar="FIELD=VALUE", action="append", dest="set_options",
+                        help="default value for a device field the source does not provide (repeatable)")
+    parser.add_argument("--output-dir", default=settings["stig_config_file_path"],
+                        help="where to save the generated configs (default: %(default)s)")
+    parser.add_argument("--content-store", action="store_true", default=settings["ENABLE_content_store"],
+                        help="save configs through the content-addressed output store")
+    parser.add_argument("--history", action="store_true", default=settings["ENABLE_config_history"],
+                        help="record every generated config in the config history")
+    parser.add_argument("--secret-vault", action="store_true", default=settings["ENABLE_secret_vault"],
+                        help="read the site passwords and SNMP users from the encrypted secret vault")
+    parser.add_argument("--hash-secrets", action="store_true", default=settings["ENABLE_hashed_secrets"],
+                        help="put hashes of the site password in the configs (IOS type 8/9, NX-OS password 5)")
+    parser.add_argument("--ios-secret-type", type=int, choices=(8, 9), default=settings["hashed_secret_IOS_type"],
+                        help="IOS secret type for --hash-secrets (default: %(default)s)")
+    parser.add_argument("--hash-workers", type=int, metavar="N",
+                        help="processes that compute the hashes (default: one per CPU)")
+    parser.add_argument("--fill-placeholders", action="store_true", default=settings["ENABLE_placeholder_values"],
+                        help="fill in the [ReplaceThisValueWith:KEY] values from the placeholder value map")
+    parser.add_argument("--placeholder-values", metavar="PATH", default=settings["placeholder_values_path"],
+                        help="placeholder value map for --fill-placeholders (default: %(default)s)")
+    parser.add_argument("--server-latency", action="store_true", default=settings["ENABLE_server_latency"],
+                        help="pick and order the AAA/NTP servers of each site by measured RTT")
+    parser.add_argument("--latency-data", metavar="PATH", default=settings["server_latency_path"],
+                        help="site x server RTT matrix for --server-latency (default: %(default)s)")
+    parser.add_argument("--snmp-collectors", action="store_true", default=settings["ENABLE_snmp_collectors"],
+                        help="build the SNMP ACLs from the snmp_collectors*.csv files in the STIG_Templates directory")
+    parser.add_argument("--no-lint", action="store_false", dest="lint", default=settings["ENABLE_config_lint"],
+                        help="do not lint the generated configs")
+    parser.add_argument("--lint-strict", action="store_true", default=settings["config_lint_strict"],
+                        help="do not save a config that has lint findings (the device is reported as failed)")
+    parser.add_argument("--watch-dir", metavar="DIR", default=settings["file_mode_path"],
+                        help="drop folder for --watch (default: %(default)s)")
+    parser.add_argument("--watch-interval", metavar="SECONDS", type=float, default=settings["drop_watch_interval"],
+                        help="how often --watch looks at the drop folder (default: %(default)s)")
+    parser.add_argument("--watch-settle", metavar="SECONDS", type=float, default=settings["drop_watch_settle"],
+                        help="an upload is complete once unchanged for this long (default: %(default)s)")
+    parser.add_argument("--watch-workers", metavar="N", type=int,
+                        help="drops processed at the same time (default: up to 4, one per CPU)")
+    parser.add_argument("--webhook-host", default=settings["webhook_host"],
+                        help="address the --webhook receiver listens on (default: %(default)s)")
+    parser.add_argument("--webhook-port", type=int, default=settings["webhook_port"],
+                        help="port the --webhook receiver listens on (default: %(default)s)")
+    parser.add_argument("--webhook-source", choices=("netbox", "nautobot"), default="nautobot",
+                        help="the DCIM that sends the webhooks (default: %(default)s)")
+    parser.add_argument("--webhook-secret", default=os.environ.get("STIG_WEBHOOK_SECRET"),
+                        help="check the X-Hook-Signature of every webhook with this secret "
+                             "(default: $STIG_WEBHOOK_SECRET)")
+    parser.add_argument("--webhook-debounce", metavar="SECONDS", type=float, default=settings["webhook_debounce"],
+                        help="render a device once it has had no new event for this long (default: %(default)s)")
+    parser.add_argument("--metrics", action="store_true", default=settings["ENABLE_run_metrics"],
+                        help="write the run's metrics to a Prometheus textfile-collector file")
+    parser.add_argument("--metrics-file", metavar="PATH", default=settings["run_metrics_path"],
+                        help="metrics file for --metrics (default: %(default)s)")
+    parser.add_argument("--metrics-interval", metavar="SECONDS", type=float, default=settings["run_metrics_interval"],
+                        help="also rewrite the metrics file this often during the run; 0 = only at the start "
+                             "and end (default: %(default)s)")
+    parser.add_argument("--job-store", action="store_true", default=settings["ENABLE_job_store"],
+                        help="record per-device progress so the run can be resumed with --resume")
+    parser.add_argument("--resume", metavar="JOB_ID",
+                        help="continue an earlier --job-store run from its first unfinished device "
+                             "(the source and options are taken from the job)")
+    parser.add_argument("--shard", metavar="i/N",
+                        help="only generate the devices of shard i of N (split by a hash of the hostname), "
+                             "and write a shard manifest and archive for 'python -m STIG_Modules.shards merge'")
+    parser.add_argument("--validate", action="store_true",
+                        help="only check every device (templates and reference data); nothing is rendered or saved")
+    parser.add_argument("--quiet", action="store_true", help="only print failures and the summary")
+    return parser
+
+def open_source(args, defaults, client=None):
+    """
+    NOTE: Returns a generator of DeviceRecords for the selected source.
+    """
+    from STIG_Modules import inventory_adapters
+    if args.csv:
+        return csv_records(args.csv, args.parse_workers, args.parse_min_size)
+    if args.yaml:
+        return inventory_adapters.load_yaml_inventory(args.yaml, defaults)
+    source = "netbox" if args.netbox else "nautobot"
+    targets = args.netbox or args.nautobot
+    if targets[0].startswith(("http://", "https://")):
+        return inventory_adapters.load_rest_devices(targets[0], args.token, source, defaults, client)
+    if source == "netbox":
+        return inventory_adapters.load_netbox_export(targets, defaults)
+    return inventory_adapters.load_nautobot_export(targets, defaults)
+
+def csv_records(path, parse_workers=1, parse_min_size=None):
+    """
+    NOTE: Only a file of 'parse_min_size' bytes or more loads the parallel parser (and
+    its process pool).
+    """
+    from STIG_Modules.device_schema import read_device_file
+    parse_workers = parse_workers or os.cpu_count() or 1
+    if parse_workers > 1 and parse_min_size is not None and os.path.getsize(path) >= parse_min_size:
+        from STIG_Modules.csv_chunks import read_device_chunks
+        yield from read_device_chunks(path, parse_workers, min_size=parse_min_size)
+        return
+    with open(path, newline='') as inputFile:
+        yield from read_device_file(inputFile)
+
+def url_source(args):
+    targets = args.netbox or args.nautobot
+    return bool(targets) and targets[0].startswith(("http://", "https://"))
+
+def open_client(args):
+    """
+    NOTE: Only a NetBox/Nautobot URL needs the HTTP client.
+    """
+    if not url_source(args):
+        return None
+    from STIG_Modules.inventory_client import InventoryClient
+    return InventoryClient(args.token, cache_db=args.inventory_cache, cache_ttl=args.cache_ttl, workers=args.workers)
+
+def open_job(args, argv, settings):
+    """
+    NOTE: Returns (args, argv, job). For --resume, 'args' and 'argv' are those of the
+    command line the job was started with.
+    """
+    if not args.resume and not args.job_store:
+        return args, argv, None
+    if args.resume and not os.path.isfile(settings["job_store_db"]):
+        return args, argv, None
+    from STIG_Modules.job_store import JobStore
+    store = JobStore(settings["job_store_db"])
+    if not args.resume:
+        return args, argv, store.new_job(argv)
+    resumed = store.resume_job(args.resume)
+    if resumed is None:
+        store.close()
+        return args, argv, None
+    job, job_argv = resumed
+    quiet = args.quiet
+    args = build_parser(settings).parse_args(job_argv)
+    args.quiet = args.quiet or quiet
+    return args, job_argv, job
+
+def source_paths(args):
+    """
+    NOTE: The input files of the selected source (none for a URL).
+    """
+    if args.csv:
+        return [args.csv]
+    if args.yaml:
+        return [args.yaml]
+    if url_source(args):
+        return []
+    return list(args.netbox or args.nautobot or [])
+
+def open_secrets(args, defaults, settings):
+    """
+    NOTE: Decrypts the secret vault once and keeps only the secrets of the sites in the
+    input, found by a quick first pass over the source. A NetBox/Nautobot URL is not
+    read twice, so every site is kept for it. Raises VaultError.
+    """
+    if not args.secret_vault:
+        return None
+    from STIG_Modules.batch_render import extra_value
+    from STIG_Modules.secret_vault import SecretProvider, read_passphrase
+    secrets = SecretProvider(settings["secret_vault_path"], read_passphrase())
+    site_ids = None
+    if not url_source(args):
+        site_ids = {extra_value(record, "site_id") for record in open_source(args, defaults)}
+    secrets.prefetch(site_ids)
+    return secrets
+
+def open_latency(args):
+    """
+    NOTE: Reads the RTT matrix once for the run. Raises ServerLatencyError.
+    """
+    if not args.server_latency:
+        return None
+    from STIG_Modules.server_latency import ServerLatency
+    return ServerLatency(args.latency_data)
+
+def open_hasher(args, defaults, reference, shard):
+    """
+    NOTE: Starts the hash pool and, for file sources, submits the hash of every site
+    password in the input (or shard) up front. Devices that fail to resolve are left
+    for run_batch() to report.
+    """
+    if not args.hash_secrets:
+        return None
+    from STIG_Modules.batch_render import BatchError, needs_resolution, resolve_record
+    from STIG_Modules.secret_hashing import SecretHasher
+    hasher = SecretHasher(args.ios_secret_type, args.hash_workers)
+    if url_source(args):
+        return hasher
+
+    def resolved_records():
+        records = open_source(args, defaults)
+        if shard is not None:
+            from STIG_Modules.shards import select_shard
+            records = select_shard(records, shard[0], shard[1], {})
+        for record in records:
+            try:
+                yield resolve_record(record, reference) if needs_resolution(record) else record
+            except BatchError:
+                continue
+    hasher.prefetch(resolved_records())
+    return hasher
+
+def open_manifest(args, shard, argv):
+    from STIG_Modules.shards import ShardManifest, source_fingerprint
+    index, count = shard
+    return ShardManifest(os.path.join(args.output_dir, f"STIG_shard_{index}_of_{count}.manifest.jsonl"),
+                         index, count, source_fingerprint(argv, source_paths(args)), argv)
+
+def reporter(quiet):
+    def report(message):
+        if not quiet or message.startswith("   FAILED"):
+            print(message)
+    return report
+
+def validate(args, defaults, settings):
+    from STIG_Modules.batch_render import validate_batch
+    from STIG_Modules.device_schema import DeviceFileError
+    from STIG_Modules.inventory_adapters import InventoryError
+    from STIG_Modules.reference_data import ReferenceData
+    from STIG_Modules.secret_vault import VaultError
+    from STIG_Modules.server_latency import ServerLatencyError
+    print("\n___BATCH MODE (VALIDATE ONLY)___\n")
+    client = None
+    secrets = None
+    try:
+        secrets = open_secrets(args, defaults, settings)
+        reference = ReferenceData(settings["stig_templates_path"], secrets, open_latency(args))
+        client = open_client(args)
+        stats = validate_batch(open_source(args, defaults, client), settings["jinja_templates_path"], reference,
+                               reporter(args.quiet))
+    except (DeviceFileError, InventoryError, OSError) as err:
+        print(f"\nERROR:\n   The device source could not be read. {err}\n\nEXITING SCRIPT...\n")
+        return 1
+    except (VaultError, ServerLatencyError) as err:
+        print(f"\nERROR:\n   {err}\n\nEXITING SCRIPT...\n")
+        return 1
+    finally:
+        if client is not None:
+            client.close()
+        if secrets is not None:
+            secrets.zeroise()
+    print("\n" + "#"*22 + "\n## VALIDATE SUMMARY ##\n" + "#"*22)
+    print(f"  Devices read:              {stats['devices']}")
+    print(f"  Devices valid:             {stats['rendered']}")
+    print(f"  Devices failed:            {stats['failed']}")
+    for reason, count in sorted(stats["failures"].items()):
+        print(f"      {reason:<22} {count}")
+    return 0 if stats["failed"] == 0 else 2
+
+def print_summary(stats, writer, reference, client=None, job=None, manifest=None, archive_path=None, hasher=None,
+                  linter=None, placeholders=None, collectors=None, metrics=None):
+    elapsed = (stats["finished"] or stats["started"]) - stats["started"]
+    print("\n" + "#"*19 + "\n## BATCH SUMMARY ##\n" + "#"*19)
+    if job is not None:
+        print(f"  Job ID:                    {job.job_id}")
+    if manifest is not None:
+        print(f"  Shard:                     {manifest.index}/{manifest.count}")
+        print(f"  Devices in other shards:   {stats['other_shards']}")
+    print(f"  Devices read:              {stats['devices']}")
+    if stats["skipped"]:
+        print(f"  Already done (resumed):    {stats['skipped']}")
+    print(f"  Configs generated:         {stats['rendered']}")
+    print(f"  Devices failed:            {stats['failed']}")
+    for reason, count in sorted(stats["failures"].items()):
+        print(f"      {reason:<22} {count}")
+    print(f"  Reference lookups:         {reference.lookups}")
+    print(f"  Site contexts:             {len(reference.site_contexts)} built, {reference.site_context_hits} reused")
+    print(f"  Elapsed:                   {elapsed:.2f}s")
+    print(f"  Output location:           {writer.output_path}")
+    if archive_path is not None:
+        print(f"  Shard archive:             {archive_path}")
+    for line in (writer.summary_lines() + (client.summary_lines() if client is not None else [])
+                 + (reference.secrets.summary_lines() if reference.secrets is not None else [])
+                 + (hasher.summary_lines() if hasher is not None else [])
+                 + (reference.latency.summary_lines() if reference.latency is not None else [])
+                 + (collectors.summary_lines() if collectors is not None else [])
+                 + (placeholders.summary_lines() if placeholders is not None else [])
+                 + (linter.summary_lines() if linter is not None else [])
+                 + (metrics.summary_lines() if metrics is not None else [])):
+        print(line)
+
+def main(argv, settings):
+    """
+    NOTE: 'settings' carries the path and feature settings defined at the top of
+    STIG_config_builder.py, so the batch path honors the same configuration.
+    """
+    parser = build_parser(settings)
+    args = parser.parse_args(argv)
+    if args.resume and (args.csv or args.netbox or args.nautobot or args.yaml or args.watch or args.webhook):
+        parser.error("--resume takes the source from the job; do not give a source as well")
+    if not args.resume and not (args.csv or args.netbox or args.nautobot or args.yaml or args.watch or args.webhook):
+        parser.error("one of the arguments --csv --netbox --nautobot --yaml --watch --webhook (or --resume) is required")
+    if args.watch:
+        # Drops run side by side with the same options, so they would overwrite one
+        # shard manifest or metrics file.
+        if args.shard or args.metrics:
+            parser.error("--watch cannot be combined with --shard or --metrics (or ENABLE_run_metrics)")
+        from STIG_Modules.drop_watch import watch
+        return watch(args, argv, settings)
+    if args.webhook:
+        if args.validate or args.shard or args.job_store:
+            parser.error("--webhook cannot be combined with --validate, --shard or --job-store")
+        from STIG_Modules.webhook_receiver import serve
+        return serve(args, parse_set_options(args.set_options, parser), settings)
+    if args.validate:
+        if args.resume or args.shard or args.job_store:
+            parser.error("--validate cannot be combined with --resume, --shard or --job-store")
+        return validate(args, parse_set_options(args.set_options, parser), settings)
+    if args.shard and args.job_store:
+        # A resumed shard would skip the devices it already did, leaving them out of
+        # its manifest and archive.
+        parser.error("--shard cannot be combined with --job-store or --resume")
+    resume_id = args.resume
+    args, argv, job = open_job(args, argv, settings)
+    if resume_id and job is None:
+        print(f"ERROR:\n   Job [{resume_id}] was not found in [{settings['job_store_db']}].\n\nEXITING SCRIPT...\n")
+        return 1
+    if job is not None and args.shard:
+        print(f"ERROR:\n   Job [{job.job_id}] is a shard run; a shard cannot be resumed. Run the shard again.\n\nEXITING SCRIPT...\n")
+        job.close("aborted")
+        return 1
+    defaults = parse_set_options(args.set_options, parser)
+    shard = None
+    if args.shard:
+        from STIG_Modules.shards import ShardError, parse_shard
+        try:
+            shard = parse_shard(args.shard)
+        except ShardError as err:
+            parser.error(str(err))
+
+    from STIG_Modules.batch_render import OutputWriter, TemplateRenderer, new_batch_stats, run_batch
+    from STIG_Modules.device_schema import DeviceFileError
+    from STIG_Modules.inventory_adapters import InventoryError
+    from STIG_Modules.placeholder_values import PlaceholderValues, PlaceholderValuesError
+    from STIG_Modules.reference_data import ReferenceData
+    from STIG_Modules.secret_vault import VaultError
+    from STIG_Modules.server_latency import ServerLatencyError
+    from STIG_Modules.snmp_collectors import SnmpCollectors, SnmpCollectorsError
+
+    print("\n___BATCH MODE___\n")
+    if job is not None:
+        print(f"Job ID: {job.job_id}   (resume with: python STIG_config_builder.py --resume {job.job_id})\n")
+    if not os.path.isdir(args.output_dir):
+        print(f"ERROR:\n   The output directory [{args.output_dir}] does not exist.\n\nEXITING SCRIPT...\n")
+        if job is not None:
+            job.close("aborted")
+        return 1
+    writer = OutputWriter(args.output_dir, settings["stig_config_file_PREFIX"],
+                          content_store_path=settings["content_store_path"] if args.content_store else None,
+                          history_db=settings["config_history_db"] if args.history else None)
+    report = reporter(args.quiet)
+    linter = None
+    if args.lint:
+        from STIG_Modules.config_lint import ConfigLinter
+        linter = ConfigLinter(args.lint_strict)
+    client = None
+    secrets = None
+    hasher = None
+    placeholders = None
+    collectors = None
+    manifest = None
+    archive_path = None
+    job_status = "aborted"
+    stats = new_batch_stats()
+    metrics = None
+    if args.metrics:
+        from STIG_Modules.run_metrics import RunMetrics
+        metrics = RunMetrics(args.metrics_file, stats, writer, args.metrics_interval)
+    try:
+        secrets = open_secrets(args, defaults, settings)
+        reference = ReferenceData(settings["stig_templates_path"], secrets, open_latency(args))
+        hasher = open_hasher(args, defaults, reference, shard)
+        if metrics is not None:
+            metrics.reference = reference
+            metrics.hasher = hasher
+        if args.snmp_collectors:
+            collectors = SnmpCollectors(settings["stig_templates_path"])
+        renderer = TemplateRenderer(settings["jinja_templates_path"], hasher, collectors)
+        if args.fill_placeholders:
+            placeholders = PlaceholderValues(args.placeholder_values)
+        client = open_client(args)
+        if metrics is not None:
+            metrics.client = client
+        records = open_source(args, defaults, client)
+        if shard is not None:
+            from STIG_Modules.shards import select_shard
+            manifest = open_manifest(args, shard, argv)
+            records = select_shard(records, shard[0], shard[1], stats)
+        run_batch(records, renderer, writer, reference, report, stats, job=job, manifest=manifest, linter=linter,
+                  placeholders=placeholders, metrics=metrics)
+        if manifest is not None:
+            manifest.close(stats)
+            archive_path = manifest.write_archive(args.output_dir)
+        job_status = "finished"
+    except (DeviceFileError, InventoryError, OSError) as err:
+        print(f"\nERROR:\n   The device source could not be read. {err}\n\nEXITING SCRIPT...\n")
+        writer.close()
+        return 1
+    except (VaultError, PlaceholderValuesError, SnmpCollectorsError, ServerLatencyError) as err:
+        print(f"\nERROR:\n   {err}\n\nEXITING SCRIPT...\n")
+        writer.close()
+        return 1
+    finally:
+        if client is not None:
+            client.close()
+        if secrets is not None:
+            secrets.zeroise()
+        if hasher is not None:
+            hasher.close()
+        if job is not None:
+            job.close(job_status)
+        if metrics is not None:
+            metrics.close(1 if job_status == "aborted" else 0 if stats["failed"] == 0 else 2)
+    print_summary(stats, writer, reference, client, job, manifest, archive_path, hasher, linter, placeholders,
+                  collectors, metrics)
+    writer.close()
+    return 0 if stats["failed"] == 0 else 2
@@ -0,0 +1,471 @@
+"""
+TITLE:           batch_render.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) The non-interactive render pipeline shared by every batch source (csv
+                files, DCIM exports, YAML inventories):
+                - resolve_record():  fills any blank reference fields of a DeviceRecord
+                                     from the STIG_Templates reference data.
+                - TemplateRenderer:  loads the (precompiled) Jinja templates once per
+                                     run and renders a DeviceRecord, either into one
+                                     string or as a stream of chunks.
+                - OutputWriter:      saves STIG_Config_<devName> (and, if enabled, the
+                                     content store and config history copies).
+                - run_batch():       streams records through the three steps above and
+                                     keeps per-run counters (and, if given a Job from
+                                     job_store.py, per-device progress for --resume).
+                2) Devices are processed one at a time from a generator, so memory use
+                stays flat no matter how many devices the source holds.
+                3) Unless the content store or config history is enabled (both need the
+                whole config), each config is streamed from the template straight into
+                its file in STREAM_BUFFER sized pieces and never held in memory as a
+                whole, so memory use is also flat no matter how large a config is
+                (see render_memory_bench.py).
+"""
+
+import hashlib, os, time
+
+from STIG_Modules.reference_data import (ReferenceDataError, IOS_DEVICE_TYPES, NEXUS_DEVICE_TYPES,
+                                         ASA_DEVICE_TYPES)
+
+
+DEFAULT_JINJA_TEMPLATES_PATH = "./Jinja_Templates"
+DEFAULT_OUTPUT_PATH = "./Generated_Configs/"
+DEFAULT_OUTPUT_PREFIX = "STIG_Config_"
+
+# Streamed configs are written (and hashed) in pieces of about this many characters.
+STREAM_BUFFER = 64 * 1024
+
+JINJA_TEMPLATE_IOS_IOSXE = "platform_IOS.j2"
+JINJA_TEMPLATE_ASA = "platform_ASA.j2"
+JINJA_TEMPLATE_NEXUS = "platform_NEXUS.j2"
+
+# The ASA template is not production-ready ATT (see 'Assign the correct STIG template' in
+# STIG_config_builder.py). Move ASA_DEVICE_TYPES into TEMPLATE_FOR_DEVICE once it is.
+TEMPLATE_FOR_DEVICE = {}
+TEMPLATE_FOR_DEVICE.update(dict.fromkeys(IOS_DEVICE_TYPES, JINJA_TEMPLATE_IOS_IOSXE))
+TEMPLATE_FOR_DEVICE.update(dict.fromkeys(NEXUS_DEVICE_TYPES, JINJA_TEMPLATE_NEXUS))
+
+SNMP_USER_FIELDS = ("snmp_READuser", "snmp_READrole", "snmp_READauthPW", "snmp_READprivPW",
+                    "snmp_READuserACL", "snmp_WRITEuser", "snmp_WRITErole", "snmp_WRITEauthPW",
+                    "snmp_WRITEprivPW", "snmp_WRITEuserACL")
+
+
+class BatchError(Exception):
+    """
+    NOTE: A per-device failure. 'reason' is a short, stable keyword used to group
+    failures in the end-of-run summary.
+    """
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+def extra_value(record, name):
+    return getattr(record.extras, name, "") or ""
+
+
+# ========================================================================================
+# Step 1: resolve blank fields from the reference data.
+# ========================================================================================
+
+def resolve_record(record, reference):
+    """
+    NOTE: Only blank fields are resolved; any value supplied by the source always wins.
+    The AAA servers follow ise_region, the NTP servers follow geo_region, and the site
+    fields follow the 'site_id' extra column (the Corporate Site ID, e.g. ID001). The
+    values come from the site's shared SiteContext, so they are looked up once per site.
+    """
+    updates = {}
+    try:
+        site = reference.site_context(extra_value(record, "site_id"), record.networkType,
+                                      record.geo_region, record.ise_region)
+        if not record.aaaServer_PRI or not record.aaaServer_SEC:
+            updates["aaaServer_PRI"], updates["aaaServer_SEC"] = site.value("aaa")
+        if not (record.ntpServer_Prefer and record.ntpServer_SEC and record.ntpServer_TER and record.ntpServer_ALT):
+            (updates["ntpServer_Prefer"], updates["ntpServer_SEC"],
+             updates["ntpServer_TER"], updates["ntpServer_ALT"]) = site.value("ntp")
+        if not (record.snmp_loc and record.snmp_contact and record.snmp_contact_phone):
+            updates["snmp_loc"], updates["snmp_contact"], updates["snmp_contact_phone"] = site.value("snmp")
+        if not record.site_password:
+            updates["site_password"] = site.value("site_password")
+        if not record.loggingSyntax:
+            updates["loggingSyntax"] = reference.logging_syntax(record.deviceType, record.vrf_exists, record.vrf_name)
+        if not record.snmp_READuser or not record.snmp_WRITEuser:
+            read_row, write_row = reference.platform_user_rows(record.deviceType, extra_value(record, "vdc_type"))
+            updates.update(zip(SNMP_USER_FIELDS, read_row[1:6] + write_row[1:6]))
+    except ReferenceDataError as err:
+        raise BatchError("reference_data", f"[{record.devName}] {err}") from None
+    if not updates:
+        return record
+    # Keep any value the source did provide.
+    return record._replace(**{field: value for field, value in updates.items() if not getattr(record, field)})
+
+def needs_resolution(record):
+    return not all(record[:-1])
+
+
+# ========================================================================================
+# Step 2: render.
+# ========================================================================================
+
+def template_name_for(record):
+    template_name = TEMPLATE_FOR_DEVICE.get(record.deviceType)
+    if template_name is None:
+        if record.deviceType in ASA_DEVICE_TYPES:
+            raise BatchError("unsupported_device", f"[{record.devName}] The ASA template is not complete ATT.")
+        raise BatchError("unsupported_device", f"[{record.devName}] Could not determine the correct Jinja template for deviceType [{record.deviceType}].")
+    return template_name
+
+def render_kwargs(record):
+    """
+    NOTE: The variable names handed to the Jinja templates. Keep these in line with the
+    'Rendor STIG Config' sections of STIG_config_builder.py.
+    """
+    return dict(networkType = record.networkType,
+                devType = record.deviceType,
+                hostname = record.devName,
+                mgmt_IP = record.mgmt_ipaddr,
+                mgmt_Int = record.mgmt_interf,
+                vrf_check = record.vrf_exists,
+                vrf_name = record.vrf_name,
+                AAA_PRI = record.aaaServer_PRI,
+                AAA_SEC = record.aaaServer_SEC,
+                NTP_1 = record.ntpServer_Prefer,
+                NTP_2 = record.ntpServer_SEC,
+                NTP_3 = record.ntpServer_TER,
+                NTP_4 = record.ntpServer_ALT,
+                snmp_location = record.snmp_loc,
+                snmp_contact = record.snmp_contact,
+                snmp_contact_phone = record.snmp_contact_phone,
+                sitePass = record.site_password,
+                syslogSyntax = record.loggingSyntax,
+                snmp_READuser = record.snmp_READuser,
+                snmp_READrole = record.snmp_READrole,
+                snmp_READauthPW = record.snmp_READauthPW,
+                snmp_READprivPW = record.snmp_READprivPW,
+                snmp_READuserACL = record.snmp_READuserACL,
+                snmp_WRITEuser = record.snmp_WRITEuser,
+                snmp_WRITErole = record.snmp_WRITErole,
+                snmp_WRITEauthPW = record.snmp_WRITEauthPW,
+                snmp_WRITEprivPW = record.snmp_WRITEprivPW,
+                snmp_WRITEuserACL = record.snmp_WRITEuserACL,
+                extras = record.extras._asdict())
+
+
+class TemplateRenderer:
+
+    def __init__(self, jinja_templates_path=DEFAULT_JINJA_TEMPLATES_PATH, hasher=None, collectors=None):
+        from STIG_Modules.template_build import load_environment
+        self.environ = load_environment(jinja_templates_path)
+        self.templates = {}
+        # A SecretHasher (secret_hashing.py) adds the hashed site password variables.
+        self.hasher = hasher
+        # SnmpCollectors (snmp_collectors.py) adds the SNMP ACL entries.
+        self.collectors = collectors
+
+    def get_template(self, template_name):
+        template = self.templates.get(template_name)
+        if template is None:
+            template = self.templates[template_name] = self.environ.get_template(template_name)
+        return template
+
+    def template_kwargs(self, record):
+        kwargs = render_kwargs(record)
+        if self.hasher is not None:
+            try:
+                kwargs.update(self.hasher.render_kwargs(record))
+            except Exception as err:
+                raise BatchError("secret_hash", f"[{record.devName}] The site password could not be hashed: {err}") from None
+        if self.collectors is not None:
+            kwargs.update(self.collectors.render_kwargs(record))
+        return kwargs
+
+    def render(self, record):
+        template = self.get_template(template_name_for(record))
+        kwargs = self.template_kwargs(record)
+        try:
+            return template.render(**kwargs)
+        except Exception as err:
+            raise BatchError("render", f"[{record.devName}] The STIG config could not be rendered: {err}") from None
+
+    def stream(self, record):
+        """
+        NOTE: Yields the config in the small pieces Jinja generates it in. A template
+        error part way through raises the same BatchError as render().
+        """
+        template = self.get_template(template_name_for(record))
+        kwargs = self.template_kwargs(record)
+        try:
+            yield from template.generate(**kwargs)
+        except Exception as err:
+            raise BatchError("render", f"[{record.devName}] The STIG config could not be rendered: {err}") from None
+
+
+# ========================================================================================
+# Step 3: save.
+# ========================================================================================
+
+class OutputWriter:
+    """
+    NOTE: Saves generated configs to <output_path><prefix><devName>. The optional
+    content-addressed store and config history are only opened when their paths are
+    given, and share a single run ID. 'write_time' adds up the seconds spent writing
+    to disk.
+    """
+
+    def __init__(self, output_path=DEFAULT_OUTPUT_PATH, prefix=DEFAULT_OUTPUT_PREFIX,
+                 content_store_path=None, history_db=None, run_id=None):
+        self.output_path = output_path
+        self.prefix = prefix
+        self.content_store = None
+        self.config_history = None
+        if content_store_path:
+            from STIG_Modules.output_store import ContentStore
+            self.content_store = ContentStore(content_store_path, run_id)
+            run_id = self.content_store.run_id
+        if history_db:
+            from STIG_Modules.config_history import ConfigHistory
+            self.config_history = ConfigHistory(history_db, run_id)
+            run_id = self.config_history.run_id
+        self.run_id = run_id
+        self.bytes_written = 0
+        self.write_time = 0.0
+
+    def config_path(self, devName):
+        """
+        NOTE: Raises BatchError for a hostname that would put the config (or its
+        content store index) outside the output directory.
+        """
+        from STIG_Modules.output_store import check_index_name
+        try:
+            check_index_name(devName)
+        except ValueError as err:
+            raise BatchError("hostname", f"[{devName}] {err}") from None
+        return os.path.join(self.output_path, self.prefix + devName)
+
+    def save(self, STIG_config_abs_path, devName, output):
+        started = time.perf_counter()
+        if self.content_store is not None:
+            self.content_store.save(devName, output, STIG_config_abs_path)
+        else:
+            # Never write through a hardlink left behind by an earlier run that used the store.
+            if os.path.exists(STIG_config_abs_path) and os.stat(STIG_config_abs_path).st_nlink > 1:
+                os.remove(STIG_config_abs_path)
+            with open(STIG_config_abs_path,"w") as genFile:
+                genFile.write(output)
+        if self.config_history is not None:
+            self.config_history.record(devName, output)
+        self.bytes_written += len(output.encode("utf-8"))
+        self.write_time += time.perf_counter() - started
+
+    def new_run(self, run_id):
+        """
+        NOTE: Starts a new run ID in the content store and config history.
+        """
+        if self.content_store is not None:
+            self.content_store.run_id = run_id
+        if self.config_history is not None:
+            self.config_history.new_run(run_id)
+        self.run_id = run_id
+
+    @property
+    def streaming(self):
+        """
+        NOTE: The content store and config history both need the whole config.
+        """
+        return self.content_store is None and self.config_history is None
+
+    def save_stream(self, STIG_config_abs_path, chunks, digest=None, inspect=None, substitute=None):
+        """
+        NOTE: Writes the chunks to a .part file that replaces the config once it is
+        complete, so a render error never leaves half a config behind (and a hardlink
+        left by the content store is replaced, not written through). If given, the
+        hashlib object 'digest' is updated with the UTF-8 bytes of the config, and
+        'inspect' is called with every piece written and then with None; if it raises,
+        the config is not put in place. 'substitute' rewrites every piece before it is
+        written, and returns any text it held back when called with None.
+        """
+        part_path = STIG_config_abs_path + ".part"
+        try:
+            with open(part_path, "w") as genFile:
+                pending, pending_size = [], 0
+                for chunk in chunks:
+                    pending.append(chunk)
+                    pending_size += len(chunk)
+                    if pending_size >= STREAM_BUFFER:
+                        self.write_piece(genFile, "".join(pending), digest, inspect, substitute)
+                        pending, pending_size = [], 0
+                self.write_piece(genFile, "".join(pending), digest, inspect, substitute)
+                if substitute is not None:
+                    self.write_piece(genFile, substitute(None), digest, inspect)
+            if inspect is not None:
+                inspect(None)
+            started = time.perf_counter()
+            os.replace(part_path, STIG_config_abs_path)
+            self.write_time += time.perf_counter() - started
+        except BaseException:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+
+    def write_piece(self, genFile, piece, digest, inspect=None, substitute=None):
+        if substitute is not None:
+            piece = substitute(piece)
+        started = time.perf_counter()
+        genFile.write(piece)
+        self.write_time += time.perf_counter() - started
+        data = piece.encode("utf-8")
+        if digest is not None:
+            digest.update(data)
+        if inspect is not None:
+            inspect(piece)
+        self.bytes_written += len(data)
+
+    def summary_lines(self):
+        lines = []
+        if self.content_store is not None:
+            store_stats = self.content_store.stats()
+            lines.append("\n" + "#"*27 + "\n## CONTENT STORE SUMMARY ##\n" + "#"*27)
+            lines.append(f"  Run ID:                    {self.content_store.run_id}")
+            lines.append(f"  New configs stored:        {self.content_store.blobs_written}")
+            lines.append(f"  Duplicate configs reused:  {self.content_store.blobs_reused}")
+            lines.append(f"  Devices indexed:           {store_stats['devices']}")
+            lines.append(f"  Unique configs on disk:    {store_stats['blobs']}  ({store_stats['stored_bytes']} bytes)")
+            lines.append(f"  Full-copy equivalent:      {store_stats['logical_bytes']} bytes")
+        if self.config_history is not None:
+            run_ids = self.config_history.run_ids
+            changed_devices = set()
+            for run_id in run_ids:
+                changed_devices.update(self.config_history.changed_in_run(run_id))
+            lines.append("\n" + "#"*28 + "\n## CONFIG HISTORY SUMMARY ##\n" + "#"*28)
+            if len(run_ids) > 1:
+                lines.append(f"  Run IDs:                   {run_ids[0]} to {run_ids[-1]} ({len(run_ids)} runs)")
+                lines.append(f"  Devices changed:           {len(changed_devices)}")
+                lines.append("  To review the changes:     python -m STIG_Modules.config_history runs")
+            else:
+                lines.append(f"  Run ID:                    {run_ids[0]}")
+                lines.append(f"  Devices changed this run:  {len(changed_devices)}")
+                lines.append(f"  To review the changes:     python -m STIG_Modules.config_history changed {run_ids[0]}")
+        return lines
+
+    def close(self):
+        if self.config_history is not None:
+            self.config_history.close()
+
+
+# ========================================================================================
+# The batch loop.
+# ========================================================================================
+
+def validate_batch(records, jinja_templates_path=DEFAULT_JINJA_TEMPLATES_PATH, reference=None, report=print, stats=None):
+    """
+    NOTE: Checks every record the way run_batch() would (template selection and
+    reference data) without rendering or saving anything, and without loading Jinja.
+    """
+    if stats is None:
+        stats = new_batch_stats()
+    for record in records:
+        stats["devices"] += 1
+        try:
+            template_name = template_name_for(record)
+            if not os.path.isfile(os.path.join(jinja_templates_path, template_name)):
+                raise BatchError("render", f"[{record.devName}] The Jinja template [{template_name}] is missing.")
+            if reference is not None and needs_resolution(record):
+                resolve_record(record, reference)
+        except BatchError as err:
+            stats["failed"] += 1
+            stats["failures"][err.reason] = stats["failures"].get(err.reason, 0) + 1
+            report(f"   FAILED:     {err}")
+            continue
+        stats["rendered"] += 1
+        report(f"   VALID:      [{record.devName}]  ({record.mgmt_ipaddr})")
+    stats["finished"] = time.time()
+    return stats
+
+def new_batch_stats():
+    return {"devices": 0, "rendered": 0, "failed": 0, "skipped": 0, "failures": {}, "per_platform": {},
+            "started": time.time(), "finished": None}
+
+def run_batch(records, renderer, writer, reference=None, report=print, stats=None, job=None, manifest=None,
+              linter=None, placeholders=None, metrics=None):
+    """
+    NOTE: Streams every record through resolve -> render -> save. A failing device is
+    reported and counted, and the batch carries on with the next one. With a job, rows
+    the job already finished (with unchanged input) are skipped. With a manifest (see
+    shards.py), every device's outcome is also written to it. With placeholder values
+    (see placeholder_values.py) and a linter (see config_lint.py), every config is
+    filled in and then linted on its way to the writer. With run metrics (see
+    run_metrics.py), the render and write time of every config is measured.
+    """
+    if stats is None:
+        stats = new_batch_stats()
+    for seq, record in enumerate(records, start=1):
+        stats["devices"] += 1
+        if metrics is not None:
+            metrics.tick()
+            started = time.perf_counter()
+            write_time = writer.write_time
+        if job is not None:
+            fingerprint = job.fingerprint(record)
+            if job.is_done(seq, fingerprint):
+                stats["skipped"] += 1
+                continue
+        try:
+            template_name_for(record)
+            if reference is not None and needs_resolution(record):
+                record = resolve_record(record, reference)
+            # Jobs and shard manifests record the SHA-256 of every config.
+            digest = hashlib.sha256() if job is not None or manifest is not None else None
+            config_path = writer.config_path(record.devName)
+            lint_counts = {}
+            unfilled = set()
+            try:
+                if writer.streaming:
+                    inspect = substitute = None
+                    if placeholders is not None:
+                        substitute = placeholders.filler(record, unfilled)
+                    if linter is not None:
+                        inspect = linter.watch(record.devName, lint_counts)
+                    writer.save_stream(config_path, renderer.stream(record), digest, inspect, substitute)
+                else:
+                    output = renderer.render(record)
+                    if placeholders is not None:
+                        output = placeholders.fill(record, output, unfilled)
+                    if linter is not None:
+                        lint_counts = linter.check(record.devName, output)
+                    writer.save(config_path, record.devName, output)
+                    if digest is not None:
+                        digest.update(output.encode("utf-8"))
+            except OSError as err:
+                raise BatchError("write", f"[{record.devName}] The STIG config could not be saved: {err}") from None
+        except BatchError as err:
+            stats["failed"] += 1
+            stats["failures"][err.reason] = stats["failures"].get(err.reason, 0) + 1
+            report(f"   FAILED:     {err}")
+            if job is not None:
+                job.failed_device(seq, record, fingerprint, err.reason)
+            if manifest is not None:
+                manifest.device_failed(record, err.reason)
+            continue
+        if metrics is not None:
+            write_time = writer.write_time - write_time
+            metrics.device_done(time.perf_counter() - started - write_time, write_time)
+        if job is not None:
+            job.done_device(seq, record, fingerprint, digest.hexdigest())
+        if manifest is not None:
+            manifest.device_done(record, writer.prefix + record.devName, digest.hexdigest())
+        stats["rendered"] += 1
+        platform_key = (record.deviceType, record.networkType)
+        stats["per_platform"][platform_key] = stats["per_platform"].get(platform_key, 0) + 1
+        report(f"   COMPLETED:  [{record.devName}]  ({record.mgmt_ipaddr})")
+        if placeholders is not None:
+            placeholders.finish(unfilled)
+            if unfilled:
+                report(f"   UNFILLED:   [{record.devName}]  {', '.join(sorted(unfilled))}")
+        if lint_counts:
+            from STIG_Modules.config_lint import describe as describe_lint
+            report(f"   LINT:       [{record.devName}]  {describe_lint(lint_counts)}")
+    stats["finished"] = time.time()
+    return stats
@@ -0,0 +1,355 @@
+"""
+TITLE:           config_collector.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) Collects the current running config of every device in an inventory, to
+                compare against the generated STIG baseline. It reads the same sources as
+                Batch Mode (--csv, --netbox, --nautobot, --yaml) and logs in to each
+                device's mgmt_ipaddr for 'show running-config'.
+                2) Devices are collected concurrently (asyncio, --concurrency at once),
+                each attempt with its own time limit (--timeout), and a device that
+                cannot be reached, refuses the login or stalls is tried again
+                (--retries).
+                3) Every config is written to disk as soon as it arrives, compressed, into
+                one collection per run:
+                    <output-dir>/<RUN_ID>/running_configs.gz   one gzip member per device
+                    <output-dir>/<RUN_ID>/index.jsonl          hostname -> offset, size, SHA-256
+                The .gz file is an ordinary gzip stream (zcat shows every config), and
+                the index lets read_running_config() / 'show' pull out one device's
+                config without decompressing the others.
+
+USAGE:          From the ./Scripts directory:
+                python -m STIG_Modules.config_collector collect --csv fleet.csv --username admin
+                python -m STIG_Modules.config_collector show Generated_Configs/Running_Configs/<RUN_ID> <devName>
+                python -m STIG_Modules.config_collector extract Generated_Configs/Running_Configs/<RUN_ID> --to ./running/
+
+                Without hardware, against the local stand-in (ssh_standin.py):
+                python -m STIG_Modules.ssh_standin --port 2222
+                python -m STIG_Modules.config_collector collect --csv fleet.csv --username admin --port 2222 --loopback --no-host-key-check
+
+NOTE:           Requires the asyncssh package (pip install asyncssh). The login options
+                and password handling are the same as config_delivery.py
+                (STIG_SSH_USERNAME, STIG_SSH_PASSWORD).
+"""
+
+import asyncio, collections, gzip, hashlib, json, os, sys, time
+
+from STIG_Modules.output_store import make_run_id
+
+
+DEFAULT_OUTPUT_DIR = "./Generated_Configs/Running_Configs"
+CONFIGS_FILE = "running_configs.gz"
+INDEX_FILE = "index.jsonl"
+INDEX_FORMAT = 1
+
+DEFAULT_CONCURRENCY = 200
+DEFAULT_TIMEOUT = 60.0
+DEFAULT_RETRIES = 2
+RETRY_BACKOFF = 2.0
+COMPRESS_LEVEL = 6
+
+SHOW_COMMAND = "show running-config"
+# Lines IOS prints ahead of the config itself.
+PREAMBLE = ("Building configuration...", "Current configuration :")
+
+
+class CollectionError(ValueError):
+    pass
+
+
+def strip_preamble(output):
+    lines = output.replace("\r\n", "\n").split("\n")
+    while lines and (not lines[0].strip() or lines[0].startswith(PREAMBLE)):
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+class CollectionWriter:
+    """
+    NOTE: Appends each config as its own gzip member and indexes it by hostname. Both
+    files are written as devices finish, so memory stays flat for any fleet size and
+    a run cut short still leaves every config collected so far readable.
+    """
+
+    def __init__(self, run_dir, run_id, argv):
+        os.makedirs(run_dir, exist_ok=True)
+        self.run_dir = run_dir
+        self.configsFile = open(os.path.join(run_dir, CONFIGS_FILE), "wb")
+        self.indexFile = open(os.path.join(run_dir, INDEX_FILE), "w")
+        self.offset = 0
+        self.raw_bytes = 0
+        self.write_index({"format": INDEX_FORMAT, "run_id": run_id, "argv": list(argv), "started": time.time()})
+
+    def write_index(self, entry):
+        self.indexFile.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def device_collected(self, devName, mgmt_ipaddr, config, attempts, seconds):
+        data = config.encode("utf-8")
+        member = gzip.compress(data, COMPRESS_LEVEL, mtime=0)
+        self.configsFile.write(member)
+        self.write_index({"devName": devName, "mgmt_ipaddr": mgmt_ipaddr, "status": "collected",
+                          "offset": self.offset, "length": len(member), "bytes": len(data),
+                          "sha256": hashlib.sha256(data).hexdigest(), "attempts": attempts,
+                          "seconds": round(seconds, 3), "collected": time.time()})
+        self.offset += len(member)
+        self.raw_bytes += len(data)
+
+    def device_failed(self, devName, mgmt_ipaddr, reason, attempts):
+        self.write_index({"devName": devName, "mgmt_ipaddr": mgmt_ipaddr, "status": "failed", "reason": reason,
+                          "attempts": attempts})
+
+    def close(self, stats):
+        self.write_index({"complete": True, "finished": time.time(), "collected": stats["collected"],
+                          "failed": stats["failed"]})
+        self.configsFile.close()
+        self.indexFile.close()
+
+
+def read_index(run_dir):
+    """
+    NOTE: Returns (header, {devName: entry}, footer or None). A hostname listed twice
+    keeps its later entry.
+    """
+    from STIG_Modules.shards import read_manifest_lines
+    try:
+        lines = list(read_manifest_lines(os.path.join(run_dir, INDEX_FILE)))
+    except OSError as err:
+        raise CollectionError(f"{run_dir} is not a collection ({err.strerror}).") from None
+    if not lines or lines[0].get("format") != INDEX_FORMAT:
+        raise CollectionError(f"{run_dir} has an unreadable {INDEX_FILE}.")
+    footer = lines[-1] if lines[-1].get("complete") else None
+    entries = {entry["devName"]: entry for entry in lines[1:] if "devName" in entry}
+    return lines[0], entries, footer
+
+def read_running_config(run_dir, devName, entries=None):
+    """
+    NOTE: One device's running config from a collection, or None if it was not
+    collected.
+    """
+    entries = read_index(run_dir)[1] if entries is None else entries
+    entry = entries.get(devName)
+    if entry is None or entry["status"] != "collected":
+        return None
+    with open(os.path.join(run_dir, CONFIGS_FILE), "rb") as configsFile:
+        configsFile.seek(entry["offset"])
+        return gzip.decompress(configsFile.read(entry["length"])).decode("utf-8")
+
+
+# ========================================================================================
+# Collection.
+# ========================================================================================
+
+def inventory_targets(records):
+    """
+    NOTE: (devName, mgmt_ipaddr) for every device, in source order. Devices without a
+    mgmt_ipaddr are returned separately.
+    """
+    targets, missing = collections.OrderedDict(), []
+    for record in records:
+        if record.mgmt_ipaddr.strip():
+            targets[record.devName] = record.mgmt_ipaddr.strip()
+        else:
+            missing.append(record.devName)
+    return list(targets.items()), missing
+
+async def collect_device(pool, devName, mgmt_ipaddr, args):
+    """
+    NOTE: Returns (config, None, attempts) or (None, reason, attempts).
+    """
+    from STIG_Modules.config_delivery import describe_error
+    from STIG_Modules.device_ssh import DeviceSSHError
+
+    async def attempt():
+        session = await pool.session(mgmt_ipaddr)
+        try:
+            return await session.command(SHOW_COMMAND)
+        finally:
+            session.close()
+
+    attempts, reason = 0, None
+    async with pool.device(mgmt_ipaddr):
+        while attempts <= args.retries:
+            attempts += 1
+            try:
+                output = await asyncio.wait_for(attempt(), args.timeout)
+                return strip_preamble(output), None, attempts
+            except (asyncio.TimeoutError, OSError, DeviceSSHError, pool.asyncssh.Error) as err:
+                reason = describe_error(pool.asyncssh, err)
+                pool.drop(mgmt_ipaddr)
+                if attempts <= args.retries:
+                    await asyncio.sleep(RETRY_BACKOFF * attempts)
+    return None, reason, attempts
+
+async def collect_all(targets, options, args, writer, report):
+    from STIG_Modules.device_ssh import SessionPool
+    pool = SessionPool(options, args.concurrency)
+    stats = collections.Counter()
+    failures = collections.Counter()
+
+    async def collect(devName, mgmt_ipaddr):
+        started = time.perf_counter()
+        config, reason, attempts = await collect_device(pool, devName, mgmt_ipaddr, args)
+        if config is None:
+            writer.device_failed(devName, mgmt_ipaddr, reason, attempts)
+            stats["failed"] += 1
+            failures[reason] += 1
+            report(f"   FAILED:     [{devName}]  ({mgmt_ipaddr}) {reason}")
+        else:
+            writer.device_collected(devName, mgmt_ipaddr, config, attempts, time.perf_counter() - started)
+            stats["collected"] += 1
+            stats["retried"] += attempts > 1
+            report(f"   COLLECTED:  [{devName}]  ({mgmt_ipaddr})")
+
+    try:
+        await asyncio.gather(*(collect(devName, mgmt_ipaddr) for devName, mgmt_ipaddr in targets))
+    finally:
+        await pool.close()
+    return stats, failures, pool.stats
+
+
+# ========================================================================================
+# Command line.
+# ========================================================================================
+
+def open_inventory(args, parser):
+    """
+    NOTE: The devices of the selected source, read the way Batch Mode reads them.
+    """
+    from STIG_Modules.batch_cli import open_client, open_source, parse_set_options
+    client = open_client(args)
+    try:
+        return list(open_source(args, parse_set_options(args.set_options, parser), client))
+    finally:
+        if client is not None:
+            client.close()
+
+def collect(args, argv, parser):
+    from STIG_Modules.config_delivery import DeliveryError, USERNAME_ENV, ssh_options
+    from STIG_Modules.device_ssh import DeviceSSHError, load_asyncssh
+    from STIG_Modules.device_schema import DeviceFileError
+    from STIG_Modules.inventory_adapters import InventoryError
+    if not args.username:
+        print(f"ERROR:\n   Give --username (or set {USERNAME_ENV}).\n")
+        return 1
+    try:
+        load_asyncssh()
+        targets, missing = inventory_targets(open_inventory(args, parser))
+        options = ssh_options(args)
+    except (DeviceFileError, InventoryError, OSError) as err:
+        print(f"\nERROR:\n   The device source could not be read. {err}\n\nEXITING SCRIPT...\n")
+        return 1
+    except (DeliveryError, DeviceSSHError, ValueError) as err:
+        print(f"ERROR:\n   {err}\n\nEXITING SCRIPT...\n")
+        return 1
+
+    run_id = make_run_id()
+    writer = CollectionWriter(os.path.join(args.output_dir, run_id), run_id, argv)
+    report = (lambda message: message.startswith("   FAILED") and print(message)) if args.quiet else print
+    print(f"\n___RUNNING-CONFIG COLLECTION___   run {run_id}, {len(targets)} devices\n")
+    for devName in missing:
+        writer.device_failed(devName, "", "no mgmt_ipaddr", 0)
+        report(f"   FAILED:     [{devName}]  no mgmt_ipaddr")
+    started = time.time()
+    stats = collections.Counter()
+    try:
+        stats, failures, pool_stats = asyncio.run(collect_all(targets, options, args, writer, report))
+    except KeyboardInterrupt:
+        writer.configsFile.close()
+        writer.indexFile.close()
+        print(f"\nInterrupted; the configs collected so far are in {writer.run_dir}")
+        return 130
+    writer.close(stats)
+    elapsed = time.time() - started
+    if missing:
+        stats["failed"] += len(missing)
+        failures["no mgmt_ipaddr"] += len(missing)
+
+    print("\n" + "#"*24 + "\n## COLLECTION SUMMARY ##\n" + "#"*24)
+    print(f"  Run ID:                    {run_id}")
+    print(f"  Devices read:              {len(targets) + len(missing)}")
+    print(f"  Configs collected:         {stats['collected']}   ({stats['retried']} after a retry)")
+    print(f"  Devices failed:            {stats['failed']}")
+    for reason, count in failures.most_common():
+        print(f"      {reason:<22} {count}")
+    print(f"  SSH connections:           {pool_stats['connections']}")
+    print(f"  Config data:               {writer.raw_bytes / 1e6:.1f} MB, {writer.offset / 1e6:.1f} MB compressed")
+    print(f"  Elapsed:                   {elapsed:.2f}s")
+    print(f"  Output location:           {writer.run_dir}")
+    return 0 if stats["failed"] == 0 else 2
+
+def main(argv=None):
+    import argparse
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(prog="python -m STIG_Modules.config_collector",
+                                     description="Collect the running config of every device in an inventory over SSH.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_collect = sub.add_parser("collect", help="collect 'show running-config' from every device")
+    source = p_collect.add_mutually_exclusive_group(required=True)
+    source.add_argument("--csv", metavar="FILE", help="a multi-device csv file (legacy or header layout)")
+    source.add_argument("--netbox", metavar="EXPORT_OR_URL", nargs="+",
+                        help="NetBox device export file(s) (JSON), or the /api/dcim/devices/ URL")
+    source.add_argument("--nautobot", metavar="EXPORT_OR_URL", nargs="+",
+                        help="Nautobot device export file(s) (JSON), or the /api/dcim/devices/ URL")
+    source.add_argument("--yaml", metavar="FILE", help="a YAML inventory file")
+    p_collect.add_argument("--token", default=os.environ.get("STIG_INVENTORY_TOKEN"),
+                           help="API token for a NetBox/Nautobot URL (default: $STIG_INVENTORY_TOKEN)")
+    p_collect.add_argument("--set", metavar="FIELD=VALUE", action="append", dest="set_options",
+                           help="default value for a device field the source does not provide (repeatable)")
+    p_collect.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR,
+                           help="where to create the collection (default: %(default)s)")
+    p_collect.add_argument("--username", default=os.environ.get("STIG_SSH_USERNAME"),
+                           help="SSH username (default: $STIG_SSH_USERNAME)")
+    p_collect.add_argument("--key", metavar="FILE", help="log in with this private key instead of a password")
+    p_collect.add_argument("--known-hosts", metavar="FILE", help="known hosts file (default: ~/.ssh/known_hosts)")
+    p_collect.add_argument("--no-host-key-check", action="store_true", help="do not check device host keys (lab only)")
+    p_collect.add_argument("--port", type=int, default=22)
+    p_collect.add_argument("--loopback", action="store_true",
+                           help="reach mgmt_ipaddr a.b.c.d at 127.b.c.d, where the local ssh_standin answers")
+    p_collect.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                           help="devices collected at once (default: %(default)s)")
+    p_collect.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                           help="seconds one attempt on a device may take, login included (default: %(default)s)")
+    p_collect.add_argument("--connect-timeout", type=float, default=20.0, help="seconds (default: %(default)s)")
+    p_collect.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                           help="extra attempts for a device that fails or times out (default: %(default)s)")
+    p_collect.add_argument("--quiet", action="store_true", help="only print failures and the summary")
+    p_collect.set_defaults(inventory_cache=None, cache_ttl=0, workers=8, parse_workers=1, parse_min_size=None)
+    p_show = sub.add_parser("show", help="print one device's config from a collection")
+    p_show.add_argument("run_dir")
+    p_show.add_argument("devName")
+    p_extract = sub.add_parser("extract", help="write every config of a collection to its own file")
+    p_extract.add_argument("run_dir")
+    p_extract.add_argument("--to", required=True, metavar="DIR", help="the directory to write RUNNING_Config_<devName> files to")
+    args = parser.parse_args(argv)
+
+    if args.command == "collect":
+        return collect(args, argv, parser)
+    try:
+        header, entries, footer = read_index(args.run_dir)
+    except CollectionError as err:
+        print(f"ERROR:\n   {err}\n")
+        return 1
+    if args.command == "show":
+        config = read_running_config(args.run_dir, args.devName, entries)
+        if config is None:
+            entry = entries.get(args.devName)
+            print(f"[{args.devName}] was not collected in this run" + (f" ({entry['reason']})." if entry else "."))
+            return 1
+        print(config)
+        return 0
+    os.makedirs(args.to, exist_ok=True)
+    written = 0
+    with open(os.path.join(args.run_dir, CONFIGS_FILE), "rb") as configsFile:
+        for devName, entry in entries.items():
+            if entry["status"] != "collected":
+                continue
+            configsFile.seek(entry["offset"])
+            with open(os.path.join(args.to, "RUNNING_Config_" + devName), "wb") as configFile:
+                configFile.write(gzip.decompress(configsFile.read(entry["length"])))
+            written += 1
+    print(f"Wrote {written} running configs to {args.to}" + ("" if footer else "  (the collection run did not finish)"))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
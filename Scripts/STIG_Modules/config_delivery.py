@@ -0,0 +1,469 @@
+"""
+TITLE:           config_delivery.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) Pushes the generated STIG configs to the devices over SSH, instead of
+                pasting every file into a console or VTY session by hand. It reads a
+                shard or fleet manifest (see shards.py) for the list of configs, checks
+                every config file against the SHA-256 in the manifest, and delivers it
+                to the device's mgmt_ipaddr.
+                2) Devices are worked on concurrently (--concurrency, asyncio), one SSH
+                session each. Every config is sent in configuration mode in chunks no
+                larger than --chunk-bytes, and the next chunk is only sent once the
+                device has answered every line of the previous one, so its input
+                buffer is never overrun. Lines the device rejects are captured.
+                3) The result for each device (delivered / rejected / failed / skipped,
+                why, the rejected lines and a compressed transcript of the session) is
+                stored per run in a local SQLite database. Failed devices of a run can
+                be delivered again with --only-failed.
+
+USAGE:          From the ./Scripts directory:
+                python STIG_config_builder.py --csv fleet.csv --shard 1/1      <--- writes the manifest
+                python -m STIG_Modules.config_delivery push --manifest Generated_Configs/STIG_shard_1_of_1.manifest.jsonl --username admin
+                python -m STIG_Modules.config_delivery push --manifest ... --only-failed <RUN_ID> --save
+                python -m STIG_Modules.config_delivery status <RUN_ID>
+                python -m STIG_Modules.config_delivery failed <RUN_ID>
+                python -m STIG_Modules.config_delivery transcript <RUN_ID> <devName>
+
+                Without hardware, against the local stand-in (ssh_standin.py):
+                python -m STIG_Modules.ssh_standin --port 2222
+                python -m STIG_Modules.config_delivery push --manifest ... --username admin --port 2222 --loopback --no-host-key-check
+
+NOTE:           Requires the asyncssh package (pip install asyncssh). The SSH password is
+                read from STIG_SSH_PASSWORD, or prompted for; --key logs in with a key
+                instead.
+                Configs that still hold [ReplaceThisValueWith:...] values are skipped
+                unless --allow-placeholders is given.
+                A device that fails part way through is sent its whole config again on
+                the next attempt; the STIG configs only hold commands that can be
+                applied twice.
+"""
+
+import asyncio, collections, hashlib, json, os, sqlite3, sys, time, zlib
+
+from STIG_Modules.output_store import make_run_id
+
+
+# Default location of the delivery database, relative to ./Scripts.
+DEFAULT_DELIVERY_DB = "./Generated_Configs/.stig_delivery.sqlite3"
+
+DEFAULT_CONCURRENCY = 64
+# Most IOS and NX-OS VTYs take a few KB of pasted input before dropping characters;
+# 1 KB chunks stay well clear of that.
+DEFAULT_CHUNK_BYTES = 1024
+DEFAULT_RETRIES = 2
+RETRY_BACKOFF = 2.0
+
+PASSWORD_ENV = "STIG_SSH_PASSWORD"
+USERNAME_ENV = "STIG_SSH_USERNAME"
+PLACEHOLDER = "[ReplaceThisValueWith:"
+NEXUS_SAVE_COMMAND = "copy running-config startup-config"
+IOS_SAVE_COMMAND = "write memory"
+
+# Pending results are committed after this many devices or seconds.
+COMMIT_EVERY = 200
+COMMIT_INTERVAL = 2.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id      TEXT PRIMARY KEY,
+    manifest    TEXT NOT NULL,
+    argv        TEXT NOT NULL,      -- JSON list of the push command line arguments
+    status      TEXT NOT NULL,      -- 'running', 'finished' or 'aborted'
+    started     REAL NOT NULL,
+    finished    REAL
+);
+CREATE TABLE IF NOT EXISTS deliveries (
+    run_id      TEXT NOT NULL,
+    devName     TEXT NOT NULL,
+    mgmt_ipaddr TEXT,
+    status      TEXT NOT NULL,      -- 'delivered', 'rejected', 'failed' or 'skipped'
+    reason      TEXT,
+    config_sha  TEXT,
+    attempts    INTEGER NOT NULL,
+    lines_sent  INTEGER NOT NULL,
+    rejected    TEXT,               -- JSON list of [config line, device reply]
+    transcript  BLOB,               -- zlib-compressed session output
+    seconds     REAL NOT NULL,
+    finished    REAL NOT NULL,
+    PRIMARY KEY (run_id, devName)
+);
+CREATE INDEX IF NOT EXISTS deliveries_by_status ON deliveries (run_id, status);
+"""
+
+DeliveryTarget = collections.namedtuple("DeliveryTarget", ("devName", "mgmt_ipaddr", "deviceType", "config_path",
+                                                           "sha256"))
+DeliveryResult = collections.namedtuple("DeliveryResult", ("status", "reason", "attempts", "lines_sent", "rejected",
+                                                           "transcript", "seconds"))
+
+
+class DeliveryError(ValueError):
+    pass
+
+
+def read_targets(manifest_path, configs_dir=None):
+    """
+    NOTE: Returns (targets, skipped) from a shard or fleet manifest. 'skipped' lists
+    (entry, reason) for devices that have nothing to deliver. A hostname listed twice
+    is delivered once, with its later entry.
+    """
+    from STIG_Modules.shards import read_manifest_lines
+    configs_dir = configs_dir or os.path.dirname(manifest_path) or "."
+    lines = list(read_manifest_lines(manifest_path))
+    if not lines or "format" not in lines[0]:
+        raise DeliveryError(f"{manifest_path} is not a shard or fleet manifest.")
+    if "merged" not in lines[0] and not lines[-1].get("complete"):
+        raise DeliveryError(f"{manifest_path} is from a Batch Mode run that did not finish.")
+    entries = {}
+    for entry in lines[1:]:
+        if "devName" in entry:
+            entries[entry["devName"]] = entry
+    targets, skipped = [], []
+    for devName, entry in entries.items():
+        if entry.get("status") != "done":
+            skipped.append((entry, f"not generated ({entry.get('reason', entry.get('status'))})"))
+        elif not entry.get("mgmt_ipaddr"):
+            skipped.append((entry, "no mgmt_ipaddr in the manifest"))
+        else:
+            targets.append(DeliveryTarget(devName, entry["mgmt_ipaddr"], entry.get("deviceType", ""),
+                                          os.path.join(configs_dir, os.path.basename(entry["file"])), entry["sha256"]))
+    return targets, skipped
+
+def read_config(target, allow_placeholders):
+    """
+    NOTE: Returns the config lines of a target, after checking the file is the one the
+    manifest lists.
+    """
+    try:
+        with open(target.config_path, "rb") as configFile:
+            data = configFile.read()
+    except OSError as err:
+        raise DeliveryError(f"config file unreadable ({err.strerror})") from None
+    if hashlib.sha256(data).hexdigest() != target.sha256:
+        raise DeliveryError("config file does not match the manifest")
+    text = data.decode("utf-8")
+    if not allow_placeholders and PLACEHOLDER in text:
+        raise DeliveryError("config still holds [ReplaceThisValueWith:...] values")
+    return text.splitlines()
+
+def save_command(deviceType):
+    from STIG_Modules.reference_data import NEXUS_DEVICE_TYPES
+    return NEXUS_SAVE_COMMAND if deviceType in NEXUS_DEVICE_TYPES else IOS_SAVE_COMMAND
+
+
+# ========================================================================================
+# Results.
+# ========================================================================================
+
+class DeliveryStore:
+
+    def __init__(self, db_path=DEFAULT_DELIVERY_DB, read_only=False):
+        self.db_path = db_path
+        if read_only:
+            self.db = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        else:
+            self.db = sqlite3.connect(db_path)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript(SCHEMA)
+        self.pending = []
+        self.last_commit = time.time()
+
+    def new_run(self, manifest_path, argv):
+        run_id = make_run_id()
+        self.db.execute("INSERT INTO runs (run_id, manifest, argv, status, started) VALUES (?, ?, ?, 'running', ?)",
+                        (run_id, manifest_path, json.dumps(list(argv)), time.time()))
+        self.db.commit()
+        return run_id
+
+    def record(self, run_id, devName, mgmt_ipaddr, config_sha, result):
+        self.pending.append((run_id, devName, mgmt_ipaddr, result.status, result.reason, config_sha, result.attempts,
+                             result.lines_sent, json.dumps(result.rejected) if result.rejected else None,
+                             zlib.compress(result.transcript.encode("utf-8")) if result.transcript else None,
+                             result.seconds, time.time()))
+        if len(self.pending) >= COMMIT_EVERY or time.time() - self.last_commit >= COMMIT_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        self.db.executemany("INSERT OR REPLACE INTO deliveries (run_id, devName, mgmt_ipaddr, status, reason, "
+                            "config_sha, attempts, lines_sent, rejected, transcript, seconds, finished) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self.pending)
+        self.db.commit()
+        self.pending = []
+        self.last_commit = time.time()
+
+    def finish_run(self, run_id, status):
+        self.flush()
+        self.db.execute("UPDATE runs SET status = ?, finished = ? WHERE run_id = ?", (status, time.time(), run_id))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def runs(self):
+        return self.db.execute("SELECT run_id, status, started, finished, manifest FROM runs ORDER BY started").fetchall()
+
+    def run_stats(self, run_id):
+        run = self.db.execute("SELECT status, started, finished, manifest FROM runs WHERE run_id = ?",
+                              (run_id,)).fetchone()
+        if run is None:
+            return None
+        counts = dict(self.db.execute("SELECT status, COUNT(*) FROM deliveries WHERE run_id = ? GROUP BY status",
+                                      (run_id,)).fetchall())
+        reasons = self.db.execute("SELECT reason, COUNT(*) FROM deliveries WHERE run_id = ? AND reason IS NOT NULL "
+                                  "GROUP BY reason ORDER BY 2 DESC", (run_id,)).fetchall()
+        return {"status": run[0], "started": run[1], "finished": run[2], "manifest": run[3], "counts": counts,
+                "reasons": reasons}
+
+    def failed_devices(self, run_id):
+        return self.db.execute("SELECT devName, status, reason, rejected FROM deliveries WHERE run_id = ? "
+                               "AND status != 'delivered' ORDER BY devName", (run_id,)).fetchall()
+
+    def transcript(self, run_id, devName):
+        row = self.db.execute("SELECT transcript FROM deliveries WHERE run_id = ? AND devName = ?",
+                              (run_id, devName)).fetchone()
+        if row is None:
+            return None
+        return zlib.decompress(row[0]).decode("utf-8") if row[0] else ""
+
+
+# ========================================================================================
+# Delivery.
+# ========================================================================================
+
+def describe_error(asyncssh, err):
+    """
+    NOTE: A short reason for a failed attempt, so failures group well in the summary.
+    """
+    if isinstance(err, asyncio.TimeoutError):
+        return "timed out"
+    if isinstance(err, asyncssh.PermissionDenied):
+        return "login failed"
+    if isinstance(err, asyncssh.HostKeyNotVerifiable):
+        return "host key not verifiable"
+    if isinstance(err, ConnectionRefusedError):
+        return "connection refused"
+    if isinstance(err, asyncssh.Error):
+        return f"ssh error ({err.reason})"
+    if isinstance(err, OSError):
+        return f"network error ({err.strerror or err})"
+    return str(err)
+
+async def deliver_device(pool, target, args):
+    """
+    NOTE: Delivers one config, retrying failed connections and stalled sessions up to
+    args.retries times. Returns a DeliveryResult.
+    """
+    from STIG_Modules.device_ssh import DeviceSSHError
+    started = time.perf_counter()
+    try:
+        lines = read_config(target, args.allow_placeholders)
+    except (DeliveryError, UnicodeDecodeError) as err:
+        return DeliveryResult("skipped", str(err), 0, 0, None, "", 0.0)
+    attempts, reason = 0, None
+    async with pool.device(target.mgmt_ipaddr):
+        while attempts <= args.retries:
+            attempts += 1
+            session = None
+            try:
+                session = await pool.session(target.mgmt_ipaddr)
+                transcript, rejected, sent = await session.push(lines, args.chunk_bytes)
+                if args.save and not rejected:
+                    command = save_command(target.deviceType)
+                    transcript += session.prompt + command + "\n" + await session.command(command)
+                status = "rejected" if rejected else "delivered"
+                reason = f"{len(rejected)} lines rejected" if rejected else None
+                return DeliveryResult(status, reason, attempts, sent, rejected, transcript,
+                                      time.perf_counter() - started)
+            except (asyncio.TimeoutError, OSError, DeviceSSHError, pool.asyncssh.Error) as err:
+                reason = describe_error(pool.asyncssh, err)
+                if isinstance(err, (pool.asyncssh.PermissionDenied, pool.asyncssh.HostKeyNotVerifiable)):
+                    pool.drop(target.mgmt_ipaddr)
+                if attempts <= args.retries:
+                    await asyncio.sleep(RETRY_BACKOFF * attempts)
+            finally:
+                if session is not None:
+                    session.close()
+    return DeliveryResult("failed", reason, attempts, 0, None, "", time.perf_counter() - started)
+
+async def deliver_all(targets, options, args, store, run_id, report):
+    from STIG_Modules.device_ssh import SessionPool
+    pool = SessionPool(options, args.concurrency)
+    stats = collections.Counter()
+    failures = collections.Counter()
+
+    async def deliver(target):
+        result = await deliver_device(pool, target, args)
+        store.record(run_id, target.devName, target.mgmt_ipaddr, target.sha256, result)
+        stats[result.status] += 1
+        if result.status == "delivered":
+            report(f"   DELIVERED:  [{target.devName}]  ({target.mgmt_ipaddr}, {result.lines_sent} lines, "
+                   f"{result.seconds:.1f}s)")
+        else:
+            failures[result.reason if result.status != "rejected" else "lines rejected"] += 1
+            report(f"   FAILED:     [{target.devName}]  ({target.mgmt_ipaddr}) {result.status}: {result.reason}")
+
+    try:
+        await asyncio.gather(*(deliver(target) for target in targets))
+    finally:
+        await pool.close()
+    return stats, failures, pool.stats
+
+
+# ========================================================================================
+# Command line.
+# ========================================================================================
+
+def ssh_options(args):
+    from STIG_Modules.device_ssh import SSHOptions
+    password = None
+    if not args.key:
+        password = os.environ.get(PASSWORD_ENV)
+        if password is None:
+            if not sys.stdin.isatty():
+                raise DeliveryError(f"Set {PASSWORD_ENV} (or use --key); there is no terminal to prompt on.")
+            import getpass
+            password = getpass.getpass(f"SSH password for {args.username}: ")
+    known_hosts = None if args.no_host_key_check else (args.known_hosts if args.known_hosts else ())
+    return SSHOptions(args.username, password, client_keys=[args.key] if args.key else None, known_hosts=known_hosts,
+                      port=args.port, connect_timeout=args.connect_timeout, command_timeout=args.timeout,
+                      loopback=args.loopback)
+
+def push(args, argv):
+    from STIG_Modules.device_ssh import DeviceSSHError, load_asyncssh
+    if not args.username:
+        print(f"ERROR:\n   Give --username (or set {USERNAME_ENV}).\n")
+        return 1
+    try:
+        load_asyncssh()
+        targets, skipped = read_targets(args.manifest, args.configs)
+        options = ssh_options(args)
+    except (DeliveryError, DeviceSSHError, OSError, ValueError) as err:
+        print(f"ERROR:\n   {err}\n\nEXITING SCRIPT...\n")
+        return 1
+    store = DeliveryStore(args.db)
+    if args.only_failed:
+        retry = {row[0] for row in store.failed_devices(args.only_failed)}
+        targets = [target for target in targets if target.devName in retry]
+        skipped = [(entry, reason) for entry, reason in skipped if entry["devName"] in retry]
+
+    report = (lambda message: message.startswith("   FAILED") and print(message)) if args.quiet else print
+    run_id = store.new_run(args.manifest, argv)
+    print(f"\n___CONFIG DELIVERY___   run {run_id}, {len(targets)} devices\n")
+    for entry, reason in skipped:
+        store.record(run_id, entry["devName"], entry.get("mgmt_ipaddr"), entry.get("sha256"),
+                     DeliveryResult("skipped", reason, 0, 0, None, "", 0.0))
+        report(f"   FAILED:     [{entry['devName']}]  skipped: {reason}")
+    started = time.time()
+    status = "aborted"
+    try:
+        stats, failures, pool_stats = asyncio.run(deliver_all(targets, options, args, store, run_id, report))
+        status = "finished"
+    except KeyboardInterrupt:
+        print("\nInterrupted; the devices finished so far are recorded.")
+        return 130
+    finally:
+        store.finish_run(run_id, status)
+        store.close()
+    elapsed = time.time() - started
+    stats["skipped"] += len(skipped)
+    for entry, reason in skipped:
+        failures[reason.split(" (")[0]] += 1
+
+    print("\n" + "#"*22 + "\n## DELIVERY SUMMARY ##\n" + "#"*22)
+    print(f"  Run ID:                    {run_id}")
+    print(f"  Devices in manifest:       {len(targets) + len(skipped)}")
+    print(f"  Configs delivered:         {stats['delivered']}")
+    print(f"  Configs with rejections:   {stats['rejected']}")
+    print(f"  Devices failed:            {stats['failed']}")
+    print(f"  Devices skipped:           {stats['skipped']}")
+    for reason, count in failures.most_common():
+        print(f"      {reason:<22} {count}")
+    print(f"  SSH connections:           {pool_stats['connections']} ({pool_stats['sessions']} sessions)")
+    print(f"  Elapsed:                   {elapsed:.2f}s  ({len(targets) / elapsed * 3600 if elapsed else 0:.0f} devices/hour)")
+    print(f"  Results:                   {args.db}")
+    return 0 if stats["delivered"] == len(targets) + len(skipped) else 2
+
+def main(argv=None):
+    import argparse
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(prog="python -m STIG_Modules.config_delivery",
+                                     description="Push generated STIG configs to the devices over SSH.")
+    parser.add_argument("--db", default=DEFAULT_DELIVERY_DB, help="the delivery database (default: %(default)s)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_push = sub.add_parser("push", help="deliver the configs listed in a manifest")
+    p_push.add_argument("--manifest", required=True, help="a shard manifest (.manifest.jsonl) or fleet manifest")
+    p_push.add_argument("--configs", metavar="DIR", help="where the config files are (default: the manifest's directory)")
+    p_push.add_argument("--username", default=os.environ.get(USERNAME_ENV),
+                        help=f"SSH username (default: ${USERNAME_ENV})")
+    p_push.add_argument("--key", metavar="FILE", help="log in with this private key instead of a password")
+    p_push.add_argument("--known-hosts", metavar="FILE", help="known hosts file (default: ~/.ssh/known_hosts)")
+    p_push.add_argument("--no-host-key-check", action="store_true", help="do not check device host keys (lab only)")
+    p_push.add_argument("--port", type=int, default=22)
+    p_push.add_argument("--loopback", action="store_true",
+                        help="reach mgmt_ipaddr a.b.c.d at 127.b.c.d, where the local ssh_standin answers")
+    p_push.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="devices worked on at once (default: %(default)s)")
+    p_push.add_argument("--chunk-bytes", type=int, default=DEFAULT_CHUNK_BYTES,
+                        help="most config bytes sent before waiting for the device (default: %(default)s)")
+    p_push.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                        help="extra attempts for a device that cannot be reached or stalls (default: %(default)s)")
+    p_push.add_argument("--connect-timeout", type=float, default=20.0, help="seconds (default: %(default)s)")
+    p_push.add_argument("--timeout", type=float, default=60.0,
+                        help="seconds to wait for a device to answer a chunk (default: %(default)s)")
+    p_push.add_argument("--save", action="store_true", help="save the running config to startup after delivery")
+    p_push.add_argument("--allow-placeholders", action="store_true",
+                        help="also deliver configs that still hold [ReplaceThisValueWith:...] values")
+    p_push.add_argument("--only-failed", metavar="RUN_ID", help="only deliver the devices that were not delivered in RUN_ID")
+    p_push.add_argument("--quiet", action="store_true", help="only print failures and the summary")
+    sub.add_parser("list", help="list every delivery run")
+    p_status = sub.add_parser("status", help="show the results of a run")
+    p_status.add_argument("run_id")
+    p_failed = sub.add_parser("failed", help="list the devices of a run that were not delivered")
+    p_failed.add_argument("run_id")
+    p_transcript = sub.add_parser("transcript", help="print the SSH session of one device")
+    p_transcript.add_argument("run_id")
+    p_transcript.add_argument("devName")
+    args = parser.parse_args(argv)
+
+    if args.command == "push":
+        return push(args, argv)
+    if not os.path.isfile(args.db):
+        print(f"No delivery database at [{args.db}].")
+        return 1
+    store = DeliveryStore(args.db, read_only=True)
+    try:
+        if args.command == "list":
+            for run_id, status, started, finished, manifest in store.runs():
+                print(f"{run_id}  {status:<9} {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started))}  {manifest}")
+            return 0
+        if args.command == "transcript":
+            transcript = store.transcript(args.run_id, args.devName)
+            if transcript is None:
+                print(f"No device [{args.devName}] in run [{args.run_id}].")
+                return 1
+            print(transcript)
+            return 0
+        stats = store.run_stats(args.run_id)
+        if stats is None:
+            print(f"Run [{args.run_id}] was not found in [{args.db}].")
+            return 1
+        if args.command == "failed":
+            for devName, status, reason, rejected in store.failed_devices(args.run_id):
+                print(f"{devName:<30} {status:<9} {reason}")
+                for line, reply in json.loads(rejected) if rejected else []:
+                    print(f"      {line}\n          {reply}")
+            return 0
+        print(f"Run:              {args.run_id}   ({stats['status']})")
+        print(f"Manifest:         {stats['manifest']}")
+        for status in ("delivered", "rejected", "failed", "skipped"):
+            print(f"{status.capitalize() + ':':<18}{stats['counts'].get(status, 0)}")
+        for reason, count in stats["reasons"]:
+            print(f"    {reason:<22} {count}")
+        return 0
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,292 @@
+"""
+TITLE:           config_history.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) Keeps every generation of every generated STIG config without storing
+                a full copy per run. The newest config for each device is kept
+                compressed, and each generation is recorded as a compact line delta
+                against the generation before it.
+                2) Answers the two questions asked after every baseline change quickly,
+                using indexes instead of reading the whole history:
+                - What changed for device X between run A and run B?
+                - Which devices changed in run N?
+
+USAGE:          From the ./Scripts directory:
+                python -m STIG_Modules.config_history runs
+                python -m STIG_Modules.config_history changed <RUN_ID>
+                python -m STIG_Modules.config_history history <devName>
+                python -m STIG_Modules.config_history show <devName> <RUN_ID>
+                python -m STIG_Modules.config_history diff <devName> <RUN_ID_A> <RUN_ID_B>
+
+NOTE:           A full (keyframe) copy is stored every KEYFRAME_INTERVAL generations, or
+                whenever a delta would be larger than the config itself, so rebuilding an
+                old generation never needs to replay more than a handful of deltas.
+"""
+
+import difflib, hashlib, json, os, sqlite3, sys, time, zlib
+
+from STIG_Modules.output_store import make_run_id
+
+
+# Default location of the history database, relative to ./Scripts.
+DEFAULT_HISTORY_DB = "./Generated_Configs/.stig_history.sqlite3"
+
+# A full copy is stored at least this often per device.
+KEYFRAME_INTERVAL = 20
+
+# Pending writes are committed in batches of this many devices.
+COMMIT_EVERY = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id      TEXT PRIMARY KEY,
+    started     REAL NOT NULL,
+    finished    REAL
+);
+CREATE TABLE IF NOT EXISTS generations (
+    hostname    TEXT NOT NULL,
+    seq         INTEGER NOT NULL,
+    run_id      TEXT NOT NULL,
+    sha256      TEXT NOT NULL,
+    kind        TEXT NOT NULL,      -- 'full', 'delta' or 'same'
+    changed     INTEGER NOT NULL,
+    payload     BLOB,
+    PRIMARY KEY (hostname, seq)
+);
+CREATE INDEX IF NOT EXISTS generations_by_run ON generations (run_id, changed);
+CREATE UNIQUE INDEX IF NOT EXISTS generations_by_host_run ON generations (hostname, run_id);
+CREATE TABLE IF NOT EXISTS heads (
+    hostname    TEXT PRIMARY KEY,
+    seq         INTEGER NOT NULL,
+    sha256      TEXT NOT NULL,
+    since_full  INTEGER NOT NULL,
+    text_z      BLOB NOT NULL
+);
+"""
+
+
+# ========================================================================================
+# Line delta encoding.
+# ========================================================================================
+
+def make_delta(old_lines, new_lines):
+    """
+    NOTE: Only the non-matching regions are kept: [start, end, [replacement lines]]
+    against the old generation. Unchanged lines cost nothing.
+    """
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    ops = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != "equal":
+            ops.append([i1, i2, new_lines[j1:j2]])
+    return ops
+
+def apply_delta(old_lines, ops):
+    new_lines = []
+    position = 0
+    for start, end, replacement in ops:
+        new_lines.extend(old_lines[position:start])
+        new_lines.extend(replacement)
+        position = end
+    new_lines.extend(old_lines[position:])
+    return new_lines
+
+def pack(value):
+    return zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"), 6)
+
+def unpack(payload):
+    return json.loads(zlib.decompress(payload).decode("utf-8"))
+
+
+class ConfigHistory:
+
+    def __init__(self, db_path=DEFAULT_HISTORY_DB, run_id=None, read_only=False):
+        self.db_path = db_path
+        self.run_id = run_id or make_run_id()
+        self.run_ids = [self.run_id]
+        self.pending = 0
+        if read_only:
+            self.conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+            return
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript(SCHEMA)
+        self.conn.execute("INSERT OR IGNORE INTO runs (run_id, started) VALUES (?, ?)",
+                          (self.run_id, time.time()))
+        self.conn.commit()
+
+    def new_run(self, run_id):
+        """
+        NOTE: Ends the current run and records from now on under 'run_id'. A process
+        that renders the same device more than once (the webhook receiver) starts a
+        run per batch, as only one generation per device is kept in each run.
+        """
+        now = time.time()
+        self.conn.execute("UPDATE runs SET finished = ? WHERE run_id = ?", (now, self.run_id))
+        self.conn.execute("INSERT OR IGNORE INTO runs (run_id, started) VALUES (?, ?)", (run_id, now))
+        self.commit()
+        self.run_id = run_id
+        self.run_ids.append(run_id)
+
+    # ====================================================================================
+    # Recording generations.
+    # ====================================================================================
+
+    def record(self, devName, output):
+        """
+        NOTE: Adds this run's config for devName to the history. Returns True if the
+        config differs from the device's previous generation.
+        """
+        digest = hashlib.sha256(output.encode("utf-8")).hexdigest()
+        lines = output.splitlines(keepends=True)
+        text_z = pack(lines)
+        head = self.conn.execute("SELECT seq, sha256, since_full, text_z FROM heads WHERE hostname = ?",
+                                 (devName,)).fetchone()
+        # The same run can be replayed (e.g. a resumed batch); keep the first entry.
+        if self.conn.execute("SELECT 1 FROM generations WHERE hostname = ? AND run_id = ?",
+                             (devName, self.run_id)).fetchone():
+            return head is None or head[1] != digest
+
+        if head is None:
+            seq, kind, changed, payload, since_full = 1, "full", 1, text_z, 0
+        else:
+            head_seq, head_digest, head_since_full, head_text_z = head
+            seq = head_seq + 1
+            if head_digest == digest:
+                kind, changed, payload, since_full = "same", 0, None, head_since_full
+            else:
+                changed = 1
+                delta_payload = pack(make_delta(unpack(head_text_z), lines))
+                if head_since_full + 1 >= KEYFRAME_INTERVAL or len(delta_payload) >= len(text_z):
+                    kind, payload, since_full = "full", text_z, 0
+                else:
+                    kind, payload, since_full = "delta", delta_payload, head_since_full + 1
+
+        self.conn.execute("INSERT INTO generations (hostname, seq, run_id, sha256, kind, changed, payload) "
+                          "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                          (devName, seq, self.run_id, digest, kind, changed, payload))
+        self.conn.execute("INSERT OR REPLACE INTO heads (hostname, seq, sha256, since_full, text_z) "
+                          "VALUES (?, ?, ?, ?, ?)",
+                          (devName, seq, digest, since_full, text_z))
+        self.pending += 1
+        if self.pending >= COMMIT_EVERY:
+            self.commit()
+        return bool(changed)
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        self.conn.execute("UPDATE runs SET finished = ? WHERE run_id = ?", (time.time(), self.run_id))
+        self.commit()
+        self.conn.close()
+
+    # ====================================================================================
+    # Queries.
+    # ====================================================================================
+
+    def runs(self):
+        return self.conn.execute(
+            "SELECT r.run_id, r.started, r.finished, "
+            "(SELECT COUNT(*) FROM generations g WHERE g.run_id = r.run_id), "
+            "(SELECT COUNT(*) FROM generations g WHERE g.run_id = r.run_id AND g.changed = 1) "
+            "FROM runs r ORDER BY r.run_id").fetchall()
+
+    def changed_in_run(self, run_id):
+        rows = self.conn.execute("SELECT hostname FROM generations WHERE run_id = ? AND changed = 1 "
+                                 "ORDER BY hostname", (run_id,))
+        return [row[0] for row in rows]
+
+    def device_history(self, devName):
+        return self.conn.execute("SELECT seq, run_id, sha256, kind, changed FROM generations "
+                                 "WHERE hostname = ? ORDER BY seq", (devName,)).fetchall()
+
+    def config_at(self, devName, run_id):
+        """
+        NOTE: Rebuilds the config devName received in run_id, starting from the nearest
+        full copy at or before that generation and replaying the deltas after it.
+        """
+        row = self.conn.execute("SELECT seq FROM generations WHERE hostname = ? AND run_id = ?",
+                                (devName, run_id)).fetchone()
+        if row is None:
+            return None
+        target_seq = row[0]
+        base_seq = self.conn.execute("SELECT MAX(seq) FROM generations WHERE hostname = ? AND seq <= ? "
+                                     "AND kind = 'full'", (devName, target_seq)).fetchone()[0]
+        lines = None
+        for kind, payload in self.conn.execute("SELECT kind, payload FROM generations WHERE hostname = ? "
+                                               "AND seq BETWEEN ? AND ? ORDER BY seq",
+                                               (devName, base_seq, target_seq)):
+            if kind == "full":
+                lines = unpack(payload)
+            elif kind == "delta":
+                lines = apply_delta(lines, unpack(payload))
+        return "".join(lines)
+
+    def diff(self, devName, run_a, run_b):
+        old = self.config_at(devName, run_a)
+        new = self.config_at(devName, run_b)
+        if old is None or new is None:
+            return None
+        return "".join(difflib.unified_diff(old.splitlines(keepends=True), new.splitlines(keepends=True),
+                                            fromfile=f"{devName}@{run_a}", tofile=f"{devName}@{run_b}"))
+
+
+# ========================================================================================
+# Command line queries.
+# ========================================================================================
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m STIG_Modules.config_history",
+                                     description="Query the history of generated STIG configs.")
+    parser.add_argument("--db", default=DEFAULT_HISTORY_DB, help="path to the history database")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("runs", help="list every recorded run")
+    p_changed = sub.add_parser("changed", help="list the devices whose config changed in a run")
+    p_changed.add_argument("run_id")
+    p_history = sub.add_parser("history", help="list every generation recorded for a device")
+    p_history.add_argument("devName")
+    p_show = sub.add_parser("show", help="print the config a device received in a run")
+    p_show.add_argument("devName")
+    p_show.add_argument("run_id")
+    p_diff = sub.add_parser("diff", help="show what changed for a device between two runs")
+    p_diff.add_argument("devName")
+    p_diff.add_argument("run_a")
+    p_diff.add_argument("run_b")
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(args.db):
+        print(f"No history database was found at: {args.db}")
+        return 1
+    history = ConfigHistory(args.db, read_only=True)
+    if args.command == "runs":
+        for run_id, started, finished, devices, changed in history.runs():
+            status = "complete" if finished else "incomplete"
+            print(f"{run_id}   devices: {devices:<8} changed: {changed:<8} ({status})")
+    elif args.command == "changed":
+        for hostname in history.changed_in_run(args.run_id):
+            print(hostname)
+    elif args.command == "history":
+        for seq, run_id, digest, kind, changed in history.device_history(args.devName):
+            print(f"{seq:>5}  {run_id}  {digest[:12]}  {'CHANGED' if changed else 'same'}")
+    elif args.command == "show":
+        output = history.config_at(args.devName, args.run_id)
+        if output is None:
+            print(f"[{args.devName}] has no config recorded for run {args.run_id}")
+            return 1
+        sys.stdout.write(output)
+    elif args.command == "diff":
+        output = history.diff(args.devName, args.run_a, args.run_b)
+        if output is None:
+            print(f"[{args.devName}] is missing from run {args.run_a} or run {args.run_b}")
+            return 1
+        sys.stdout.write(output or f"No changes for [{args.devName}] between the two runs.\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
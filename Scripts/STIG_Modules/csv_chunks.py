@@ -0,0 +1,285 @@
+"""
+TITLE:           csv_chunks.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) Reads very large multi-device csv files (full-estate CMDB exports of
+                several GB) with every CPU instead of one csv.reader. The file is
+                memory-mapped and split into byte ranges of about CHUNK_SIZE that each
+                end on a record boundary, and the ranges are parsed by a pool of worker
+                processes into DeviceRecords, in file order.
+                2) A record boundary is a line break outside of any quoted field. Whether
+                a position is inside quotes follows from the number of '"' characters
+                in front of it (odd = inside, since an escaped quote is written ""), so
+                the split takes two passes over the map:
+                - every worker counts the quotes of one rough range (at memory speed),
+                - each rough split point is then moved forward to the next line break
+                  outside quotes, looking only at the few bytes in between.
+                3) Workers are sent byte offsets, not data: each one maps the file itself
+                and decodes and parses only its own range. Only the parsed rows are sent
+                back, a few chunks ahead of the batch loop, which maps each row to a
+                DeviceRecord (one itemgetter call) as run_batch() asks for it.
+                4) That last step stays in the parent: the Extras namedtuple of a file's
+                header only exists there, and DeviceRecords cost more to send back than
+                to build. Splitting the rows and mapping them is about 2/3 of the work
+                of read_device_file(), so the parser reads a file at most about 1.5x
+                faster, however many workers it has.
+
+USAGE:          From the ./Scripts directory:
+                python STIG_config_builder.py --csv estate_export.csv --parse-workers 8
+                python -m STIG_Modules.csv_chunks estate_export.csv       <--- parse only, and time it
+
+NOTE:           Files smaller than 'csv_parallel_min_size', and every file when only one
+                worker would be used (--parse-workers 1, or one CPU), are read with
+                read_device_file() as before. A csv file that uses a quote character inside an UNquoted field
+                (not valid RFC 4180) may be split in the wrong place; parse such files
+                with --parse-workers 1. Any error in the file is reported exactly as
+                read_device_file() reports it.
+"""
+
+import collections, csv, io, itertools, mmap, os, sys, time
+
+from STIG_Modules.device_schema import (SCHEMA_MARKER, SCHEMA_VERSION, DeviceFileError, SchemaMapper,
+                                        looks_like_header, read_device_file)
+
+
+CHUNK_SIZE = 32 * 1024 * 1024
+DEFAULT_PARALLEL_MIN_SIZE = 64 * 1024 * 1024
+QUOTE = b'"'
+NEWLINE = b"\n"
+ENCODING = "utf-8"
+
+# Parsed rows go back to the parent as ONE string per chunk, fields joined by the ASCII
+# unit separator and rows by the record separator: a single string is copied between
+# processes at memory speed and split at C speed, where a list of row lists costs more
+# to pickle and unpickle than parsing the csv again. A chunk that contains either
+# character goes back as a list of rows instead.
+FIELD_SEPARATOR = "\x1f"
+ROW_SEPARATOR = "\x1e"
+
+
+def map_file(path):
+    """
+    NOTE: A read-only map of the whole file, or None for an empty file (which cannot be
+    mapped).
+    """
+    with open(path, "rb") as csvFile:
+        if os.fstat(csvFile.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(csvFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+def record_end(csv_map, position, in_quotes=False):
+    """
+    NOTE: The offset just past the first line break at or after 'position' that is
+    outside quotes ('in_quotes' is the state at 'position'), or the end of the map.
+    """
+    while True:
+        newline = csv_map.find(NEWLINE, position)
+        if newline < 0:
+            return len(csv_map)
+        if csv_map[position:newline].count(QUOTE) % 2:
+            in_quotes = not in_quotes
+        if not in_quotes:
+            return newline + 1
+        position = newline + 1
+
+def parse_row(data):
+    rows = list(csv.reader(io.StringIO(data.decode(ENCODING), newline="")))
+    return rows[0] if rows else []
+
+def is_blank(row):
+    return not row or (len(row) == 1 and not row[0].strip())
+
+def read_header(csv_map):
+    """
+    NOTE: Reads the leading rows the way read_device_file() does (blank rows, the
+    optional schema marker, the header). Returns (header or None, version, offset of
+    the first data row).
+    """
+    version = SCHEMA_VERSION
+    position = 0
+    while position < len(csv_map):
+        end = record_end(csv_map, position)
+        row = parse_row(csv_map[position:end])
+        if is_blank(row):
+            position = end
+            continue
+        if row[0].startswith(SCHEMA_MARKER):
+            try:
+                version = int(row[0][len(SCHEMA_MARKER):])
+            except ValueError:
+                version = None
+            if version is None or version > SCHEMA_VERSION:
+                # Let read_device_file() report it.
+                return None, None, None
+            position = end
+            continue
+        if looks_like_header(row):
+            return row, version, end
+        return None, version, position
+    return None, version, position
+
+
+# ========================================================================================
+# Worker processes.
+# ========================================================================================
+
+worker_maps = {}
+
+def worker_map(path):
+    csv_map = worker_maps.get(path)
+    if csv_map is None:
+        csv_map = worker_maps[path] = map_file(path)
+    return csv_map
+
+def count_quotes(path, start, end):
+    return worker_map(path)[start:end].count(QUOTE)
+
+def parse_range(path, start, end, width, legacy=False):
+    """
+    NOTE: The non-blank rows in bytes start:end (see FIELD_SEPARATOR), or None if any
+    row does not have 'width' values, or at least 'width' for a legacy file (the
+    parent then reports it with
+    read_device_file()). The rows go back as text, not DeviceRecords: the Extras
+    namedtuple of a file's header only exists in the parent, which maps each row with
+    SchemaMapper.map_row().
+    """
+    text = worker_map(path)[start:end].decode(ENCODING)
+    rows = []
+    try:
+        for row in csv.reader(io.StringIO(text, newline="")):
+            if len(row) == width or (legacy and len(row) > width):
+                rows.append(row)
+            elif not is_blank(row):
+                return None
+    except csv.Error:
+        return None
+    if FIELD_SEPARATOR in text or ROW_SEPARATOR in text:
+        return rows
+    return ROW_SEPARATOR.join([FIELD_SEPARATOR.join(row) for row in rows])
+
+def chunk_rows(parsed):
+    if not isinstance(parsed, str):
+        return parsed
+    if not parsed:
+        return []
+    return (line.split(FIELD_SEPARATOR) for line in parsed.split(ROW_SEPARATOR))
+
+
+# ========================================================================================
+# Reading.
+# ========================================================================================
+
+def split_ranges(path, csv_map, start, chunk_size, pool):
+    """
+    NOTE: [(start, end), ...] byte ranges from 'start' to the end of the map, each
+    ending on a record boundary.
+    """
+    size = len(csv_map)
+    rough = list(range(start, size, chunk_size)) + [size]
+    counts = list(pool.map(count_quotes, itertools.repeat(path), rough[:-1], rough[1:]))
+    boundaries = [start]
+    quotes_before = 0
+    for index in range(1, len(rough) - 1):
+        quotes_before += counts[index - 1]
+        boundary = record_end(csv_map, rough[index], quotes_before % 2 == 1)
+        if boundary > boundaries[-1] and boundary < size:
+            boundaries.append(boundary)
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+def read_device_chunks(path, workers=None, chunk_size=CHUNK_SIZE, min_size=DEFAULT_PARALLEL_MIN_SIZE, stats=None):
+    """
+    NOTE: Yields the same DeviceRecords as read_device_file() for the file at 'path',
+    parsed by 'workers' processes (default: one per CPU) when the file is at least
+    'min_size' bytes and there is more than one worker (a pool of one is slower than
+    read_device_file()). 'stats', if given, gets the number of chunks and the time the
+    batch loop spent waiting on the parser.
+    """
+    workers = workers or os.cpu_count() or 1
+    csv_map = map_file(path) if workers > 1 else None
+    mapper = None
+    if csv_map is not None and len(csv_map) >= min_size:
+        header, version, data_start = read_header(csv_map)
+        if data_start is not None:
+            try:
+                mapper = SchemaMapper(header, version) if header is not None else SchemaMapper()
+            except DeviceFileError:
+                mapper = None
+    if mapper is None:
+        if csv_map is not None:
+            csv_map.close()
+        with open(path, newline="") as inputFile:
+            yield from read_device_file(inputFile)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    if stats is not None:
+        stats.update(chunks=0, parse_wait=0.0)
+    yielded = 0
+    pool = ProcessPoolExecutor(workers)
+    try:
+        ranges = iter(split_ranges(path, csv_map, data_start, chunk_size, pool))
+        pending = collections.deque()
+        # Parse a few chunks ahead of the consumer, not the whole file at once.
+        for start, end in itertools.islice(ranges, workers * 2):
+            pending.append(pool.submit(parse_range, path, start, end, mapper.width, mapper.legacy))
+        while pending:
+            started = time.perf_counter()
+            parsed = pending.popleft().result()
+            if stats is not None:
+                stats["chunks"] += 1
+                stats["parse_wait"] += time.perf_counter() - started
+            for start, end in itertools.islice(ranges, 1):
+                pending.append(pool.submit(parse_range, path, start, end, mapper.width, mapper.legacy))
+            if parsed is None:
+                break
+            map_row = mapper.map_row
+            for row in chunk_rows(parsed):
+                yield map_row(row)
+                yielded += 1
+        else:
+            return
+    finally:
+        pool.shutdown(cancel_futures=True)
+        csv_map.close()
+    # A chunk had an invalid row: read the file again up to it for the usual error.
+    with open(path, newline="") as inputFile:
+        yield from itertools.islice(read_device_file(inputFile), yielded, None)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m STIG_Modules.csv_chunks",
+                                     description="Parse a multi-device csv file in parallel chunks and time it.")
+    parser.add_argument("path", help="multi-device csv file")
+    parser.add_argument("--workers", type=int, help="parser processes (default: one per CPU)")
+    parser.add_argument("--chunk-mb", type=int, default=CHUNK_SIZE // (1024 * 1024),
+                        help="rough chunk size in MB (default: %(default)s)")
+    parser.add_argument("--compare", action="store_true", help="also parse with read_device_file() and compare")
+    args = parser.parse_args(argv)
+
+    stats = {}
+    started = time.perf_counter()
+    try:
+        records = list(read_device_chunks(args.path, args.workers, args.chunk_mb * 1024 * 1024, 0, stats))
+    except (DeviceFileError, OSError) as err:
+        print(f"ERROR:\n   {err}\n")
+        return 1
+    elapsed = time.perf_counter() - started
+    size = os.path.getsize(args.path)
+    print(f"  Devices read:              {len(records)}")
+    print(f"  Chunks:                    {stats.get('chunks', 0)}")
+    print(f"  Parse time:                {elapsed:.2f}s  ({size / max(elapsed, 1e-9) / 1e6:.0f} MB/s)")
+    print(f"  Waiting on the workers:    {stats.get('parse_wait', 0.0):.2f}s")
+    if args.compare:
+        started = time.perf_counter()
+        with open(args.path, newline="") as inputFile:
+            serial = list(read_device_file(inputFile))
+        print(f"  read_device_file():        {time.perf_counter() - started:.2f}s")
+        print(f"  Same records:              {'yes' if serial == records else 'NO'}")
+        return 0 if serial == records else 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
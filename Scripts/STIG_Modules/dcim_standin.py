@@ -0,0 +1,118 @@
+"""
+TITLE:           dcim_standin.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) A small local stand-in for the NetBox/Nautobot device API, used to try out
+                Batch Mode's URL source (inventory_client.py) without a real DCIM.
+                It serves a device export file (JSON) at /api/dcim/devices/ and supports
+                what the client uses: limit/offset paging, ?brief=1, ?last_updated__gte=,
+                keep-alive connections, gzip, and ETag / If-None-Match.
+                2) The export file is re-read whenever it changes on disk, so edits to it
+                show up as changed devices on the next pull.
+
+USAGE:          From the ./Scripts directory:
+                python -m STIG_Modules.dcim_standin netbox_devices.json --port 8080
+"""
+
+import argparse, gzip, hashlib, http.server, json, os, threading
+from urllib.parse import urlsplit, parse_qs
+
+from STIG_Modules.inventory_adapters import iter_json_array
+
+
+class DeviceSource:
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self.devices = []
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def current(self):
+        with self.lock:
+            self.requests += 1
+            mtime = os.stat(self.path).st_mtime
+            if mtime != self.mtime:
+                with open(self.path) as jsonFile:
+                    devices = list(iter_json_array(jsonFile))
+                for number, device in enumerate(devices, start=1):
+                    device.setdefault("id", number)
+                self.devices, self.mtime = devices, mtime
+            return self.devices
+
+
+class StandinHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"       # keep-alive
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if not parts.path.rstrip("/").endswith("/dcim/devices"):
+            self.send_body(404, b'{"detail": "Not found."}')
+            return
+        query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        devices = self.server.source.current()
+        since = query.get("last_updated__gte")
+        if since:
+            devices = [device for device in devices if (device.get("last_updated") or "") >= since]
+        if query.get("brief"):
+            devices = [{"id": device.get("id"), "name": device.get("name")} for device in devices]
+        limit = int(query.get("limit", 50))
+        offset = int(query.get("offset", 0))
+        body = json.dumps({"count": len(devices), "next": None, "previous": None,
+                           "results": devices[offset:offset + limit]}).encode("utf-8")
+
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        headers = {"ETag": etag}
+        if "gzip" in (self.headers.get("Accept-Encoding") or ""):
+            body = gzip.compress(body, 5)
+            headers["Content-Encoding"] = "gzip"
+        self.send_body(200, body, headers)
+
+    def send_body(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m STIG_Modules.dcim_standin",
+                                     description="Serve a NetBox/Nautobot device export as a local device API.")
+    parser.add_argument("export", help="device export file (JSON)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args(argv)
+
+    server = http.server.ThreadingHTTPServer((args.host, args.port), StandinHandler)
+    server.source = DeviceSource(args.export)
+    server.verbose = args.verbose
+    print(f"Serving {args.export} at http://{args.host}:{args.port}/api/dcim/devices/  (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"\n{server.source.requests} requests served.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
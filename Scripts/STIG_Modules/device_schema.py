@@ -0,0 +1,207 @@
+"""
+TITLE:           device_schema.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) Reads the multi-device csv files used by 'File Mode' into DeviceRecord
+                tuples. Two input schemas are supported:
+                - Schema v1 (legacy): no header row, 30 columns in the fixed order
+                  listed in ./File_Mode/multidevice_instructions.txt. Any columns after
+                  the 30th (notes and the like) are ignored, as they always were.
+                - Schema v2: the first row is a header naming each column. Columns may
+                  appear in any order, optional columns may be left out, common CMDB
+                  column names are accepted (see FIELD_ALIASES), and any column the
+                  script does not know about is passed through untouched in
+                  DeviceRecord.extras, under the name extra_field_name() gives it.
+                2) The header is analyzed ONCE per file. Every row afterwards is mapped
+                with a single pre-built itemgetter, so large exports are not slowed down
+                by building a dict for every device.
+
+NOTE:           A v2 file may optionally start with a version line such as:
+                    #STIG_SCHEMA=2
+                Files declaring a newer version than SCHEMA_VERSION are rejected instead
+                of being guessed at.
+"""
+
+import csv, keyword, re
+from collections import namedtuple
+from operator import itemgetter
+
+
+SCHEMA_VERSION = 2
+
+# Every field of a device, in the column order of the legacy (v1) schema.
+DEVICE_FIELDS = ("networkType", "deviceType", "devName", "mgmt_ipaddr", "mgmt_interf",
+                 "vrf_exists", "vrf_name", "geo_region", "ise_region", "aaaServer_PRI",
+                 "aaaServer_SEC", "ntpServer_Prefer", "ntpServer_SEC", "ntpServer_TER",
+                 "ntpServer_ALT", "snmp_loc", "snmp_contact", "snmp_contact_phone",
+                 "site_password", "loggingSyntax", "snmp_READuser", "snmp_READrole",
+                 "snmp_READauthPW", "snmp_READprivPW", "snmp_READuserACL", "snmp_WRITEuser",
+                 "snmp_WRITErole", "snmp_WRITEauthPW", "snmp_WRITEprivPW", "snmp_WRITEuserACL")
+
+DeviceRecord = namedtuple("DeviceRecord", DEVICE_FIELDS + ("extras",))
+
+# Columns the STIG_Templates reference data can fill in when they are blank or missing.
+# (Requires a 'site_id' column holding the Corporate Site ID; see batch_render.py.)
+REFERENCE_FIELDS = DEVICE_FIELDS[DEVICE_FIELDS.index("aaaServer_PRI"):]
+
+# Columns that may be left out of a v2 file, and the value used when they are.
+# NOTE: A missing ise_region takes the value of geo_region, just like Interactive Mode.
+FIELD_DEFAULTS = {"vrf_exists": "no",
+                  "vrf_name": "no_vrf",
+                  "geo_region": "",
+                  "ise_region": ""}
+FIELD_DEFAULTS.update(dict.fromkeys(REFERENCE_FIELDS, ""))
+
+# Alternate column names found in common CMDB/DCIM exports. Matching is case-insensitive.
+FIELD_ALIASES = {"network_type": "networkType",
+                 "device_type": "deviceType",
+                 "hostname": "devName",
+                 "name": "devName",
+                 "device_name": "devName",
+                 "mgmt_ip": "mgmt_ipaddr",
+                 "primary_ip": "mgmt_ipaddr",
+                 "management_ip": "mgmt_ipaddr",
+                 "mgmt_interface": "mgmt_interf",
+                 "vrf": "vrf_name",
+                 "region": "geo_region",
+                 "geo": "geo_region",
+                 "ise": "ise_region"}
+
+SCHEMA_MARKER = "#STIG_SCHEMA="
+
+
+class DeviceFileError(ValueError):
+    pass
+
+
+def canonical_field(column_name):
+    """
+    NOTE: Returns the DeviceRecord field a header cell refers to, or None if the
+    column is not one the script knows about (it then becomes an extra column).
+    """
+    name = column_name.strip()
+    lowered = name.lower()
+    for field in DEVICE_FIELDS:
+        if field.lower() == lowered:
+            return field
+    return FIELD_ALIASES.get(lowered)
+
+def extra_field_name(column_name):
+    """
+    NOTE: The name of an extra column in DeviceRecord.extras (extras.<name> in the Jinja
+    templates). Every run of characters other than letters, digits and '_' becomes one
+    '_', leading and trailing '_' are dropped, and a Python keyword gets a trailing '_':
+    'rack-unit' -> rack_unit, 'Rack Unit' -> Rack_Unit, 'class' -> class_. Returns None
+    when that leaves no name, or one starting with a digit.
+    """
+    name = re.sub(r"\W+", "_", column_name.strip(), flags=re.ASCII).strip("_")
+    if keyword.iskeyword(name):
+        name += "_"
+    if not name or name[0].isdigit():
+        return None
+    return name
+
+def looks_like_header(row):
+    return any(canonical_field(cell) == "devName" for cell in row)
+
+
+class SchemaMapper:
+    """
+    NOTE: Built once per file from its header (or from the fixed v1 layout). Calling
+    map_row(row) turns one csv row into a DeviceRecord.
+    """
+
+    def __init__(self, header=None, version=SCHEMA_VERSION):
+        self.version = version if header is not None else 1
+        self.header = tuple(header) if header is not None else DEVICE_FIELDS
+        positions = {}
+        extra_positions = []
+        extra_columns = {}
+        for position, column_name in enumerate(self.header):
+            field = canonical_field(column_name) if header is not None else column_name
+            if field is None:
+                if not column_name.strip():
+                    # A column without a name (e.g. a trailing comma) is not kept.
+                    continue
+                name = extra_field_name(column_name)
+                if name is None:
+                    raise DeviceFileError(f"Column [{column_name}] cannot be handed to the templates; "
+                                          "rename it to start with a letter.")
+                if name in extra_columns:
+                    raise DeviceFileError(f"Columns [{extra_columns[name]}] and [{column_name}] would both be "
+                                          f"extras.{name}; rename one of them.")
+                extra_positions.append(position)
+                extra_columns[name] = column_name
+            elif field in positions:
+                raise DeviceFileError(f"Column [{column_name}] maps to [{field}], which was already provided by another column.")
+            else:
+                positions[field] = position
+
+        missing = [field for field in DEVICE_FIELDS if field not in positions and field not in FIELD_DEFAULTS]
+        if missing:
+            raise DeviceFileError("The following required columns are missing from the header: " + ", ".join(missing))
+
+        # Missing optional fields read from a short tail of defaults appended to each row.
+        self.defaults_tail = []
+        width = len(self.header)
+        for field in DEVICE_FIELDS:
+            if field in positions:
+                continue
+            if field == "ise_region" and "geo_region" in positions:
+                positions[field] = positions["geo_region"]
+                continue
+            positions[field] = width + len(self.defaults_tail)
+            self.defaults_tail.append(FIELD_DEFAULTS[field])
+
+        self.width = width
+        # Legacy rows may carry extra trailing columns; a header file's rows must match it.
+        self.legacy = header is None
+        self.field_getter = itemgetter(*[positions[field] for field in DEVICE_FIELDS])
+        self.extra_names = tuple(extra_columns)
+        self.Extras = namedtuple("Extras", self.extra_names)
+        if len(extra_positions) > 1:
+            self.extras_getter = itemgetter(*extra_positions)
+        elif extra_positions:
+            single = extra_positions[0]
+            self.extras_getter = lambda row: (row[single],)
+        else:
+            self.extras_getter = lambda row: ()
+
+    def map_row(self, row):
+        if len(row) != self.width and not (self.legacy and len(row) > self.width):
+            raise DeviceFileError(f"Expected {self.width} values but found {len(row)}.")
+        if self.defaults_tail:
+            row = row + self.defaults_tail
+        return DeviceRecord._make(self.field_getter(row) + (self.Extras._make(self.extras_getter(row)),))
+
+
+def read_device_file(inputFile):
+    """
+    NOTE: Yields a DeviceRecord for every non-empty row of an open csv file (opened
+    with newline=''). The schema is detected from the first row: a header means v2,
+    anything else is treated as a legacy v1 row.
+    """
+    csv_data = csv.reader(inputFile)
+    version = SCHEMA_VERSION
+    mapper = None
+    for line_number, row in enumerate(csv_data, start=1):
+        if not row or (len(row) == 1 and not row[0].strip()):
+            continue
+        if mapper is None:
+            if row[0].startswith(SCHEMA_MARKER):
+                try:
+                    version = int(row[0][len(SCHEMA_MARKER):])
+                except ValueError:
+                    raise DeviceFileError(f"Line {line_number}: could not read the schema version from [{row[0]}].")
+                if version > SCHEMA_VERSION:
+                    raise DeviceFileError(f"Line {line_number}: schema version {version} is newer than this script supports (v{SCHEMA_VERSION}).")
+                continue
+            if looks_like_header(row):
+                mapper = SchemaMapper(row, version)
+                continue
+            mapper = SchemaMapper()
+        try:
+            yield mapper.map_row(row)
+        except DeviceFileError as err:
+            raise DeviceFileError(f"Line {line_number}: {err}") from None
@@ -0,0 +1,296 @@
+"""
+TITLE:           device_ssh.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) The SSH side of pushing configs to devices (config_delivery.py): an
+                interactive CLI session on a Cisco IOS/IOS-XE or NX-OS device, driven by
+                its prompts. Every command line gets one prompt back, so the session
+                knows when the device has taken a block of lines without any fixed
+                sleeps.
+                2) Commands that make the device ask for confirmation ('no username
+                admin' on IOS-XE when the account exists: "... [confirm]") are sent on
+                their own, and a confirmation question ([confirm], [yes/no]) is
+                answered, so the device goes on to its prompt instead of waiting for a
+                key press until the command times out.
+                3) SessionPool caps how many devices are worked on at once, and keeps one
+                SSH connection per device for as long as that device is being worked on,
+                so a retry after a stalled session opens a new channel on the same login
+                instead of a new connection.
+
+NOTE:           Requires the asyncssh package (pip install asyncssh).
+                Host keys are checked against ~/.ssh/known_hosts unless SSHOptions is
+                given another known_hosts file, or None to skip the check (lab only).
+"""
+
+import asyncio, collections, contextlib, ipaddress, re
+
+
+# A CLI prompt at the start of a line:  R1#  R1>  R1(config)#  R1(config-if)#
+PROMPT = re.compile(r"(?m)^[A-Za-z0-9][\w.:/-]{0,62}(?:\([\w.-]*\))?[#>][ \t]*")
+PROMPT_AT_END = re.compile(r"(?:^|\n)[A-Za-z0-9][\w.:/-]{0,62}(?:\([\w.-]*\))?[#>][ \t]*$")
+
+# Device replies that mean a config line was not accepted.
+REJECTED = re.compile(r"(?m)^[ \t]*% ?(?:Invalid|Incomplete|Ambiguous|Unrecognized|Error|Bad|Unknown)[^\r\n]*")
+
+# Questions a device asks before it carries out a command, with the answer sent to each.
+CONFIRM_AT_END = re.compile(r"(\[confirm\]|\[yes/no\])(?:\s*\[\w*\])?:?[ \t]*$", re.IGNORECASE)
+CONFIRM_ANSWERS = {"[confirm]": "\n", "[yes/no]": "yes\n"}
+
+# Config lines that may be answered with a confirmation question. The device takes the
+# next key press as the answer, so these are never sent in a chunk with other lines.
+MAY_CONFIRM = re.compile(r"^\s*(?:no\s+username\s|crypto\s+key\s+(?:generate|zeroize)\s)", re.IGNORECASE)
+
+# "banner login ^" starts a block that is closed by the next line holding the
+# delimiter; the device answers the whole block with a single prompt.
+BANNER_START = re.compile(r"^banner\s+\S+\s+(\S)(.*)$")
+
+DEFAULT_PORT = 22
+DEFAULT_CONNECT_TIMEOUT = 20.0
+DEFAULT_COMMAND_TIMEOUT = 60.0
+READ_SIZE = 65536
+
+
+class DeviceSSHError(Exception):
+    pass
+
+
+def load_asyncssh():
+    try:
+        import asyncssh
+    except ImportError:
+        raise DeviceSSHError("SSH delivery requires the asyncssh package:  pip install asyncssh") from None
+    return asyncssh
+
+
+class SSHOptions:
+    """
+    NOTE: How to reach and log in to the devices. With loopback=True every mgmt_ipaddr
+    a.b.c.d is reached at 127.b.c.d instead, which is where the local SSH stand-in
+    (ssh_standin.py) answers for it.
+    """
+
+    def __init__(self, username, password=None, client_keys=None, known_hosts=(), port=DEFAULT_PORT,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, command_timeout=DEFAULT_COMMAND_TIMEOUT, loopback=False):
+        self.username = username
+        self.password = password
+        self.client_keys = client_keys
+        self.known_hosts = known_hosts
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.command_timeout = command_timeout
+        self.loopback = loopback
+
+    def address(self, mgmt_ipaddr):
+        if not self.loopback:
+            return mgmt_ipaddr
+        octets = ipaddress.IPv4Address(mgmt_ipaddr).packed
+        return str(ipaddress.IPv4Address(bytes([127]) + octets[1:]))
+
+    def connect_kwargs(self):
+        kwargs = {"port": self.port, "username": self.username, "password": self.password,
+                  "client_keys": self.client_keys, "connect_timeout": self.connect_timeout}
+        if self.known_hosts != ():
+            kwargs["known_hosts"] = self.known_hosts
+        return kwargs
+
+
+def command_units(lines):
+    """
+    NOTE: Groups config lines into the units a device answers with one prompt each:
+    a single line, or a whole banner block.
+    """
+    units, banner, delimiter = [], None, None
+    for line in lines:
+        if banner is not None:
+            banner.append(line)
+            if delimiter in line:
+                units.append(banner)
+                banner = None
+            continue
+        match = BANNER_START.match(line)
+        if match and match.group(1) not in match.group(2):
+            banner, delimiter = [line], match.group(1)
+        elif line.strip() and line.strip() != "!":
+            units.append([line])
+    if banner is not None:
+        units.append(banner)
+    return units
+
+def chunk_units(units, chunk_bytes):
+    """
+    NOTE: Packs units into chunks of at most chunk_bytes, so a chunk never overruns the
+    device's input buffer. A unit larger than chunk_bytes, or one that may be answered
+    with a confirmation question (MAY_CONFIRM), is sent on its own.
+    """
+    chunk, size = [], 0
+    for unit in units:
+        unit_size = sum(len(line) + 1 for line in unit)
+        alone = MAY_CONFIRM.match(unit[0]) is not None
+        if chunk and (alone or size + unit_size > chunk_bytes):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(unit)
+        size += unit_size
+        if alone:
+            yield chunk
+            chunk, size = [], 0
+    if chunk:
+        yield chunk
+
+
+class DeviceSession:
+    """
+    NOTE: One interactive shell on a device. Use open(), then command() and push().
+    """
+
+    def __init__(self, process, command_timeout):
+        self.process = process
+        self.command_timeout = command_timeout
+        self.prompt = ""
+        self.confirmations = 0
+
+    @classmethod
+    async def open(cls, connection, command_timeout):
+        process = await connection.create_process(term_type="vt100", term_size=(511, 24),
+                                                  encoding="utf-8", errors="replace")
+        session = cls(process, command_timeout)
+        await session.read_prompts(1)
+        await session.command("terminal length 0")
+        return session
+
+    async def read_prompts(self, count, timeout=None):
+        """
+        NOTE: Reads until 'count' more prompts have arrived and the output ends at a
+        prompt, answering any confirmation question on the way. Returns everything
+        read.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or self.command_timeout)
+        output, seen, match = "", 0, None
+        # Prompts on complete lines are counted once; only the last line is rescanned.
+        done_to, done_seen = 0, 0
+        while seen < count or match is None:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            data = await asyncio.wait_for(self.process.stdout.read(READ_SIZE), remaining)
+            if not data:
+                raise DeviceSSHError("the device closed the session")
+            output += data
+            last_line = output.rfind("\n") + 1
+            question = CONFIRM_AT_END.search(output, last_line)
+            if question:
+                self.process.stdin.write(CONFIRM_ANSWERS[question.group(1).lower()])
+                self.confirmations += 1
+            if last_line > done_to:
+                done_seen += len(PROMPT.findall(output, done_to, last_line))
+                done_to = last_line
+            seen = done_seen + len(PROMPT.findall(output, done_to))
+            match = PROMPT_AT_END.search(output, max(0, last_line - 1))
+        self.prompt = match.group(0).strip()
+        return output
+
+    async def command(self, line, timeout=None):
+        """
+        NOTE: Runs one exec command and returns its output, without the echoed command
+        and the closing prompt.
+        """
+        self.process.stdin.write(line + "\n")
+        output = await self.read_prompts(1, timeout)
+        body = output[:output.rfind("\n") + 1]
+        return body.split("\n", 1)[1] if "\n" in body else ""
+
+    async def push(self, lines, chunk_bytes, timeout=None):
+        """
+        NOTE: Enters configuration mode, sends 'lines' chunk by chunk (waiting for the
+        device to answer every unit of a chunk before sending the next), and leaves
+        configuration mode. Returns (transcript, rejected, units sent), where
+        'rejected' is [(config line, device reply), ...].
+        """
+        transcript, rejected, sent = [], [], 0
+        transcript.append(self.prompt + "configure terminal\n" + await self.command("configure terminal", timeout))
+        try:
+            for chunk in chunk_units(command_units(lines), chunk_bytes):
+                self.process.stdin.write("".join(line + "\n" for unit in chunk for line in unit))
+                output = await self.read_prompts(len(chunk), timeout)
+                transcript.append(output)
+                # Between prompts: the echo of one unit and the device's reply to it.
+                for unit, reply in zip(chunk, PROMPT.split(output)):
+                    error = REJECTED.search(reply)
+                    if error:
+                        rejected.append((unit[0], error.group(0).strip()))
+                sent += len(chunk)
+        finally:
+            if not self.process.stdin.is_closing():
+                self.process.stdin.write("end\n")
+        transcript.append(await self.read_prompts(1, timeout))
+        return "".join(transcript), rejected, sent
+
+    def close(self):
+        self.process.close()
+
+
+class SessionPool:
+    """
+    NOTE: Hands out device sessions with at most 'concurrency' devices worked on at
+    once. A device's SSH connection is opened on its first session and kept until
+    release(), so retries only open a new channel.
+    """
+
+    def __init__(self, options, concurrency):
+        self.asyncssh = load_asyncssh()
+        self.options = options
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.connections = {}
+        self.stats = collections.Counter()
+
+    @contextlib.asynccontextmanager
+    async def device(self, mgmt_ipaddr):
+        """
+        NOTE: Holds one of the concurrency slots for all the work on one device.
+        """
+        async with self.semaphore:
+            try:
+                yield
+            finally:
+                await self.release(mgmt_ipaddr)
+
+    async def connection(self, mgmt_ipaddr):
+        connection = self.connections.get(mgmt_ipaddr)
+        if connection is not None and connection.is_closed():
+            connection = None
+        if connection is None:
+            connection = await asyncio.wait_for(
+                self.asyncssh.connect(self.options.address(mgmt_ipaddr), **self.options.connect_kwargs()),
+                self.options.connect_timeout)
+            self.connections[mgmt_ipaddr] = connection
+            self.stats["connections"] += 1
+        return connection
+
+    async def session(self, mgmt_ipaddr):
+        connection = await self.connection(mgmt_ipaddr)
+        try:
+            session = await DeviceSession.open(connection, self.options.command_timeout)
+        except (OSError, self.asyncssh.Error):
+            # The connection itself is broken; the next attempt logs in again.
+            self.drop(mgmt_ipaddr)
+            raise
+        self.stats["sessions"] += 1
+        return session
+
+    def drop(self, mgmt_ipaddr):
+        connection = self.connections.pop(mgmt_ipaddr, None)
+        if connection is not None:
+            connection.close()
+
+    async def release(self, mgmt_ipaddr):
+        connection = self.connections.pop(mgmt_ipaddr, None)
+        if connection is not None:
+            connection.close()
+            with contextlib.suppress(Exception):
+                await connection.wait_closed()
+
+    async def close(self):
+        for mgmt_ipaddr in list(self.connections):
+            await self.release(mgmt_ipaddr)
@@ -0,0 +1,400 @@
+"""
+TITLE:           drop_watch.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) Watch mode for File_Mode: keeps an eye on the drop folder (./File_Mode by
+                default) and runs every csv file uploaded into it through Batch Mode as
+                soon as the upload is complete, so the configs are ready seconds after
+                the SFTP transfer ends instead of whenever someone next runs the script.
+                2) The folder is polled with os.scandir() (one directory read per
+                interval, the sizes and times come with it). A file counts as complete
+                once its size and modification time have not changed for
+                'settle' seconds. Temporary upload names (*.part, *.filepart, *.tmp,
+                .hidden, ~lock) are ignored until the client renames them.
+                3) Every complete upload is identified by the SHA-256 of its content. A
+                file whose content was already processed successfully (or is being
+                processed), under any name, is reported as a duplicate and not generated
+                again. The hashes are kept in 'drop_watch_db', so this also holds across
+                restarts. A drop whose run failed is processed again when it is uploaded
+                again (e.g. after the reference data was fixed).
+                4) Each drop runs in its own worker process (up to 'workers' at a time),
+                so a large upload does not hold up the small ones behind it. The output
+                of each drop's run is saved to its own log in 'drop_log_path'.
+
+USAGE:          From the ./Scripts directory:
+                python STIG_config_builder.py --watch
+                python STIG_config_builder.py --watch --watch-dir /srv/sftp/stig --fill-placeholders
+                python -m STIG_Modules.drop_watch list                 <--- processed drops
+
+NOTE:           Every other Batch Mode option given with --watch is used for each drop,
+                except --shard and --metrics, which are refused: drops running side by
+                side would overwrite one shard manifest or metrics file.
+                On the very first start in a folder, the files already in it are
+                recorded as seen and not processed; after that, files that arrived
+                while the watcher was stopped are processed when it starts.
+"""
+
+import hashlib, os, sqlite3, sys, time
+
+
+DEFAULT_DROP_WATCH_DB = "./Generated_Configs/.stig_drops.sqlite3"
+DEFAULT_DROP_LOG_PATH = "./Generated_Configs/Drop_Logs/"
+
+DROP_EXTENSIONS = (".csv",)
+TEMPORARY_SUFFIXES = (".part", ".filepart", ".tmp", ".partial", ".crdownload")
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Only a drop with one of these outcomes makes a later upload of the same content a
+# duplicate; after 'failed' or 'error' the content is processed again.
+DUPLICATE_STATUSES = ("baseline", "running", "done")
+
+# The options that control the watcher itself; all the others are passed on to each drop.
+WATCH_FLAGS = ("--watch",)
+WATCH_OPTIONS = ("--watch-dir", "--watch-interval", "--watch-settle", "--watch-workers")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS drops (
+    sha256      TEXT PRIMARY KEY,
+    name        TEXT NOT NULL,      -- file name of the first upload with this content
+    size        INTEGER NOT NULL,
+    seen        REAL NOT NULL,
+    finished    REAL,
+    status      TEXT NOT NULL,      -- 'baseline', 'running', 'done', 'failed' or 'error'
+    configs     INTEGER,
+    failed      INTEGER,
+    log         TEXT
+);
+CREATE TABLE IF NOT EXISTS folders (
+    directory   TEXT PRIMARY KEY,   -- absolute path of a drop folder
+    baselined   REAL NOT NULL       -- when its existing files were recorded as seen
+);
+"""
+
+
+def is_drop_name(name):
+    """
+    NOTE: True for a csv file name that is not a temporary upload name.
+    """
+    lowered = name.lower()
+    if name.startswith((".", "~")) or lowered.endswith(TEMPORARY_SUFFIXES):
+        return False
+    return lowered.endswith(DROP_EXTENSIONS)
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as dropFile:
+        for block in iter(lambda: dropFile.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def drop_argv(argv):
+    """
+    NOTE: The Batch Mode command line for a drop: 'argv' without the watch options.
+    """
+    kept, skip = [], False
+    for arg in argv:
+        if skip:
+            skip = False
+            continue
+        option = arg.split("=", 1)[0]
+        if option in WATCH_FLAGS or option in WATCH_OPTIONS:
+            skip = option in WATCH_OPTIONS and "=" not in arg
+            continue
+        kept.append(arg)
+    return kept
+
+
+class DropLedger:
+    """
+    NOTE: The SHA-256 of every upload that was seen, and how its run went.
+    """
+
+    def __init__(self, db_path=DEFAULT_DROP_WATCH_DB, read_only=False):
+        self.db_path = db_path
+        if read_only:
+            self.db = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        else:
+            self.db = sqlite3.connect(db_path)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.executescript(SCHEMA)
+            # A drop that was running when the watcher stopped is processed again.
+            self.db.execute("DELETE FROM drops WHERE status = 'running'")
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def is_baselined(self, directory):
+        return self.db.execute("SELECT 1 FROM folders WHERE directory = ?", (directory,)).fetchone() is not None
+
+    def mark_baselined(self, directory):
+        self.db.execute("INSERT OR IGNORE INTO folders (directory, baselined) VALUES (?, ?)", (directory, time.time()))
+        self.db.commit()
+
+    def lookup(self, sha256):
+        """
+        NOTE: (name, status) of an earlier upload with the same content that makes this
+        one a duplicate (see DUPLICATE_STATUSES), or None.
+        """
+        row = self.db.execute("SELECT name, status FROM drops WHERE sha256 = ?", (sha256,)).fetchone()
+        return row if row is not None and row[1] in DUPLICATE_STATUSES else None
+
+    def add(self, sha256, name, size, status):
+        """
+        NOTE: Replaces the record of an earlier upload that failed.
+        """
+        self.db.execute("INSERT OR REPLACE INTO drops (sha256, name, size, seen, status) VALUES (?, ?, ?, ?, ?)",
+                        (sha256, name, size, time.time(), status))
+        self.db.commit()
+
+    def finish(self, sha256, status, configs, failed, log):
+        self.db.execute("UPDATE drops SET status = ?, finished = ?, configs = ?, failed = ?, log = ? "
+                        "WHERE sha256 = ?", (status, time.time(), configs, failed, log, sha256))
+        self.db.commit()
+
+    def drops(self):
+        return self.db.execute("SELECT sha256, name, size, seen, finished, status, configs, failed, log "
+                               "FROM drops ORDER BY seen").fetchall()
+
+
+def summary_count(text, label):
+    """
+    NOTE: The number on a '  Label:   N' line of the batch summary, or 0.
+    """
+    start = text.rfind(f"  {label}:")
+    if start < 0:
+        return 0
+    value = text[start + len(label) + 3:text.find("\n", start)].split()
+    return int(value[0]) if value and value[0].isdigit() else 0
+
+def init_worker():
+    """
+    NOTE: Ctrl+C stops the watcher, which lets the running drops finish; the workers
+    themselves ignore it.
+    """
+    import signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def process_drop(path, argv, settings, log_path):
+    """
+    NOTE: Runs Batch Mode for one drop in a worker process, with everything it prints
+    saved to 'log_path'. Returns (exit code, configs generated, devices failed).
+    """
+    import contextlib, traceback
+    from STIG_Modules.batch_cli import main as batch_main
+    with open(log_path, "w") as logFile, contextlib.redirect_stdout(logFile), contextlib.redirect_stderr(logFile):
+        try:
+            code = batch_main(["--csv", path] + argv, settings)
+        except SystemExit as err:
+            code = err.code if isinstance(err.code, int) else 1
+        except Exception:
+            traceback.print_exc()
+            code = 1
+    with open(log_path) as logFile:
+        text = logFile.read()
+    return code, summary_count(text, "Configs generated"), summary_count(text, "Devices failed")
+
+
+class DropWatcher:
+    """
+    NOTE: The polling loop. scan() finds the uploads that are complete, dispatch()
+    hands each new one to the worker pool, and collect() records the finished runs.
+    """
+
+    def __init__(self, directory, argv, settings, interval=1.0, settle=2.0, workers=None, report=print):
+        self.directory = directory
+        self.argv = argv
+        self.settings = settings
+        self.interval = interval
+        self.settle = settle
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.report = report
+        self.log_path = settings["drop_log_path"]
+        self.ledger = DropLedger(settings["drop_watch_db"])
+        # path: (size, mtime_ns, time that signature was first seen)
+        self.pending = {}
+        # path: (size, mtime_ns) of the content last hashed, so it is not hashed again
+        self.handled = {}
+        # future: (sha256, name, started)
+        self.running = {}
+        self.pool = None
+        self.stats = {"drops": 0, "duplicates": 0, "completed": 0, "failed": 0, "configs": 0, "latency": 0.0}
+
+    def scan(self):
+        """
+        NOTE: [(path, name, size, first seen)] for the uploads that have just settled.
+        """
+        now = time.monotonic()
+        settled, present = [], set()
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not is_drop_name(entry.name) or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                signature = (stat.st_size, stat.st_mtime_ns)
+                present.add(entry.path)
+                if self.handled.get(entry.path) == signature:
+                    continue
+                pending = self.pending.get(entry.path)
+                if pending is None or pending[:2] != signature:
+                    self.pending[entry.path] = signature + (now,)
+                elif now - pending[2] >= self.settle and stat.st_size:
+                    del self.pending[entry.path]
+                    self.handled[entry.path] = signature
+                    settled.append((entry.path, entry.name, stat.st_size, pending[2]))
+        for path in set(self.pending).difference(present):
+            del self.pending[path]
+        for path in set(self.handled).difference(present):
+            del self.handled[path]
+        return settled
+
+    def baseline(self):
+        """
+        NOTE: On the first start in the folder, records the files already in it as seen.
+        """
+        directory = os.path.abspath(self.directory)
+        if self.ledger.is_baselined(directory):
+            return 0
+        count = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if is_drop_name(entry.name) and entry.is_file():
+                    stat = entry.stat()
+                    sha256 = file_sha256(entry.path)
+                    if self.ledger.lookup(sha256) is None:
+                        self.ledger.add(sha256, entry.name, stat.st_size, "baseline")
+                    self.handled[entry.path] = (stat.st_size, stat.st_mtime_ns)
+                    count += 1
+        self.ledger.mark_baselined(directory)
+        return count
+
+    def dispatch(self, path, name, size, first_seen):
+        from concurrent.futures import ProcessPoolExecutor
+        try:
+            sha256 = file_sha256(path)
+        except OSError:
+            # Renamed or removed before it could be read; a new name is seen as a new upload.
+            self.handled.pop(path, None)
+            return
+        earlier = self.ledger.lookup(sha256)
+        if earlier is not None:
+            self.stats["duplicates"] += 1
+            self.report(f"   DUPLICATE:  [{name}]  same content as [{earlier[0]}] ({earlier[1]}), not processed again")
+            return
+        self.ledger.add(sha256, name, size, "running")
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers, initializer=init_worker)
+        log = os.path.join(self.log_path, f"{os.path.splitext(name)[0]}_{sha256[:12]}.log")
+        future = self.pool.submit(process_drop, path, self.argv, self.settings, log)
+        self.running[future] = (sha256, name, first_seen, log)
+        self.stats["drops"] += 1
+        self.report(f"   DROPPED:    [{name}]  ({size} bytes, sha256 {sha256[:12]})")
+
+    def collect(self, done):
+        for future in done:
+            sha256, name, first_seen, log = self.running.pop(future)
+            try:
+                code, configs, failed = future.result()
+            except Exception as err:
+                code, configs, failed = 1, 0, 0
+                self.report(f"   FAILED:     [{name}]  the worker process failed: {err}")
+            status = "done" if code == 0 else "failed" if code == 2 else "error"
+            self.ledger.finish(sha256, status, configs, failed, log)
+            latency = time.monotonic() - first_seen
+            self.stats["configs"] += configs
+            self.stats["latency"] = max(self.stats["latency"], latency)
+            if status == "done":
+                self.stats["completed"] += 1
+                self.report(f"   COMPLETED:  [{name}]  {configs} configs  ({latency:.1f}s after upload)  log: {log}")
+            elif status == "failed":
+                self.stats["failed"] += 1
+                self.report(f"   FAILED:     [{name}]  {configs} configs, {failed} devices failed  "
+                            f"({latency:.1f}s after upload)  log: {log}")
+            else:
+                self.stats["failed"] += 1
+                self.report(f"   FAILED:     [{name}]  the run stopped with an error  log: {log}")
+
+    def run(self):
+        """
+        NOTE: Polls until interrupted (Ctrl+C), then waits for the running drops.
+        """
+        from concurrent.futures import FIRST_COMPLETED, wait
+        os.makedirs(self.log_path, exist_ok=True)
+        seen = self.baseline()
+        if seen:
+            self.report(f"   {seen} file(s) already in [{self.directory}] recorded as seen, not processed")
+        try:
+            while True:
+                for path, name, size, first_seen in self.scan():
+                    self.dispatch(path, name, size, first_seen)
+                if self.running:
+                    done, _ = wait(self.running, timeout=self.interval, return_when=FIRST_COMPLETED)
+                    self.collect(done)
+                else:
+                    time.sleep(self.interval)
+        except KeyboardInterrupt:
+            if self.running:
+                print(f"\nStopping: waiting for {len(self.running)} running drop(s) to finish...")
+                self.collect(wait(self.running)[0])
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
+            self.ledger.close()
+
+    def summary_lines(self):
+        return ["\n" + "#"*24 + "\n## DROP WATCH SUMMARY ##\n" + "#"*24,
+                f"  Drop folder:               {self.directory}",
+                f"  Drops processed:           {self.stats['drops']}",
+                f"      completed              {self.stats['completed']}",
+                f"      failed                 {self.stats['failed']}",
+                f"  Duplicates skipped:        {self.stats['duplicates']}",
+                f"  Configs generated:         {self.stats['configs']}",
+                f"  Slowest turnaround:        {self.stats['latency']:.1f}s after upload",
+                f"  Drop logs:                 {self.log_path}"]
+
+
+def watch(args, argv, settings):
+    """
+    NOTE: The --watch entry point of batch_cli.
+    """
+    from STIG_Modules.secret_vault import PASSPHRASE_ENV
+    if not os.path.isdir(args.watch_dir):
+        print(f"ERROR:\n   The drop folder [{args.watch_dir}] does not exist.\n\nEXITING SCRIPT...\n")
+        return 1
+    if args.secret_vault and os.environ.get(PASSPHRASE_ENV) is None:
+        print(f"ERROR:\n   Watch mode needs the vault passphrase in {PASSPHRASE_ENV}.\n\nEXITING SCRIPT...\n")
+        return 1
+    watcher = DropWatcher(args.watch_dir, drop_argv(argv), settings, args.watch_interval, args.watch_settle,
+                          args.watch_workers)
+    print("\n___BATCH MODE (WATCH)___\n")
+    print(f"Watching [{args.watch_dir}] for csv uploads every {args.watch_interval:g}s. Press Ctrl+C to stop.\n")
+    watcher.run()
+    for line in watcher.summary_lines():
+        print(line)
+    return 0
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m STIG_Modules.drop_watch",
+                                     description="Show the uploads recorded by watch mode.")
+    parser.add_argument("--db", default=DEFAULT_DROP_WATCH_DB, help="path to the drop database")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="list every recorded drop")
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(args.db):
+        print(f"No drop database was found at: {args.db}")
+        return 1
+    ledger = DropLedger(args.db, read_only=True)
+    for sha256, name, size, seen, finished, status, configs, failed, log in ledger.drops():
+        line = f"{sha256[:12]}   {status:<8} {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(seen))}   {name}"
+        if finished is not None:
+            line += f"   configs: {configs}   failed: {failed}   took: {finished - seen:.1f}s"
+        print(line)
+    ledger.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,268 @@
+"""
+TITLE:           golden_outputs.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) A regression check for template changes. Every device in the corpus of
+                stored device inputs is rendered with the current Jinja_Templates and
+                compared against its committed golden output:
+                    corpus:   File_Mode/multidevice_example.csv
+                              File_Mode/multidevice_example_header.csv
+                              Golden_Outputs/corpus/*.csv
+                    golden:   Golden_Outputs/expected/<corpus name>/STIG_Config_<devName>
+                2) Devices are rendered and compared in parallel worker processes, and a
+                line-level diff is printed for every device whose output changed.
+                3) Render time is measured per device (the fastest of TIMING_REPEATS
+                renders). The median per corpus is compared with
+                Golden_Outputs/timings.json, so a template change that makes rendering
+                noticeably slower is flagged as well.
+                4) 'update' accepts the current outputs (and timings) as the new golden
+                files; commit them together with the template change.
+
+USAGE:          From the ./Scripts directory:
+                python -m STIG_Modules.golden_outputs run
+                python -m STIG_Modules.golden_outputs run --jobs 4 --corpus ../big_inventory.csv
+                python -m STIG_Modules.golden_outputs update
+
+NOTE:           Render timings depend on the machine. Run 'update' on the machine that
+                runs the check, or raise --time-tolerance.
+"""
+
+import difflib, json, os, statistics, sys, time
+
+
+GOLDEN_PATH = "./Golden_Outputs"
+CORPUS_DIR = "corpus"
+EXPECTED_DIR = "expected"
+TIMINGS_FILE = "timings.json"
+DEFAULT_CORPUS = ("./File_Mode/multidevice_example.csv", "./File_Mode/multidevice_example_header.csv")
+GOLDEN_PREFIX = "STIG_Config_"
+
+# A corpus is flagged when its median render time exceeds the recorded median by this
+# fraction AND by at least TIME_FLOOR_US (below that, timings are mostly noise).
+DEFAULT_TIME_TOLERANCE = 0.5
+TIME_FLOOR_US = 50
+
+# Each device is rendered this many times and its fastest render is kept, so one-off
+# stalls (cold caches, other processes) do not read as a slowdown.
+TIMING_REPEATS = 3
+
+# Devices per task handed to a worker.
+CHUNK_SIZE = 250
+
+
+def corpus_name(corpus_path):
+    return os.path.splitext(os.path.basename(corpus_path))[0]
+
+def corpus_files(golden_path, extra=()):
+    files = [path for path in DEFAULT_CORPUS if os.path.isfile(path)]
+    corpus_dir = os.path.join(golden_path, CORPUS_DIR)
+    if os.path.isdir(corpus_dir):
+        files += [os.path.join(corpus_dir, name) for name in sorted(os.listdir(corpus_dir)) if name.endswith(".csv")]
+    return files + list(extra)
+
+def read_corpus(corpus_path):
+    from STIG_Modules.device_schema import read_device_file
+    with open(corpus_path, newline='') as inputFile:
+        return list(read_device_file(inputFile))
+
+
+# ========================================================================================
+# Worker side. Each worker process loads the templates and reference data once, and
+# each corpus file once.
+# ========================================================================================
+
+WORKER = {}
+
+def init_worker(jinja_templates_path, stig_templates_path):
+    from STIG_Modules.batch_render import TemplateRenderer
+    WORKER["renderer"] = TemplateRenderer(jinja_templates_path)
+    WORKER["stig_templates_path"] = stig_templates_path
+    WORKER["reference"] = None
+    WORKER["corpus"] = {}
+
+def worker_reference():
+    if WORKER["reference"] is None:
+        from STIG_Modules.reference_data import ReferenceData
+        WORKER["reference"] = ReferenceData(WORKER["stig_templates_path"])
+    return WORKER["reference"]
+
+def check_chunk(corpus_path, expected_dir, start, stop, update):
+    """
+    NOTE: Returns [(devName, status, diff_lines, render_us), ...] for devices
+    start..stop of a corpus file. Status is 'same', 'changed', 'new' or 'failed'.
+    """
+    from STIG_Modules.batch_render import BatchError, needs_resolution, resolve_record, template_name_for
+    records = WORKER["corpus"].get(corpus_path)
+    if records is None:
+        records = WORKER["corpus"][corpus_path] = read_corpus(corpus_path)
+    results = []
+    for record in records[start:stop]:
+        golden_file = os.path.join(expected_dir, GOLDEN_PREFIX + record.devName)
+        try:
+            if needs_resolution(record):
+                record = resolve_record(record, worker_reference())
+            WORKER["renderer"].get_template(template_name_for(record))     # load outside the timing
+            render_us = None
+            for _ in range(TIMING_REPEATS):
+                started = time.perf_counter()
+                output = WORKER["renderer"].render(record)
+                elapsed_us = (time.perf_counter() - started) * 1e6
+                render_us = elapsed_us if render_us is None else min(render_us, elapsed_us)
+        except BatchError as err:
+            results.append((record.devName, "failed", [str(err)], 0.0))
+            continue
+        try:
+            with open(golden_file) as goldenFile:
+                expected = goldenFile.read()
+        except FileNotFoundError:
+            expected = None
+        if expected == output:
+            status, diff = "same", None
+        else:
+            status = "new" if expected is None else "changed"
+            diff = None if expected is None else list(difflib.unified_diff(
+                expected.splitlines(), output.splitlines(), f"golden/{record.devName}", f"rendered/{record.devName}", lineterm=""))
+            if update:
+                with open(golden_file, "w") as goldenFile:
+                    goldenFile.write(output)
+        results.append((record.devName, status, diff, render_us))
+    return results
+
+
+# ========================================================================================
+# Runner.
+# ========================================================================================
+
+def run_corpus(corpus_paths, golden_path, jobs, update, jinja_templates_path, stig_templates_path):
+    """
+    NOTE: Returns {corpus name: [(devName, status, diff_lines, render_us), ...]}.
+    """
+    tasks = []
+    for corpus_path in corpus_paths:
+        expected_dir = os.path.join(golden_path, EXPECTED_DIR, corpus_name(corpus_path))
+        if update:
+            os.makedirs(expected_dir, exist_ok=True)
+        count = len(read_corpus(corpus_path))
+        for start in range(0, count, CHUNK_SIZE):
+            tasks.append((corpus_path, expected_dir, start, min(start + CHUNK_SIZE, count), update))
+
+    results = {corpus_name(corpus_path): [] for corpus_path in corpus_paths}
+    if jobs <= 1 or len(tasks) <= 1:
+        init_worker(jinja_templates_path, stig_templates_path)
+        for task in tasks:
+            results[corpus_name(task[0])].extend(check_chunk(*task))
+        return results
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(jobs, initializer=init_worker, initargs=(jinja_templates_path, stig_templates_path)) as pool:
+        futures = [(task, pool.submit(check_chunk, *task)) for task in tasks]
+        for task, future in futures:
+            results[corpus_name(task[0])].extend(future.result())
+    return results
+
+def orphaned_goldens(golden_path, name, results):
+    """
+    NOTE: Golden files of a corpus that no device in it produces any more.
+    """
+    expected_dir = os.path.join(golden_path, EXPECTED_DIR, name)
+    if not os.path.isdir(expected_dir):
+        return []
+    produced = {GOLDEN_PREFIX + devName for devName, _, _, _ in results}
+    return sorted(filename for filename in os.listdir(expected_dir) if filename not in produced)
+
+def load_timings(golden_path):
+    try:
+        with open(os.path.join(golden_path, TIMINGS_FILE)) as timingsFile:
+            return json.load(timingsFile)
+    except (OSError, ValueError):
+        return {}
+
+def save_timings(golden_path, timings):
+    with open(os.path.join(golden_path, TIMINGS_FILE), "w") as timingsFile:
+        json.dump(timings, timingsFile, indent=1, sort_keys=True)
+        timingsFile.write("\n")
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m STIG_Modules.golden_outputs",
+                                     description="Render the device corpus and compare it with the golden outputs.")
+    parser.add_argument("command", choices=("run", "update"),
+                        help="'run' compares, 'update' accepts the current outputs and timings as golden")
+    parser.add_argument("--corpus", action="append", default=[], metavar="FILE",
+                        help="an extra device csv to include (repeatable)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="worker processes (default: %(default)s)")
+    parser.add_argument("--time-tolerance", type=float, default=DEFAULT_TIME_TOLERANCE,
+                        help="allowed slowdown of the median render time, as a fraction (default: %(default)s)")
+    parser.add_argument("--max-diff-lines", type=int, default=40,
+                        help="diff lines to print per changed device (default: %(default)s)")
+    parser.add_argument("--golden", default=GOLDEN_PATH, help="the golden output directory (default: %(default)s)")
+    parser.add_argument("--templates", default="./Jinja_Templates", help="the Jinja_Templates directory")
+    parser.add_argument("--stig-templates", default="./STIG_Templates/", help="the STIG_Templates directory")
+    args = parser.parse_args(argv)
+
+    corpus_paths = corpus_files(args.golden, args.corpus)
+    missing = [path for path in args.corpus if not os.path.isfile(path)]
+    if missing or not corpus_paths:
+        print(f"ERROR:\n   No device corpus found{': ' + ', '.join(missing) if missing else ''}. Run this from the ./Scripts directory.\n")
+        return 1
+    update = args.command == "update"
+    started = time.perf_counter()
+    results = run_corpus(corpus_paths, args.golden, args.jobs, update, args.templates, args.stig_templates)
+    elapsed = time.perf_counter() - started
+
+    baseline = load_timings(args.golden)
+    timings = dict(baseline)
+    failed = False
+    totals = {"same": 0, "changed": 0, "new": 0, "failed": 0}
+    print("\n" + "#"*25 + "\n## GOLDEN OUTPUT CHECK ##\n" + "#"*25)
+    for name, corpus_results in results.items():
+        counts = {"same": 0, "changed": 0, "new": 0, "failed": 0}
+        for devName, status, diff, render_us in corpus_results:
+            counts[status] += 1
+            if status == "changed" and not update:
+                print(f"\n   CHANGED:    [{name}] {devName}")
+                for line in diff[:args.max_diff_lines]:
+                    print("      " + line)
+                if len(diff) > args.max_diff_lines:
+                    print(f"      ... {len(diff) - args.max_diff_lines} more diff lines")
+            elif status == "new" and not update:
+                print(f"\n   NEW:        [{name}] {devName}  (no golden output yet; run 'update')")
+            elif status == "failed":
+                print(f"\n   FAILED:     [{name}] {diff[0]}")
+        for key in totals:
+            totals[key] += counts[key]
+        orphans = orphaned_goldens(args.golden, name, corpus_results)
+        for filename in orphans:
+            if update:
+                os.remove(os.path.join(args.golden, EXPECTED_DIR, name, filename))
+            else:
+                print(f"\n   ORPHANED:   [{name}] {filename}  (no device in the corpus produces it)")
+
+        render_times = [render_us for _, status, _, render_us in corpus_results if status != "failed"]
+        median_us = statistics.median(render_times) if render_times else 0.0
+        previous = baseline.get(name, {}).get("median_us")
+        slower = (previous is not None and median_us > previous * (1 + args.time_tolerance)
+                  and median_us - previous > TIME_FLOOR_US)
+        if update:
+            timings[name] = {"devices": len(corpus_results), "median_us": round(median_us, 1)}
+        failed = failed or counts["failed"] > 0 or (not update and (counts["changed"] or counts["new"] or orphans or slower))
+        timing_note = f"   (recorded {previous:.0f} us{', SLOWER' if slower else ''})" if previous is not None else ""
+        print(f"\n  {name}")
+        print(f"      Devices:               {len(corpus_results)}   same: {counts['same']}   changed: {counts['changed']}"
+              f"   new: {counts['new']}   failed: {counts['failed']}")
+        print(f"      Median render time:    {median_us:.0f} us{timing_note}")
+
+    if update:
+        save_timings(args.golden, timings)
+    print(f"\n  Devices checked:           {sum(totals.values())}")
+    print(f"  Unchanged:                 {totals['same']}")
+    print(f"  {'Golden files updated:' if update else 'Changed or new:':<27}{totals['changed'] + totals['new']}")
+    print(f"  Failed to render:          {totals['failed']}")
+    print(f"  Elapsed:                   {elapsed:.2f}s  ({args.jobs} workers)")
+    print(f"  Result:                    {'FAIL' if failed else 'PASS'}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+"""
+TITLE:           inventory_adapters.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) Bulk loaders that turn an existing device inventory into DeviceRecords
+                for the batch pipeline, replacing the 9 interactive questions:
+                - load_netbox_export()    NetBox device exports (JSON), v3.0 and greater
+                - load_nautobot_export()  Nautobot device exports (JSON)
+                - load_rest_devices()     the same data pulled from a live NetBox/Nautobot
+                                          REST endpoint (see inventory_client.py)
+                - load_yaml_inventory()   a YAML-based inventory file
+                2) Every loader is a generator. JSON exports are decoded one device at a
+                time from a small read buffer, and YAML inventories are composed one
+                device node at a time, so a 50k-device inventory never has to fit in
+                memory at once.
+
+DCIM FIELDS:    The STIG-specific values are read from these device custom fields when
+                present. Anything missing can be supplied for the whole run with
+                '--set FIELD=VALUE' on the command line.
+                - stig_network_type     -> networkType
+                - stig_device_type      -> deviceType (otherwise derived from the platform)
+                - stig_mgmt_interface   -> mgmt_interf
+                - stig_vrf              -> vrf_name (otherwise the VRF of the primary IP)
+                - stig_geo_region       -> geo_region
+                - stig_ise_region       -> ise_region
+                - stig_site_id          -> site_id (otherwise the device's site/location)
+                - stig_vdc_type         -> vdc_type (Nexus only: admin | service)
+
+YAML FORMAT:    defaults:                     <--- optional, must come before 'devices'
+                  networkType: OVERLAY
+                  geo_region: REGION_A
+                devices:
+                  - devName: LAN-Switch-2
+                    deviceType: Switch_NON_NEXUS
+                    mgmt_ipaddr: 2.2.2.2
+                    mgmt_interf: vlan 2
+                    site_id: ID002
+"""
+
+import json
+from collections import namedtuple
+
+from STIG_Modules.device_schema import DEVICE_FIELDS, DeviceRecord, canonical_field
+
+
+# Extra (non-DeviceRecord) values every inventory adapter carries for each device.
+ADAPTER_EXTRA_FIELDS = ("site_id", "vdc_type", "source")
+AdapterExtras = namedtuple("Extras", ADAPTER_EXTRA_FIELDS)
+
+READ_CHUNK_SIZE = 1 << 16
+
+
+class InventoryError(ValueError):
+    pass
+
+
+def build_record(values, defaults):
+    """
+    NOTE: values/defaults are {field: value} dicts keyed by DeviceRecord field names
+    and ADAPTER_EXTRA_FIELDS. Blank reference fields are left blank on purpose; the
+    batch pipeline fills them in from the STIG_Templates reference data.
+    """
+    def pick(field):
+        value = values.get(field)
+        if value in (None, ""):
+            value = defaults.get(field, "")
+        return "" if value is None else str(value)
+    fields = [pick(field) for field in DEVICE_FIELDS]
+    record = DeviceRecord._make(fields + [AdapterExtras._make(pick(field) for field in ADAPTER_EXTRA_FIELDS)])
+    if not record.vrf_exists:
+        record = record._replace(vrf_exists="yes" if record.vrf_name and record.vrf_name != "no_vrf" else "no")
+    if not record.vrf_name:
+        record = record._replace(vrf_name="no_vrf")
+    if not record.ise_region:
+        record = record._replace(ise_region=record.geo_region)
+    if not record.devName or not record.mgmt_ipaddr:
+        raise InventoryError(f"Device [{record.devName or '?'}] from {record.extras.source} is missing a hostname or management IP.")
+    return record
+
+
+# ========================================================================================
+# Streaming JSON.
+# ========================================================================================
+
+def iter_json_array(jsonFile, array_key="results"):
+    """
+    NOTE: Yields the items of a JSON array without loading the whole file. Accepts a
+    top-level array ([{...}, {...}]) or an API-style page ({"count": ..., "results":
+    [{...}, {...}]}). Only one device, plus one read chunk, is held at a time.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = None
+
+    def read_more():
+        chunk = jsonFile.read(READ_CHUNK_SIZE)
+        if not chunk:
+            raise InventoryError("The JSON export ended before the device list was complete.")
+        return chunk
+
+    # Locate the opening bracket of the device list.
+    while position is None:
+        buffer += read_more()
+        stripped = buffer.lstrip()
+        if not stripped:
+            continue
+        if stripped[0] == "[":
+            position = buffer.index("[") + 1
+        elif stripped[0] == "{":
+            key_at = buffer.find(f'"{array_key}"')
+            if key_at == -1:
+                continue
+            bracket_at = buffer.find("[", key_at)
+            if bracket_at == -1:
+                continue
+            position = bracket_at + 1
+        else:
+            raise InventoryError("The JSON export does not start with a device list or an API page.")
+
+    while True:
+        # Skip separators between items.
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position < len(buffer):
+                break
+            buffer, position = read_more(), 0
+        if buffer[position] == "]":
+            return
+        while True:
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+                break
+            except json.JSONDecodeError:
+                buffer = buffer[position:] + read_more()
+                position = 0
+        yield item
+        position = end
+
+
+# ========================================================================================
+# NetBox / Nautobot.
+# ========================================================================================
+
+def nested(obj, *keys):
+    for key in keys:
+        if not isinstance(obj, dict):
+            return ""
+        obj = obj.get(key)
+    return obj if obj is not None else ""
+
+def derive_device_type(platform, role):
+    """
+    NOTE: Used only when the device has no stig_device_type custom field.
+    """
+    platform = platform.lower()
+    if "nxos" in platform or "nx-os" in platform:
+        return "Switch_Nexus"
+    if "asa" in platform:
+        return "ASA_Traditional"
+    if "ios" in platform:
+        return "Router" if "router" in role.lower() else "Switch_NON_NEXUS"
+    return ""
+
+def dcim_device_values(device, source):
+    custom = device.get("custom_fields") or {}
+    primary_ip = device.get("primary_ip4") or device.get("primary_ip") or {}
+    platform = nested(device, "platform", "network_driver") or nested(device, "platform", "slug") or nested(device, "platform", "name")
+    role = nested(device, "role", "slug") or nested(device, "device_role", "slug") or nested(device, "role", "name")
+    site = device.get("location") or device.get("site") or {}
+    return {"networkType": custom.get("stig_network_type"),
+            "deviceType": custom.get("stig_device_type") or derive_device_type(platform, role),
+            "devName": device.get("name"),
+            "mgmt_ipaddr": nested(primary_ip, "address").split("/")[0],
+            "mgmt_interf": custom.get("stig_mgmt_interface"),
+            "vrf_name": custom.get("stig_vrf") or nested(primary_ip, "vrf", "name"),
+            "geo_region": custom.get("stig_geo_region"),
+            "ise_region": custom.get("stig_ise_region"),
+            "site_id": custom.get("stig_site_id") or nested(site, "slug") or nested(site, "name"),
+            "vdc_type": custom.get("stig_vdc_type"),
+            "source": source}
+
+def load_dcim_export(paths, source, defaults=None):
+    defaults = defaults or {}
+    for path in paths:
+        with open(path) as jsonFile:
+            for device in iter_json_array(jsonFile):
+                yield build_record(dcim_device_values(device, source), defaults)
+
+def load_netbox_export(paths, defaults=None):
+    return load_dcim_export(paths, "netbox", defaults)
+
+def load_nautobot_export(paths, defaults=None):
+    return load_dcim_export(paths, "nautobot", defaults)
+
+def load_rest_devices(url, token, source, defaults=None, client=None):
+    """
+    NOTE: Works with NetBox and Nautobot (or a local stand-in server that serves the
+    same JSON shape). Pass an InventoryClient to use its connection pool and device
+    cache; without one, every page is pulled fresh and nothing is cached.
+    """
+    from STIG_Modules.inventory_client import InventoryClient
+    defaults = defaults or {}
+    owned = client is None
+    if owned:
+        client = InventoryClient(token, cache_db=None)
+    try:
+        for device in client.sync_devices(url):
+            yield build_record(dcim_device_values(device, source), defaults)
+    finally:
+        if owned:
+            client.close()
+
+
+# ========================================================================================
+# YAML inventory.
+# ========================================================================================
+
+def yaml_device_values(device, source):
+    values = {"source": source}
+    for key, value in device.items():
+        key = str(key)
+        field = canonical_field(key) or (key if key in ADAPTER_EXTRA_FIELDS else None)
+        if field is not None:
+            values[field] = value
+    return values
+
+def load_yaml_inventory(path, defaults=None):
+    """
+    NOTE: Requires PyYAML (pip install pyyaml). The 'devices' list is read one entry
+    at a time with PyYAML's event parser instead of yaml.safe_load(), which would
+    build the entire inventory in memory first.
+    """
+    try:
+        import yaml
+    except ImportError:
+        raise InventoryError("YAML inventories require the PyYAML package:  pip install pyyaml") from None
+    defaults = dict(defaults or {})
+    with open(path) as yamlFile:
+        loader = yaml.SafeLoader(yamlFile)
+        try:
+            loader.get_event()                          # StreamStart
+            if loader.check_event(yaml.StreamEndEvent):
+                return
+            loader.get_event()                          # DocumentStart
+            if not loader.check_event(yaml.MappingStartEvent):
+                raise InventoryError(f"{path} must contain a mapping with a 'devices' list.")
+            loader.get_event()
+            while not loader.check_event(yaml.MappingEndEvent):
+                key = loader.construct_document(loader.compose_node(None, None))
+                if key != "devices":
+                    value = loader.construct_document(loader.compose_node(None, None))
+                    if key == "defaults" and isinstance(value, dict):
+                        for default_key, default_value in yaml_device_values(value, "yaml").items():
+                            defaults.setdefault(default_key, default_value)
+                    continue
+                if not loader.check_event(yaml.SequenceStartEvent):
+                    raise InventoryError(f"'devices' in {path} must be a list.")
+                loader.get_event()
+                while not loader.check_event(yaml.SequenceEndEvent):
+                    device = loader.construct_document(loader.compose_node(None, None))
+                    if not isinstance(device, dict):
+                        raise InventoryError(f"Every entry of 'devices' in {path} must be a mapping.")
+                    yield build_record(yaml_device_values(device, "yaml"), defaults)
+                loader.get_event()
+        except yaml.YAMLError as err:
+            raise InventoryError(f"{path} is not valid YAML: {err}") from None
+        finally:
+            loader.dispose()
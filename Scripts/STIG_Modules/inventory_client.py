@@ -0,0 +1,297 @@
+"""
+TITLE:           inventory_client.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) Pulls the device list from a live NetBox/Nautobot API in as few round
+                trips as possible:
+                - Persistent (keep-alive) connections, kept in a small pool and reused
+                  for every request of the run.
+                - The first page reports the device count; every remaining page is then
+                  requested at the same time (limit/offset paging) by a thread pool.
+                - Responses are requested gzip-compressed.
+                2) Keeps a local cache (SQLite) of the devices and of each page:
+                - Within 'cache_ttl' seconds of the last sync, no request is made at all.
+                - After that, only devices changed since the last sync are requested
+                  (?last_updated__gte=...), and a light 'brief' id listing removes any
+                  device that was deleted in the DCIM.
+                - Pages are re-requested with If-None-Match / If-Modified-Since, so an
+                  unchanged page costs a '304 Not Modified' and no download.
+
+NOTE:           Test against a local stand-in server with:
+                python -m STIG_Modules.dcim_standin <export.json> --port 8080
+                python STIG_config_builder.py --netbox http://127.0.0.1:8080/api/dcim/devices/
+"""
+
+import gzip, http.client, json, queue, sqlite3, threading, time, zlib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit, parse_qsl, urlunsplit
+
+from STIG_Modules.inventory_adapters import InventoryError
+
+
+DEFAULT_CACHE_DB = "./Generated_Configs/.stig_inventory_cache.sqlite3"
+DEFAULT_CACHE_TTL = 300           # seconds
+DEFAULT_WORKERS = 8
+DEFAULT_PAGE_SIZE = 1000          # NetBox's default MAX_PAGE_SIZE
+REQUEST_TIMEOUT = 60              # seconds
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS http_cache (
+    url             TEXT PRIMARY KEY,
+    etag            TEXT,
+    last_modified   TEXT,
+    body_z          BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS devices (
+    endpoint        TEXT NOT NULL,
+    device_id       TEXT NOT NULL,
+    name            TEXT,
+    last_updated    TEXT,
+    body_z          BLOB NOT NULL,
+    PRIMARY KEY (endpoint, device_id)
+);
+CREATE INDEX IF NOT EXISTS devices_by_name ON devices (endpoint, name);
+CREATE TABLE IF NOT EXISTS sync_state (
+    endpoint        TEXT PRIMARY KEY,
+    watermark       TEXT,
+    synced_at       REAL NOT NULL
+);
+"""
+
+
+class InventoryClientError(InventoryError):
+    pass
+
+
+def with_query(url, **params):
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    query.update({key: str(value) for key, value in params.items() if value is not None})
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ""))
+
+
+class ConnectionPool:
+    """
+    NOTE: A fixed-size pool of keep-alive connections to ONE host. A connection the
+    server has closed is transparently re-opened on its next use.
+    """
+
+    def __init__(self, base_url, size):
+        parts = urlsplit(base_url)
+        if parts.scheme not in ("http", "https"):
+            raise InventoryClientError(f"Unsupported URL: {base_url}")
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self.netloc = parts.netloc
+        self.idle = queue.LifoQueue()
+        self.size = size
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.opened < self.size:
+                self.opened += 1
+                return self.connection_class(self.netloc, timeout=REQUEST_TIMEOUT)
+        return self.idle.get()
+
+    def release(self, connection):
+        self.idle.put(connection)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class InventoryClient:
+
+    def __init__(self, token=None, cache_db=DEFAULT_CACHE_DB, cache_ttl=DEFAULT_CACHE_TTL,
+                 workers=DEFAULT_WORKERS, page_size=DEFAULT_PAGE_SIZE):
+        self.token = token
+        self.cache_ttl = cache_ttl
+        self.workers = workers
+        self.page_size = page_size
+        self.pools = {}
+        self.cache_lock = threading.Lock()
+        self.cache = None
+        if cache_db:
+            self.cache = sqlite3.connect(cache_db, check_same_thread=False)
+            self.cache.executescript(SCHEMA)
+        # Counters for the end-of-run summary.
+        self.requests = 0
+        self.not_modified = 0
+        self.bytes_downloaded = 0
+        self.devices_fetched = 0
+        self.devices_deleted = 0
+        self.from_cache_only = False
+
+    def pool_for(self, url):
+        netloc = urlsplit(url).netloc
+        pool = self.pools.get(netloc)
+        if pool is None:
+            pool = self.pools[netloc] = ConnectionPool(url, self.workers)
+        return pool
+
+    def summary_lines(self):
+        lines = ["\n" + "#"*30 + "\n## INVENTORY CLIENT SUMMARY ##\n" + "#"*30]
+        if self.from_cache_only:
+            lines.append(f"  Served from the local cache (synced less than {self.cache_ttl}s ago)")
+        lines.append(f"  HTTP requests:             {self.requests}  ({self.not_modified} not modified)")
+        lines.append(f"  Devices downloaded:        {self.devices_fetched}")
+        lines.append(f"  Deleted devices removed:   {self.devices_deleted}")
+        lines.append(f"  Bytes downloaded:          {self.bytes_downloaded}")
+        return lines
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.close()
+        if self.cache is not None:
+            self.cache.commit()
+            self.cache.close()
+            self.cache = None
+
+    # ====================================================================================
+    # One HTTP GET, with conditional-request caching.
+    # ====================================================================================
+
+    def cached_page(self, url):
+        if self.cache is None:
+            return None
+        with self.cache_lock:
+            return self.cache.execute("SELECT etag, last_modified, body_z FROM http_cache WHERE url = ?",
+                                      (url,)).fetchone()
+
+    def get_json(self, url):
+        headers = {"Accept": "application/json", "Accept-Encoding": "gzip"}
+        if self.token:
+            headers["Authorization"] = f"Token {self.token}"
+        cached = self.cached_page(url)
+        if cached:
+            if cached[0]:
+                headers["If-None-Match"] = cached[0]
+            if cached[1]:
+                headers["If-Modified-Since"] = cached[1]
+        parts = urlsplit(url)
+        path = parts.path + ("?" + parts.query if parts.query else "")
+
+        pool = self.pool_for(url)
+        connection = pool.acquire()
+        try:
+            for attempt in (1, 2):
+                try:
+                    connection.request("GET", path, headers=headers)
+                    response = connection.getresponse()
+                    body = response.read()
+                    break
+                except (http.client.HTTPException, ConnectionError) as err:
+                    # The server closed an idle keep-alive connection; reconnect once.
+                    connection.close()
+                    if attempt == 2:
+                        raise InventoryClientError(f"GET {url} failed: {err!r}") from None
+        finally:
+            pool.release(connection)
+        self.requests += 1
+
+        if response.status == 304 and cached:
+            self.not_modified += 1
+            return json.loads(zlib.decompress(cached[2]))
+        if response.status != 200:
+            raise InventoryClientError(f"GET {url} returned HTTP {response.status} {response.reason}")
+        self.bytes_downloaded += len(body)
+        if response.getheader("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        etag = response.getheader("ETag")
+        last_modified = response.getheader("Last-Modified")
+        if self.cache is not None and (etag or last_modified):
+            with self.cache_lock:
+                self.cache.execute("INSERT OR REPLACE INTO http_cache (url, etag, last_modified, body_z) "
+                                   "VALUES (?, ?, ?, ?)", (url, etag, last_modified, zlib.compress(body)))
+        return json.loads(body)
+
+    # ====================================================================================
+    # Paging.
+    # ====================================================================================
+
+    def fetch_all(self, url, **params):
+        """
+        NOTE: Requests the first page, then every remaining page concurrently. Pages
+        are yielded in order as soon as each one (and those before it) has arrived.
+        """
+        first = self.get_json(with_query(url, limit=self.page_size, offset=0, **params))
+        yield first.get("results", [])
+        count = first.get("count") or 0
+        offsets = range(self.page_size, count, self.page_size)
+        if not offsets:
+            return
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.get_json, with_query(url, limit=self.page_size, offset=offset, **params))
+                       for offset in offsets]
+            for future in futures:
+                yield future.result().get("results", [])
+
+    # ====================================================================================
+    # Device sync.
+    # ====================================================================================
+
+    def sync_devices(self, url):
+        """
+        NOTE: Brings the local device cache up to date with the DCIM and returns a
+        generator over every cached device (as the API's JSON dicts), ordered by name.
+        Without a cache, every page is simply streamed from the API.
+        """
+        if self.cache is None:
+            return self.streamed_devices(url)
+
+        state = self.cache.execute("SELECT watermark, synced_at FROM sync_state WHERE endpoint = ?",
+                                   (url,)).fetchone()
+        if state and time.time() - state[1] < self.cache_ttl:
+            self.from_cache_only = True
+            return self.cached_devices(url)
+
+        watermark = state[0] if state else None
+        newest = watermark
+        params = {"last_updated__gte": watermark} if watermark else {}
+        for page in self.fetch_all(url, **params):
+            rows = []
+            self.devices_fetched += len(page)
+            for device in page:
+                last_updated = device.get("last_updated") or ""
+                if last_updated and (newest is None or last_updated > newest):
+                    newest = last_updated
+                rows.append((url, str(device.get("id", device.get("name"))), device.get("name"), last_updated,
+                             zlib.compress(json.dumps(device, separators=(",", ":")).encode("utf-8"))))
+            with self.cache_lock:
+                self.cache.executemany("INSERT OR REPLACE INTO devices (endpoint, device_id, name, last_updated, body_z) "
+                                       "VALUES (?, ?, ?, ?, ?)", rows)
+        if watermark:
+            self.prune_deleted(url)
+        self.cache.execute("INSERT OR REPLACE INTO sync_state (endpoint, watermark, synced_at) VALUES (?, ?, ?)",
+                           (url, newest, time.time()))
+        self.cache.commit()
+        return self.cached_devices(url)
+
+    def streamed_devices(self, url):
+        for page in self.fetch_all(url):
+            self.devices_fetched += len(page)
+            yield from page
+
+    def prune_deleted(self, url):
+        live_ids = set()
+        for page in self.fetch_all(url, brief=1):
+            live_ids.update(str(device.get("id", device.get("name"))) for device in page)
+        cached_ids = [row[0] for row in self.cache.execute("SELECT device_id FROM devices WHERE endpoint = ?", (url,))]
+        deleted = [(url, device_id) for device_id in cached_ids if device_id not in live_ids]
+        self.cache.executemany("DELETE FROM devices WHERE endpoint = ? AND device_id = ?", deleted)
+        self.devices_deleted = len(deleted)
+
+    def cached_devices(self, url):
+        cursor = self.cache.execute("SELECT body_z FROM devices WHERE endpoint = ? ORDER BY name", (url,))
+        for (body_z,) in cursor:
+            yield json.loads(zlib.decompress(body_z))
@@ -0,0 +1,240 @@
+"""
+TITLE:           job_store.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) Records the progress of every Batch Mode run (a "job") in a local SQLite
+                database, so a run that dies part way through a large inventory can be
+                resumed instead of started over. For every device the job keeps:
+                - its row number in the source
+                - its status (done / failed, and why)
+                - a fingerprint of its input values
+                - the SHA-256 of the config generated for it
+                2) A resumed job re-reads the same source and skips every row already
+                recorded as done with an unchanged input fingerprint. Failed rows, and
+                rows whose input changed since, are generated again.
+                3) Progress is committed in batches (COMMIT_EVERY devices or
+                COMMIT_INTERVAL seconds, whichever comes first), and the database runs in
+                WAL mode, so a job's status can be queried while it is still running.
+
+USAGE:          From the ./Scripts directory:
+                python STIG_config_builder.py --csv big_inventory.csv --job-store
+                python STIG_config_builder.py --resume <JOB_ID>
+                python -m STIG_Modules.job_store list
+                python -m STIG_Modules.job_store status <JOB_ID>
+                python -m STIG_Modules.job_store failed <JOB_ID>
+"""
+
+import hashlib, json, os, sqlite3, sys, time
+
+from STIG_Modules.output_store import make_run_id
+
+
+# Default location of the job database, relative to ./Scripts.
+DEFAULT_JOB_DB = "./Generated_Configs/.stig_jobs.sqlite3"
+
+# Pending progress is committed after this many devices or seconds.
+COMMIT_EVERY = 500
+COMMIT_INTERVAL = 2.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id      TEXT PRIMARY KEY,
+    argv        TEXT NOT NULL,      -- JSON list of the batch command line arguments
+    status      TEXT NOT NULL,      -- 'running', 'finished' or 'aborted'
+    started     REAL NOT NULL,
+    updated     REAL NOT NULL,
+    finished    REAL,
+    resumes     INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS job_devices (
+    job_id      TEXT NOT NULL,
+    seq         INTEGER NOT NULL,   -- row number in the source, from 1
+    devName     TEXT NOT NULL,
+    status      TEXT NOT NULL,      -- 'done' or 'failed'
+    reason      TEXT,
+    input_fp    TEXT NOT NULL,
+    output_sha  TEXT,
+    updated     REAL NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+CREATE INDEX IF NOT EXISTS job_devices_by_status ON job_devices (job_id, status);
+"""
+
+
+def record_fingerprint(record):
+    """
+    NOTE: Covers every field and extra column of a DeviceRecord, so any change to a
+    device's input between two attempts is noticed.
+    """
+    values = list(record[:-1]) + [f"{name}={value}" for name, value in record.extras._asdict().items()]
+    return hashlib.blake2b("\x1f".join(values).encode("utf-8"), digest_size=16).hexdigest()
+
+
+class JobStore:
+
+    def __init__(self, db_path=DEFAULT_JOB_DB, read_only=False):
+        self.db_path = db_path
+        if read_only:
+            self.db = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        else:
+            self.db = sqlite3.connect(db_path)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    # ====================================================================================
+    # Jobs.
+    # ====================================================================================
+
+    def new_job(self, argv):
+        job_id = make_run_id()
+        now = time.time()
+        self.db.execute("INSERT INTO jobs (job_id, argv, status, started, updated) VALUES (?, ?, 'running', ?, ?)",
+                        (job_id, json.dumps(list(argv)), now, now))
+        self.db.commit()
+        return Job(self, job_id)
+
+    def resume_job(self, job_id):
+        """
+        NOTE: Returns (job, argv) for an earlier job, or None if it does not exist.
+        """
+        row = self.db.execute("SELECT argv FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        self.db.execute("UPDATE jobs SET status = 'running', finished = NULL, updated = ?, resumes = resumes + 1 "
+                        "WHERE job_id = ?", (time.time(), job_id))
+        self.db.commit()
+        return Job(self, job_id), json.loads(row[0])
+
+    def jobs(self):
+        return self.db.execute("SELECT job_id, status, started, updated, finished, resumes FROM jobs "
+                               "ORDER BY started").fetchall()
+
+    def job_stats(self, job_id):
+        job = self.db.execute("SELECT status, started, updated, finished, resumes, argv FROM jobs WHERE job_id = ?",
+                              (job_id,)).fetchone()
+        if job is None:
+            return None
+        counts = dict(self.db.execute("SELECT status, COUNT(*) FROM job_devices WHERE job_id = ? GROUP BY status",
+                                      (job_id,)).fetchall())
+        reasons = self.db.execute("SELECT reason, COUNT(*) FROM job_devices WHERE job_id = ? AND status = 'failed' "
+                                  "GROUP BY reason ORDER BY 2 DESC", (job_id,)).fetchall()
+        last = self.db.execute("SELECT seq, devName FROM job_devices WHERE job_id = ? ORDER BY seq DESC LIMIT 1",
+                               (job_id,)).fetchone()
+        return {"status": job[0], "started": job[1], "updated": job[2], "finished": job[3], "resumes": job[4],
+                "argv": json.loads(job[5]), "done": counts.get("done", 0), "failed": counts.get("failed", 0),
+                "reasons": reasons, "last_seq": last[0] if last else 0, "last_device": last[1] if last else None}
+
+    def failed_devices(self, job_id):
+        return self.db.execute("SELECT seq, devName, reason FROM job_devices WHERE job_id = ? AND status = 'failed' "
+                               "ORDER BY seq", (job_id,)).fetchall()
+
+
+class Job:
+    """
+    NOTE: The progress recorder handed to run_batch(). Rows are buffered and written
+    in batches; call close() (even after an error) to flush what is left and release
+    the database.
+    """
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.job_id = job_id
+        self.pending = []
+        self.last_commit = time.time()
+        # seq -> input fingerprint of every row already done in an earlier attempt.
+        self.done = dict(store.db.execute("SELECT seq, input_fp FROM job_devices WHERE job_id = ? AND status = 'done'",
+                                          (job_id,)).fetchall())
+
+    fingerprint = staticmethod(record_fingerprint)
+
+    def is_done(self, seq, fingerprint):
+        return self.done.get(seq) == fingerprint
+
+    def record(self, seq, devName, status, fingerprint, output_sha=None, reason=None):
+        self.pending.append((self.job_id, seq, devName, status, reason, fingerprint, output_sha, time.time()))
+        if len(self.pending) >= COMMIT_EVERY or time.time() - self.last_commit >= COMMIT_INTERVAL:
+            self.flush()
+
+    def done_device(self, seq, record, fingerprint, output_sha):
+        self.record(seq, record.devName, "done", fingerprint, output_sha=output_sha)
+
+    def failed_device(self, seq, record, fingerprint, reason):
+        self.record(seq, record.devName, "failed", fingerprint, reason=reason)
+
+    def flush(self):
+        db = self.store.db
+        db.executemany("INSERT OR REPLACE INTO job_devices (job_id, seq, devName, status, reason, input_fp, "
+                       "output_sha, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self.pending)
+        db.execute("UPDATE jobs SET updated = ? WHERE job_id = ?", (time.time(), self.job_id))
+        db.commit()
+        self.pending = []
+        self.last_commit = time.time()
+
+    def close(self, status):
+        self.flush()
+        now = time.time()
+        self.store.db.execute("UPDATE jobs SET status = ?, updated = ?, finished = ? WHERE job_id = ?",
+                              (status, now, now if status == "finished" else None, self.job_id))
+        self.store.db.commit()
+        self.store.close()
+
+
+# ========================================================================================
+# Command line.
+# ========================================================================================
+
+def print_status(job_id, stats):
+    processed = stats["done"] + stats["failed"]
+    elapsed = (stats["finished"] or stats["updated"]) - stats["started"]
+    print(f"Job:              {job_id}   ({stats['status']}, resumed {stats['resumes']} times)")
+    print(f"Source:           {' '.join(stats['argv'])}")
+    print(f"Devices done:     {stats['done']}")
+    print(f"Devices failed:   {stats['failed']}")
+    for reason, count in stats["reasons"]:
+        print(f"    {reason:<22} {count}")
+    print(f"Last row:         {stats['last_seq']}  [{stats['last_device']}]")
+    if elapsed > 0 and processed:
+        print(f"Rate:             {processed / elapsed:.0f} devices/s over {elapsed:.1f}s")
+    if stats["status"] == "running":
+        print(f"Last update:      {time.time() - stats['updated']:.0f}s ago")
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m STIG_Modules.job_store",
+                                     description="Query Batch Mode jobs (also while they are running).")
+    parser.add_argument("--db", default=DEFAULT_JOB_DB, help="path to the job database")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="list every recorded job")
+    p_status = sub.add_parser("status", help="show the progress of a job")
+    p_status.add_argument("job_id")
+    p_failed = sub.add_parser("failed", help="list the devices that failed in a job")
+    p_failed.add_argument("job_id")
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(args.db):
+        print(f"No job database was found at: {args.db}")
+        return 1
+    store = JobStore(args.db, read_only=True)
+    if args.command == "list":
+        for job_id, status, started, updated, finished, resumes in store.jobs():
+            print(f"{job_id}   {status:<9} started: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started))}"
+                  f"   resumed: {resumes}")
+        return 0
+    stats = store.job_stats(args.job_id)
+    if stats is None:
+        print(f"Job {args.job_id} was not found in {args.db}")
+        return 1
+    if args.command == "status":
+        print_status(args.job_id, stats)
+    elif args.command == "failed":
+        for seq, devName, reason in store.failed_devices(args.job_id):
+            print(f"{seq:>8}  {devName:<30} {reason}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+"""
+TITLE:           output_store.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) An optional, content-addressed store for generated STIG configs. Every
+                rendered config is saved once as a 'blob' named by the SHA-256 of its
+                contents. A small per-hostname index records which blob each device
+                received on every run, so older generations are kept at no extra cost
+                when the config did not change.
+                2) The familiar ./Generated_Configs/STIG_Config_<devName> files are still
+                created, but as hardlinks to the blob instead of full copies. If the
+                filesystem does not support hardlinks, a regular copy is made instead.
+
+LAYOUT:         <store_root>/objects/<first 2 chars of sha256>/<sha256>
+                <store_root>/index/<devName>      <--- one line per run: "<run_id> <sha256>"
+
+NOTE:           Blobs are written read-only. Because the published config file is a
+                hardlink to the blob, it is read-only as well. This is intentional; it
+                prevents a hand-edit of one device's file from silently changing every
+                other device (and every older run) that shares the same blob.
+"""
+
+import hashlib, os, shutil, stat, tempfile, time
+
+
+# Number of hex characters used for the blob fan-out directories.
+BLOB_FANOUT = 2
+
+
+def make_run_id():
+    """
+    NOTE: Run IDs sort in the order the runs happened, which keeps every index file
+    in chronological order without needing to parse the timestamps.
+    """
+    return time.strftime("%Y%m%dT%H%M%S") + f"-{os.getpid()}"
+
+
+def check_index_name(devName):
+    """
+    NOTE: A hostname names its index file, so it must stay a plain file name inside
+    the store. Raises ValueError otherwise.
+    """
+    if not devName or "/" in devName or "\\" in devName or devName.startswith("."):
+        raise ValueError(f"The hostname [{devName}] cannot be used as a file name "
+                         "(it is empty, starts with '.' or contains '/' or '\\').")
+
+
+class ContentStore:
+
+    def __init__(self, store_root, run_id=None):
+        self.store_root = store_root
+        self.objects_path = os.path.join(store_root, "objects")
+        self.index_path = os.path.join(store_root, "index")
+        self.run_id = run_id or make_run_id()
+        os.makedirs(self.objects_path, exist_ok=True)
+        os.makedirs(self.index_path, exist_ok=True)
+        # Counters for the end-of-run summary.
+        self.blobs_written = 0
+        self.blobs_reused = 0
+
+    def blob_path(self, digest):
+        return os.path.join(self.objects_path, digest[:BLOB_FANOUT], digest)
+
+    def put_blob(self, output):
+        """
+        NOTE: Writes the rendered config into the store (only if an identical config
+        was not already stored) and returns its SHA-256 digest.
+        """
+        data = output.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        target = self.blob_path(digest)
+        if os.path.exists(target):
+            self.blobs_reused += 1
+            return digest
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Write to a temporary file first so a crash never leaves a partial blob behind.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix=".tmp_")
+        try:
+            with os.fdopen(fd, "wb") as tmpFile:
+                tmpFile.write(data)
+            os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.blobs_written += 1
+        return digest
+
+    def index_file(self, devName):
+        check_index_name(devName)
+        return os.path.join(self.index_path, devName)
+
+    def record(self, devName, digest):
+        """
+        NOTE: Appends this run's blob to the device's index. Re-running the same
+        run_id for a device (e.g. a retried row) does not add a duplicate entry.
+        """
+        entry = f"{self.run_id} {digest}\n"
+        index_file = self.index_file(devName)
+        if os.path.exists(index_file):
+            with open(index_file) as idxFile:
+                if entry in idxFile.readlines():
+                    return
+        with open(index_file, "a") as idxFile:
+            idxFile.write(entry)
+
+    def publish(self, digest, dest_path):
+        """
+        NOTE: Places the blob at dest_path as a hardlink. Falls back to a plain copy
+        when hardlinks are not possible (e.g. the store lives on another filesystem).
+        """
+        source = self.blob_path(digest)
+        if os.path.lexists(dest_path):
+            if os.path.exists(dest_path) and os.path.samefile(source, dest_path):
+                return
+            os.remove(dest_path)
+        try:
+            os.link(source, dest_path)
+        except OSError:
+            shutil.copyfile(source, dest_path)
+
+    def save(self, devName, output, dest_path):
+        """
+        NOTE: The one call File Mode and Interactive Mode need: store the config,
+        index it under the hostname, and publish it to the usual output location.
+        """
+        check_index_name(devName)
+        digest = self.put_blob(output)
+        self.record(devName, digest)
+        self.publish(digest, dest_path)
+        return digest
+
+    # ====================================================================================
+    # Read-only queries against the store.
+    # ====================================================================================
+
+    def history(self, devName):
+        """
+        NOTE: Returns [(run_id, sha256), ...] for a device, oldest first.
+        """
+        index_file = self.index_file(devName)
+        if not os.path.exists(index_file):
+            return []
+        with open(index_file) as idxFile:
+            return [tuple(line.split()) for line in idxFile if line.strip()]
+
+    def current(self, devName):
+        entries = self.history(devName)
+        if not entries:
+            return None
+        return entries[-1][1]
+
+    def read_blob(self, digest):
+        with open(self.blob_path(digest)) as blobFile:
+            return blobFile.read()
+
+    def stats(self):
+        """
+        NOTE: Summarizes how much space the store is saving. 'logical_bytes' is what
+        the same history would cost if every run kept a full copy of every config.
+        """
+        blob_sizes = {}
+        for fanout in os.scandir(self.objects_path):
+            if not fanout.is_dir():
+                continue
+            for blob in os.scandir(fanout.path):
+                if not blob.name.startswith(".tmp_"):
+                    blob_sizes[blob.name] = blob.stat().st_size
+        logical_bytes = 0
+        devices = 0
+        for entry in os.scandir(self.index_path):
+            devices += 1
+            for run_id, digest in self.history(entry.name):
+                logical_bytes += blob_sizes.get(digest, 0)
+        return {"devices": devices,
+                "blobs": len(blob_sizes),
+                "stored_bytes": sum(blob_sizes.values()),
+                "logical_bytes": logical_bytes}
+
+    def prune(self):
+        """
+        NOTE: Removes blobs that no device index points to anymore (i.e. after an index
+        file was deleted by hand). Returns the number of blobs removed.
+        """
+        referenced = set()
+        for entry in os.scandir(self.index_path):
+            for run_id, digest in self.history(entry.name):
+                referenced.add(digest)
+        removed = 0
+        for fanout in os.scandir(self.objects_path):
+            if not fanout.is_dir():
+                continue
+            for blob in os.scandir(fanout.path):
+                if blob.name not in referenced:
+                    os.remove(blob.path)
+                    removed += 1
+        return removed
@@ -0,0 +1,146 @@
+"""
+TITLE:           placeholder_values.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) Fills in the [ReplaceThisValueWith:KEY] values the Jinja templates leave
+                for operators (LOGIN_BANNER_MESSAGE, SYSLOG_DISCRIMINATOR_NAME, VTY_ACL,
+                ...) from a value map, so generated configs need less editing by hand.
+                2) The value map (STIG_Templates/placeholder_values.csv) is read ONE time
+                per run. Each row is:  "site_id","networkType","KEY","VALUE"  where
+                site_id and networkType may be "*" for any. The most specific row wins:
+                site + networkType, then site, then networkType, then "*","*".
+                3) The merged values of every site/networkType are built once and shared
+                by every device of that site. Each config is filled in one pass over its
+                text, and all the keys a device has no value for are reported together.
+
+NOTE:           Only named keys are filled; positional values such as
+                [ReplaceThisValueWith:x.x.x.x] are left alone (see config_lint.py).
+                A row with an empty VALUE counts as no value. Passwords and keys (any
+                KEY ending in _PASSWORD) are refused: they would sit in plain text in
+                the map, so they stay placeholders and are reported as unfilled.
+"""
+
+import collections, csv, re
+
+from STIG_Modules.reference_store import DEFAULT_STIG_TEMPLATES_PATH
+
+
+DEFAULT_PLACEHOLDER_VALUES = DEFAULT_STIG_TEMPLATES_PATH + "placeholder_values.csv"
+ANY = "*"
+PLACEHOLDER_TOKEN = "[ReplaceThisValueWith:"
+PLACEHOLDER = re.compile(r"\[ReplaceThisValueWith:([A-Za-z_][A-Za-z0-9_]*)\]")
+SECRET_KEY_SUFFIX = "_PASSWORD"
+
+
+class PlaceholderValuesError(ValueError):
+    pass
+
+
+def read_value_map(path):
+    """
+    NOTE: {(site_id, networkType): {KEY: VALUE}} from the value map file.
+    """
+    scopes = {}
+    try:
+        with open(path, newline="") as valuesFile:
+            for line_number, row in enumerate(csv.reader(valuesFile), start=1):
+                if not row or not "".join(row).strip():
+                    continue
+                if len(row) != 4:
+                    raise PlaceholderValuesError(f"[{path}] line {line_number}: expected 4 values "
+                                                 f"(site_id, networkType, KEY, VALUE) but found {len(row)}.")
+                site_id, networkType, key, value = (field.strip() for field in row)
+                if not PLACEHOLDER.fullmatch(PLACEHOLDER_TOKEN + key + "]"):
+                    raise PlaceholderValuesError(f"[{path}] line {line_number}: [{key}] is not a placeholder key.")
+                if value and key.endswith(SECRET_KEY_SUFFIX):
+                    raise PlaceholderValuesError(f"[{path}] line {line_number}: [{key}] is a secret; it cannot "
+                                                 "be given a plain text value in the placeholder value map.")
+                if value:
+                    scopes.setdefault((site_id or ANY, networkType or ANY), {})[key] = value
+    except OSError as err:
+        raise PlaceholderValuesError(f"The placeholder value map could not be read: {err}") from None
+    return scopes
+
+
+class PlaceholderValues:
+    """
+    NOTE: The substitution stage of run_batch(). fill() fills a whole config, filler()
+    fills a streamed config piece by piece as the writer writes it.
+    """
+
+    def __init__(self, path=DEFAULT_PLACEHOLDER_VALUES):
+        self.path = path
+        self.scopes = read_value_map(path)
+        self.site_values = {}
+        self.devices_filled = 0
+        self.placeholders_filled = 0
+        self.missing_keys = collections.Counter()
+
+    def values_for(self, site_id, networkType):
+        key = (site_id, networkType)
+        values = self.site_values.get(key)
+        if values is None:
+            values = {}
+            for scope in ((ANY, ANY), (ANY, networkType), (site_id, ANY), (site_id, networkType)):
+                values.update(self.scopes.get(scope, ()))
+            self.site_values[key] = values
+        return values
+
+    def substitute(self, text, values, missing):
+        """
+        NOTE: One pass over 'text'. Keys with no value are left in place and added to
+        the set 'missing'.
+        """
+        if PLACEHOLDER_TOKEN not in text:
+            return text
+
+        def replace(match):
+            value = values.get(match.group(1))
+            if value is None:
+                missing.add(match.group(1))
+                return match.group(0)
+            self.placeholders_filled += 1
+            return value
+        return PLACEHOLDER.sub(replace, text)
+
+    def fill(self, record, text, missing):
+        from STIG_Modules.batch_render import extra_value
+        return self.substitute(text, self.values_for(extra_value(record, "site_id"), record.networkType), missing)
+
+    def filler(self, record, missing):
+        """
+        NOTE: Returns the 'substitute' callable for OutputWriter.save_stream(): given a
+        piece of the config it returns the filled text up to the last line break
+        (placeholders never span lines), and given None it returns the rest.
+        """
+        from STIG_Modules.batch_render import extra_value
+        values = self.values_for(extra_value(record, "site_id"), record.networkType)
+        tail = [""]
+
+        def substitute(piece):
+            if piece is None:
+                text, tail[0] = tail[0], ""
+                return self.substitute(text, values, missing)
+            cut = piece.rfind("\n") + 1
+            if not cut:
+                tail[0] += piece
+                return ""
+            text, tail[0] = tail[0] + piece[:cut], piece[cut:]
+            return self.substitute(text, values, missing)
+        return substitute
+
+    def finish(self, missing):
+        self.devices_filled += 1
+        self.missing_keys.update(missing)
+
+    def summary_lines(self):
+        lines = ["\n" + "#"*25 + "\n## PLACEHOLDER SUMMARY ##\n" + "#"*25,
+                 f"  Value map:                 {self.path}",
+                 f"  Scopes loaded:             {len(self.scopes)} ({len(self.site_values)} site/network maps built)",
+                 f"  Configs filled:            {self.devices_filled}",
+                 f"  Placeholders filled:       {self.placeholders_filled}",
+                 f"  Keys with no value:        {len(self.missing_keys)}"]
+        for key, devices in sorted(self.missing_keys.items()):
+            lines.append(f"      {key:<30} {devices} device{'s' if devices != 1 else ''}")
+        return lines
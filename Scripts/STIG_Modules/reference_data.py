@@ -0,0 +1,232 @@
+"""
+TITLE:           reference_data.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) Loads the Corporate STIG reference data in ./STIG_Templates ONE time and
+                answers the same questions Interactive Mode asks of those files (AAA and
+                NTP servers per network/region, SNMP location and contact per site, the
+                site password, and the SNMP users per platform).
+                2) Used by the batch pipeline so that devices coming from an inventory
+                source only need a Corporate Site ID and a region, instead of repeating
+                every server address and password on every row.
+                3) The data itself comes from the compiled cache of reference_store.py
+                (stig_reference.csv, or the individual files until it exists).
+                4) site_context() resolves everything tied to one Corporate Site ID,
+                networkType and region (AAA and NTP servers, SNMP location/contact/phone
+                and the site password) ONE time into an immutable SiteContext, which every
+                device of that site then shares. A rollout of hundreds of devices per
+                site needs only a handful of lookups.
+                5) Given a SecretProvider (secret_vault.py), the site passwords and SNMP
+                users come from the encrypted vault instead of the csv files.
+                6) Given ServerLatency (server_latency.py), the AAA and NTP servers of a
+                measured site are picked and ordered by RTT instead of by region.
+
+NOTE:           The network-to-file mapping (NETWORK_FILES in reference_store.py) follows
+                the same rules as the AAA/NTP Server selection section of
+                STIG_config_builder.py. If you rename a networkType there, update
+                NETWORK_FILES as well.
+"""
+
+from collections import namedtuple
+
+from STIG_Modules.reference_store import DEFAULT_STIG_TEMPLATES_PATH, SERVER_COUNT, ReferenceStore
+
+
+# Networks whose SNMP contact is always the Corporate HQ Network Department.
+HQ_MANAGED_NETWORKS = ("UNDERLAY", "UNDERLAYv2", "DATACENTER_DC", "COMMERCIAL")
+HQ_CONTACT = "Corporate HQ Network Department"
+HQ_CONTACT_PHONE = "REPLACE_WITH_10_DIGIT_PHONE_OF_CORPORATE_NETWORK_DEPT"
+
+IOS_DEVICE_TYPES = ("Router", "Switch_NON_NEXUS")
+NEXUS_DEVICE_TYPES = ("Switch_Nexus",)
+ASA_DEVICE_TYPES = ("ASA_Traditional", "ASA_Firepower_21xx", "ASA_Firepower_41xx")
+
+
+MISSING_SITE_ID = "a Corporate Site ID (site_id) is required to look up the SNMP location, contact and site password."
+
+
+class ReferenceDataError(LookupError):
+    pass
+
+
+# A lookup that failed while a SiteContext was built; raised again for every device
+# that needs that value.
+LookupFailure = namedtuple("LookupFailure", ("message",))
+
+
+class SiteContext(namedtuple("SiteContext", ("aaa", "ntp", "snmp", "site_password"))):
+    """
+    NOTE: The resolved reference values shared by every device with the same site_id,
+    networkType and regions:
+        aaa            (aaaServer_PRI, aaaServer_SEC)
+        ntp            (ntpServer_Prefer, ntpServer_SEC, ntpServer_TER, ntpServer_ALT)
+        snmp           (snmp_loc, snmp_contact, snmp_contact_phone)
+        site_password  enable secret of the site
+    Each field holds either its value or a LookupFailure; value() raises the failure.
+    """
+    __slots__ = ()
+
+    def value(self, field):
+        value = getattr(self, field)
+        if isinstance(value, LookupFailure):
+            raise ReferenceDataError(value.message)
+        return value
+
+
+class ReferenceData:
+
+    def __init__(self, stig_templates_path=DEFAULT_STIG_TEMPLATES_PATH, secrets=None, latency=None):
+        self.stig_templates_path = stig_templates_path
+        self.store = ReferenceStore.open(stig_templates_path)
+        self.secrets = secrets
+        self.latency = latency
+        # Counts how many lookups were answered, for end-of-run reporting.
+        self.lookups = 0
+        # (site_id, networkType, geo_region, ise_region) -> SiteContext
+        self.site_contexts = {}
+        self.site_context_hits = 0
+        # (deviceType, vdc_type) -> (READ row, WRITE row) or LookupFailure
+        self.platform_users = {}
+
+    def region_lookup(self, values, kind, networkType, region):
+        self.lookups += 1
+        if not values:
+            raise ReferenceDataError(f"No {kind} servers are listed for network [{networkType}] in region [{region}].")
+        return values
+
+    # ====================================================================================
+    # Keyed lookups.
+    # ====================================================================================
+
+    def aaa_servers(self, networkType, region):
+        return self.region_lookup(self.store.aaa(networkType, region), "AAA", networkType, region)
+
+    def ntp_servers(self, networkType, region):
+        return self.region_lookup(self.store.ntp(networkType, region), "NTP", networkType, region)
+
+    def site_servers(self, dataset, site_id, networkType, region):
+        """
+        NOTE: The AAA or NTP servers for a site: by measured latency when there is
+        latency data for the site, by region otherwise.
+        """
+        lookup = self.aaa_servers if dataset == "aaa" else self.ntp_servers
+        if self.latency is None or not site_id:
+            return lookup(networkType, region)
+        static = self.attempt(lookup, networkType, region)
+        ordered = self.latency.order(site_id, self.store.network_servers(dataset, networkType),
+                                     () if isinstance(static, LookupFailure) else static, SERVER_COUNT[dataset])
+        if ordered is None:
+            return lookup(networkType, region)
+        return ordered
+
+    def snmp_site(self, site_id, networkType):
+        """
+        NOTE: Returns (snmp_loc, snmp_contact, snmp_contact_phone) for a Corporate Site
+        ID. Devices in the HQ-managed networks always list the Corporate HQ contact.
+        """
+        self.lookups += 1
+        site = self.store.site(site_id)
+        if site is None or "snmp-server" not in (site.snmp_location or ""):
+            raise ReferenceDataError(f"Corporate Site ID [{site_id}] has no SNMP location in the STIG reference data.")
+        if networkType in HQ_MANAGED_NETWORKS:
+            return site.snmp_location, HQ_CONTACT, HQ_CONTACT_PHONE
+        if "Network Department" not in site.snmp_contact:
+            raise ReferenceDataError(f"Corporate Site ID [{site_id}] has no valid SNMP Contact in the STIG reference data.")
+        return site.snmp_location, site.snmp_contact, site.snmp_contact_phone
+
+    def site_password(self, site_id):
+        self.lookups += 1
+        if self.secrets is not None:
+            secrets = self.secrets.site_secret(site_id)
+            if secrets is None:
+                raise ReferenceDataError(f"Corporate Site ID [{site_id}] has no site password in the secret vault.")
+            return secrets[0]
+        site = self.store.site(site_id)
+        if site is None or site.enable_secret is None:
+            raise ReferenceDataError(f"Corporate Site ID [{site_id}] has no site password in the STIG reference data.")
+        return site.enable_secret
+
+    def snmp_user_rows(self, deviceType, vdc_type):
+        """
+        NOTE: Returns the (READ, WRITE) rows of the snmp_users_*.csv file that apply
+        to the device, each as [condition, user, role, authPW, privPW, userACL].
+        """
+        self.lookups += 1
+        source = self.store if self.secrets is None else self.secrets
+        if deviceType in IOS_DEVICE_TYPES:
+            rows = source.snmp_users("IOS")
+        elif deviceType in NEXUS_DEVICE_TYPES and vdc_type in ("admin", "service"):
+            rows = source.snmp_users("NEXUS", vdc_type)
+        elif deviceType in NEXUS_DEVICE_TYPES:
+            raise ReferenceDataError("Nexus devices need a vdc_type of 'admin' or 'service' to select SNMP users.")
+        elif deviceType in ASA_DEVICE_TYPES:
+            rows = source.snmp_users("ASA")
+        else:
+            raise ReferenceDataError(f"SNMP users cannot be selected for deviceType [{deviceType}].")
+        if rows is None:
+            raise ReferenceDataError(f"The SNMP users for [{deviceType}] are missing a READ or WRITE user.")
+        return rows
+
+    # ====================================================================================
+    # Shared per-site and per-platform results.
+    # ====================================================================================
+
+    @staticmethod
+    def attempt(lookup, *args):
+        try:
+            return lookup(*args)
+        except ReferenceDataError as err:
+            return LookupFailure(str(err))
+
+    def site_context(self, site_id, networkType, geo_region, ise_region):
+        """
+        NOTE: Returns the SiteContext for a site, building it on first use. The AAA
+        servers follow ise_region (or geo_region when blank), the NTP servers follow
+        geo_region.
+        """
+        key = (site_id, networkType, geo_region, ise_region)
+        context = self.site_contexts.get(key)
+        if context is not None:
+            self.site_context_hits += 1
+            return context
+        if site_id:
+            snmp = self.attempt(self.snmp_site, site_id, networkType)
+            site_password = self.attempt(self.site_password, site_id)
+        else:
+            snmp = site_password = LookupFailure(MISSING_SITE_ID)
+        context = self.site_contexts[key] = SiteContext(
+            aaa = self.attempt(self.site_servers, "aaa", site_id, networkType, ise_region or geo_region),
+            ntp = self.attempt(self.site_servers, "ntp", site_id, networkType, geo_region),
+            snmp = snmp,
+            site_password = site_password)
+        return context
+
+    def platform_user_rows(self, deviceType, vdc_type):
+        """
+        NOTE: snmp_user_rows(), looked up once per deviceType and vdc_type.
+        """
+        key = (deviceType, vdc_type)
+        rows = self.platform_users.get(key)
+        if rows is None:
+            rows = self.platform_users[key] = self.attempt(self.snmp_user_rows, deviceType, vdc_type)
+        if isinstance(rows, LookupFailure):
+            raise ReferenceDataError(rows.message)
+        return rows
+
+    @staticmethod
+    def logging_syntax(deviceType, vrf_exists, vrf_name):
+        """
+        NOTE: Mirrors the 'Identify device-specific Syslog syntax' section of the script.
+        """
+        if deviceType in IOS_DEVICE_TYPES:
+            if vrf_exists == "yes":
+                return f"logging host x.x.x.x vrf {vrf_name} transport udp port xxxxx"
+            return "logging host x.x.x.x transport udp port xxxxx"
+        if deviceType in NEXUS_DEVICE_TYPES:
+            if vrf_exists == "yes":
+                return f"logging server x.x.x.x 6 port xxxxx use-vrf {vrf_name}"
+            return "logging server x.x.x.x 6 port xxxxx"
+        if deviceType in ASA_DEVICE_TYPES:
+            return "not_required"
+        raise ReferenceDataError(f"Syslog syntax cannot be generated for deviceType [{deviceType}].")
@@ -0,0 +1,353 @@
+"""
+TITLE:           reference_store.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) The Corporate STIG reference data as ONE keyed csv file
+                (STIG_Templates/stig_reference.csv), replacing the 13 separate files.
+                Every row names its dataset and key, followed by the values:
+                    DATASET,KEY,VALUES...
+                    aaa,DEFAULT:REGION_A,192.168.0.100,192.168.0.101
+                    aaa,UNDERLAY:*,172.18.0.100,172.18.0.101
+                    ntp,OOB:REGION_A,192.168.50.110,192.168.50.111,192.168.50.112,192.168.50.113
+                    snmp_location,ID001,"Corporate HQ, ...",Some_Country,"snmp-server location ...",...
+                    site_password,ID001,EnableSecretPassword,d47d1cdfe7ddca9bc963296e2ee83656
+                    snmp_user,NEXUS:READuser_admin,SNMP_Read_Username,network-operator,...
+                - The network part of an aaa/ntp key is DEFAULT, UNDERLAY, UNDERLAYv2 or
+                  OOB (the same split as the aaa_servers*/ntp_servers* files); a region
+                  of '*' applies to every region.
+                2) The parsed data is compiled into a binary cache
+                (STIG_Templates/.stig_reference.cache) stamped with the SHA-256 of its
+                source, so later runs load it in milliseconds without parsing any csv.
+                The cache is rebuilt automatically whenever the source changes.
+                3) Until stig_reference.csv is created, the 13 individual files are the
+                source, and are compiled into the same cache.
+
+USAGE:          From the ./Scripts directory:
+                python -m STIG_Modules.reference_store consolidate     <--- create stig_reference.csv
+                python -m STIG_Modules.reference_store info
+                python -m STIG_Modules.reference_store query aaa OVERLAY REGION_A
+
+NOTE:           Interactive Mode still reads the individual files. Keep them in step with
+                stig_reference.csv (re-run 'consolidate') until it is moved over as well.
+"""
+
+import csv, hashlib, os, pickle, sys
+from collections import namedtuple
+
+
+DEFAULT_STIG_TEMPLATES_PATH = "STIG_Templates/"
+REFERENCE_FILE = "stig_reference.csv"
+CACHE_FILE = ".stig_reference.cache"
+CACHE_FORMAT = 1
+
+# Network part of an aaa/ntp key -> suffix of the matching individual file.
+NETWORK_FILES = {"DEFAULT": "",
+                 "UNDERLAY": "_UNDERLAY",
+                 "UNDERLAYv2": "_UNDERLAYv2",
+                 "OOB": "_OOB"}
+
+GEO_REGIONS = ("REGION_A", "REGION_B", "REGION_C", "REGION_D")
+
+SNMP_PLATFORMS = ("IOS", "NEXUS", "ASA")
+
+SERVER_COUNT = {"aaa": 2, "ntp": 4}
+
+REFERENCE_HEADER = ("DATASET", "KEY", "VALUES...")
+
+Site = namedtuple("Site", ("site_id", "site_name", "country", "snmp_location", "snmp_contact",
+                           "snmp_contact_phone", "enable_secret", "enable_secret_md5"))
+
+
+class ReferenceStoreError(ValueError):
+    pass
+
+
+def read_csv_rows(path):
+    if not os.path.isfile(path):
+        return []
+    with open(path, newline='') as csvFile:
+        return [row for row in csv.reader(csvFile) if row]
+
+def legacy_files():
+    files = []
+    for suffix in NETWORK_FILES.values():
+        files.append("aaa_servers" + suffix + ".csv")
+        files.append("ntp_servers" + suffix + ".csv")
+    files += ["site_passwords.csv", "snmp_locations.csv"]
+    files += [f"snmp_users_{platform}.csv" for platform in SNMP_PLATFORMS]
+    return files
+
+def network_label(networkType):
+    return networkType if networkType in NETWORK_FILES else "DEFAULT"
+
+
+# ========================================================================================
+# Parsing (only done when the cache is missing or stale).
+# ========================================================================================
+
+def empty_data():
+    return {"aaa": {label: {} for label in NETWORK_FILES},
+            "ntp": {label: {} for label in NETWORK_FILES},
+            "snmp_locations": {},
+            "site_passwords": {},
+            "snmp_users": {platform: {} for platform in SNMP_PLATFORMS}}
+
+def parse_legacy_files(stig_templates_path):
+    """
+    NOTE: Region tables have one row per region ("REGION_A", ip, ip, ...). The
+    UNDERLAY aaa files have a single row of IPs with no region; that row applies to
+    every region, and is stored under the key None.
+    """
+    data = empty_data()
+    for label, suffix in NETWORK_FILES.items():
+        for dataset, width in SERVER_COUNT.items():
+            filename = ("aaa_servers" if dataset == "aaa" else "ntp_servers") + suffix + ".csv"
+            for row in read_csv_rows(os.path.join(stig_templates_path, filename)):
+                if row[0] in GEO_REGIONS:
+                    data[dataset][label][row[0]] = tuple(row[1:width + 1])
+                else:
+                    data[dataset][label][None] = tuple(row[:width])
+    for row in read_csv_rows(os.path.join(stig_templates_path, "snmp_locations.csv")):
+        data["snmp_locations"][row[0]] = tuple(row)
+    for row in read_csv_rows(os.path.join(stig_templates_path, "site_passwords.csv")):
+        data["site_passwords"][row[0]] = tuple(row)
+    for platform in SNMP_PLATFORMS:
+        for row in read_csv_rows(os.path.join(stig_templates_path, f"snmp_users_{platform}.csv")):
+            data["snmp_users"][platform][row[0]] = tuple(row)
+    return data
+
+def parse_reference_file(path):
+    data = empty_data()
+    for line_number, row in enumerate(read_csv_rows(path), start=1):
+        dataset = row[0].strip()
+        if dataset.startswith("#") or dataset == REFERENCE_HEADER[0]:
+            continue
+        if len(row) < 3:
+            raise ReferenceStoreError(f"{path} line {line_number}: expected DATASET,KEY,VALUES...")
+        key, values = row[1].strip(), tuple(row[2:])
+        if dataset in SERVER_COUNT:
+            label, separator, region = key.partition(":")
+            if not separator or label not in NETWORK_FILES:
+                raise ReferenceStoreError(f"{path} line {line_number}: [{key}] should be NETWORK:REGION with a NETWORK of {', '.join(NETWORK_FILES)}.")
+            data[dataset][label][None if region == "*" else region] = values[:SERVER_COUNT[dataset]]
+        elif dataset == "snmp_location":
+            data["snmp_locations"][key] = (key,) + values
+        elif dataset == "site_password":
+            data["site_passwords"][key] = (key,) + values
+        elif dataset == "snmp_user":
+            platform, separator, condition = key.partition(":")
+            if not separator or platform not in SNMP_PLATFORMS:
+                raise ReferenceStoreError(f"{path} line {line_number}: [{key}] should be PLATFORM:CONDITION with a PLATFORM of {', '.join(SNMP_PLATFORMS)}.")
+            data["snmp_users"][platform][condition] = (condition,) + values
+        else:
+            raise ReferenceStoreError(f"{path} line {line_number}: unknown dataset [{dataset}].")
+    return data
+
+def consolidated_rows(data):
+    """
+    NOTE: The rows of stig_reference.csv for already-parsed reference data.
+    """
+    yield REFERENCE_HEADER
+    for dataset in SERVER_COUNT:
+        for label, table in data[dataset].items():
+            for region, values in table.items():
+                yield (dataset, f"{label}:{region or '*'}") + tuple(values)
+    for site_id, row in data["snmp_locations"].items():
+        yield ("snmp_location", site_id) + tuple(row[1:])
+    for site_id, row in data["site_passwords"].items():
+        yield ("site_password", site_id) + tuple(row[1:])
+    for platform, table in data["snmp_users"].items():
+        for condition, row in table.items():
+            if condition != "DETERMINING_CONDITION":
+                yield ("snmp_user", f"{platform}:{condition}") + tuple(row[1:])
+
+
+# ========================================================================================
+# The compiled store.
+# ========================================================================================
+
+class ReferenceStore:
+
+    def __init__(self, data, source_files, source_hash, from_cache):
+        self.data = data
+        self.source_files = source_files
+        self.source_hash = source_hash
+        self.from_cache = from_cache
+
+    @classmethod
+    def open(cls, stig_templates_path=DEFAULT_STIG_TEMPLATES_PATH):
+        """
+        NOTE: Loads the compiled cache when it matches the current source files. A
+        quick size/mtime comparison is tried first; only when that differs are the
+        sources hashed, and only when the hash differs is any csv parsed again.
+        """
+        if os.path.isfile(os.path.join(stig_templates_path, REFERENCE_FILE)):
+            source_files = [REFERENCE_FILE]
+        else:
+            source_files = legacy_files()
+        paths = [os.path.join(stig_templates_path, filename) for filename in source_files]
+        stamps = [file_stamp(path) for path in paths]
+        cache_path = os.path.join(stig_templates_path, CACHE_FILE)
+
+        cached = load_cache(cache_path)
+        if cached and cached["source_files"] == source_files and cached["stamps"] == stamps:
+            return cls(cached["data"], source_files, cached["source_hash"], True)
+        source_hash = hash_files(paths)
+        if cached and cached["source_files"] == source_files and cached["source_hash"] == source_hash:
+            cached["stamps"] = stamps
+            save_cache(cache_path, cached)
+            return cls(cached["data"], source_files, source_hash, True)
+
+        if source_files == [REFERENCE_FILE]:
+            data = parse_reference_file(paths[0])
+        else:
+            data = parse_legacy_files(stig_templates_path)
+        save_cache(cache_path, {"format": CACHE_FORMAT, "source_files": source_files, "stamps": stamps,
+                                "source_hash": source_hash, "data": data})
+        return cls(data, source_files, source_hash, False)
+
+    # ====================================================================================
+    # Keyed queries. Each returns None when the reference data has no match.
+    # ====================================================================================
+
+    def servers(self, dataset, network, region):
+        table = self.data[dataset][network_label(network)]
+        return table.get(region) or table.get(None)
+
+    def network_servers(self, dataset, network):
+        """
+        NOTE: Every server of a network, over all its regions, in file order.
+        """
+        servers = {}
+        for values in self.data[dataset][network_label(network)].values():
+            servers.update(dict.fromkeys(values))
+        return tuple(servers)
+
+    def aaa(self, network, region):
+        return self.servers("aaa", network, region)
+
+    def ntp(self, network, region):
+        return self.servers("ntp", network, region)
+
+    def snmp_users(self, platform, vdc_type=None):
+        """
+        NOTE: Returns the (READ, WRITE) rows for the platform, each as [condition,
+        user, role, authPW, privPW, userACL]. Nexus admin VDCs use the *_admin users.
+        """
+        table = self.data["snmp_users"].get(platform, {})
+        if platform == "NEXUS" and vdc_type == "admin":
+            conditions = ("READuser_admin", "WRITEuser_admin")
+        else:
+            conditions = ("READuser", "WRITEuser")
+        if conditions[0] not in table or conditions[1] not in table:
+            return None
+        return table[conditions[0]], table[conditions[1]]
+
+    def site(self, site_id):
+        location = self.data["snmp_locations"].get(site_id)
+        password = self.data["site_passwords"].get(site_id)
+        if location is None and password is None:
+            return None
+        location = (tuple(location) + ("",) * 6)[1:6] if location else (None,) * 5
+        password = (tuple(password) + ("",) * 3)[1:3] if password else (None, None)
+        return Site(site_id, *location, *password)
+
+
+def file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+def hash_files(paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(os.path.basename(path).encode("utf-8") + b"\0")
+        if os.path.isfile(path):
+            with open(path, "rb") as sourceFile:
+                digest.update(sourceFile.read())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def load_cache(cache_path):
+    try:
+        with open(cache_path, "rb") as cacheFile:
+            cached = pickle.load(cacheFile)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get("format") != CACHE_FORMAT:
+        return None
+    return cached
+
+def save_cache(cache_path, cached):
+    """
+    NOTE: Written to a temp file and renamed into place, so a concurrent run never
+    reads a half-written cache. A read-only STIG_Templates directory is not an error;
+    the data is then simply parsed on every run.
+    """
+    import tempfile
+    try:
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path) or ".", prefix=CACHE_FILE)
+        with os.fdopen(handle, "wb") as cacheFile:
+            pickle.dump(cached, cacheFile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        pass
+
+
+# ========================================================================================
+# Command line.
+# ========================================================================================
+
+def consolidate(stig_templates_path, output_path):
+    data = parse_legacy_files(stig_templates_path)
+    with open(output_path, "w", newline='') as outputFile:
+        csv.writer(outputFile).writerows(consolidated_rows(data))
+    return data
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m STIG_Modules.reference_store",
+                                     description="Manage the consolidated STIG reference data and its compiled cache.")
+    parser.add_argument("--templates", default=DEFAULT_STIG_TEMPLATES_PATH,
+                        help="the STIG_Templates directory (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    consolidate_cmd = commands.add_parser("consolidate", help=f"merge the individual csv files into {REFERENCE_FILE}")
+    consolidate_cmd.add_argument("--output", help=f"where to write it (default: <templates>/{REFERENCE_FILE})")
+    consolidate_cmd.add_argument("--force", action="store_true", help="overwrite an existing file")
+    commands.add_parser("info", help="show the active source and what it holds")
+    query_cmd = commands.add_parser("query", help="run one keyed query")
+    query_cmd.add_argument("dataset", choices=("aaa", "ntp", "snmp_users", "site"))
+    query_cmd.add_argument("keys", nargs="+", help="aaa/ntp: NETWORK REGION, snmp_users: PLATFORM [VDC_TYPE], site: SITE_ID")
+    args = parser.parse_args(argv)
+
+    if args.command == "consolidate":
+        output_path = args.output or os.path.join(args.templates, REFERENCE_FILE)
+        if os.path.exists(output_path) and not args.force:
+            print(f"ERROR:\n   [{output_path}] already exists. Use --force to overwrite it.\n")
+            return 1
+        data = consolidate(args.templates, output_path)
+        print(f"Wrote {output_path}:  {sum(len(table) for table in data['aaa'].values())} aaa, "
+              f"{sum(len(table) for table in data['ntp'].values())} ntp, {len(data['snmp_locations'])} site rows.")
+        return 0
+
+    store = ReferenceStore.open(args.templates)
+    if args.command == "info":
+        print(f"Source:       {', '.join(store.source_files)}")
+        print(f"SHA-256:      {store.source_hash}")
+        print(f"Loaded from:  {'compiled cache' if store.from_cache else 'csv (cache rebuilt)'}")
+        print(f"Sites:        {len(set(store.data['snmp_locations']) | set(store.data['site_passwords']))}")
+        return 0
+    query = getattr(store, args.dataset)
+    try:
+        result = query(*args.keys)
+    except TypeError:
+        parser.error(f"wrong number of keys for {args.dataset}")
+    print(result)
+    return 0 if result is not None else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+TITLE:           render_memory_bench.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) Shows how much memory one worker needs to generate a config of a given
+                size, with the whole-string render (template.render() then save()) and
+                with the streamed render Batch Mode uses (template.generate() straight
+                into the file through OutputWriter.save_stream()).
+                2) The configs are made larger by rendering the IOS template of the
+                first device in File_Mode/multidevice_example.csv several times over into
+                one file. Every measurement runs in a fresh Python process, and reports
+                how far its peak RSS rose while that one config was generated.
+                3) The run fails (exit code 1) when the streamed render's peak RSS grows
+                with the config size by more than --tolerance MB.
+
+USAGE:          From the ./Scripts directory:
+                python -m STIG_Modules.render_memory_bench
+                python -m STIG_Modules.render_memory_bench --repeats 1 100 2000
+
+NOTE:           Peak RSS is read with the 'resource' module, so this runs on Linux and
+                macOS only.
+"""
+
+import json, os, shutil, subprocess, sys, tempfile
+
+
+DEFAULT_REPEATS = (1, 10, 100, 1000)
+DEFAULT_TOLERANCE_MB = 4.0
+SAMPLE_FILE = "File_Mode/multidevice_example.csv"
+BENCH_TEMPLATE = "bench_repeat.j2"
+
+
+def peak_rss_kb():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+def sample_record():
+    from STIG_Modules.batch_cli import csv_records
+    from STIG_Modules.batch_render import needs_resolution, resolve_record
+    from STIG_Modules.reference_data import IOS_DEVICE_TYPES, ReferenceData
+    record = next(record for record in csv_records(SAMPLE_FILE) if record.deviceType in IOS_DEVICE_TYPES)
+    if needs_resolution(record):
+        record = resolve_record(record, ReferenceData())
+    return record
+
+def measure(mode, repeats, work_dir):
+    """
+    NOTE: Runs inside the child process. Everything is loaded and one small config is
+    generated first, so the peak RSS rise only covers the measured config.
+    """
+    from STIG_Modules.batch_render import OutputWriter, TemplateRenderer, render_kwargs
+    renderer = TemplateRenderer(work_dir)
+    template = renderer.get_template(BENCH_TEMPLATE)
+    kwargs = render_kwargs(sample_record())
+    writer = OutputWriter(work_dir, "STIG_Config_")
+    config_path = writer.config_path("bench")
+
+    def generate(count):
+        if mode == "stream":
+            writer.save_stream(config_path, template.generate(repeats=count, **kwargs))
+        else:
+            writer.save(config_path, "bench", template.render(repeats=count, **kwargs))
+
+    generate(1)
+    baseline_kb = peak_rss_kb()
+    generate(repeats)
+    return {"mode": mode, "repeats": repeats, "config_bytes": os.path.getsize(config_path),
+            "baseline_kb": baseline_kb, "peak_kb": peak_rss_kb()}
+
+def make_work_dir(jinja_templates_path):
+    work_dir = tempfile.mkdtemp(prefix="stig_render_bench_")
+    shutil.copy(os.path.join(jinja_templates_path, "platform_IOS.j2"), work_dir)
+    with open(os.path.join(work_dir, BENCH_TEMPLATE), "w") as templateFile:
+        templateFile.write('{% for _ in range(repeats) %}{% include "platform_IOS.j2" %}{% endfor %}')
+    return work_dir
+
+def run_child(mode, repeats, work_dir):
+    result = subprocess.run([sys.executable, "-m", "STIG_Modules.render_memory_bench", "--child", mode,
+                             str(repeats), work_dir], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "no output")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m STIG_Modules.render_memory_bench",
+                                     description="Compare the peak memory of whole-string and streamed rendering.")
+    parser.add_argument("--repeats", type=int, nargs="+", default=DEFAULT_REPEATS,
+                        help="config sizes to test, as copies of the IOS template (default: %(default)s)")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE_MB,
+                        help="allowed peak RSS growth of the streamed render, in MB (default: %(default)s)")
+    parser.add_argument("--templates", default="./Jinja_Templates", help="the Jinja_Templates directory")
+    parser.add_argument("--child", nargs=3, metavar=("MODE", "REPEATS", "WORK_DIR"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        mode, repeats, work_dir = args.child
+        print(json.dumps(measure(mode, int(repeats), work_dir)))
+        return 0
+    if not os.path.isfile(SAMPLE_FILE):
+        print(f"ERROR:\n   Run this from the ./Scripts directory (where {SAMPLE_FILE} is).\n")
+        return 1
+
+    work_dir = make_work_dir(args.templates)
+    try:
+        results = {}
+        for repeats in sorted(args.repeats):
+            for mode in ("render", "stream"):
+                try:
+                    results[mode, repeats] = run_child(mode, repeats, work_dir)
+                except RuntimeError as err:
+                    print(f"ERROR:\n   The {mode} measurement for {repeats} repeats failed: {err}\n")
+                    return 1
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print("\n" + "#"*29 + "\n## RENDER MEMORY BENCHMARK ##\n" + "#"*29)
+    print(f"  {'Config size':>14}   {'render() peak rise':>20}   {'stream peak rise':>18}")
+    for repeats in sorted(args.repeats):
+        render, stream = results["render", repeats], results["stream", repeats]
+        print(f"  {stream['config_bytes'] / 1e6:>11.2f} MB   "
+              f"{(render['peak_kb'] - render['baseline_kb']) / 1024:>17.1f} MB   "
+              f"{(stream['peak_kb'] - stream['baseline_kb']) / 1024:>15.1f} MB")
+    stream_rises = [(results["stream", repeats]["peak_kb"] - results["stream", repeats]["baseline_kb"]) / 1024
+                    for repeats in args.repeats]
+    growth = max(stream_rises) - min(stream_rises)
+    result = "PASS" if growth <= args.tolerance else "FAIL"
+    print(f"\n  Streamed peak RSS growth across sizes:  {growth:.1f} MB   (tolerance {args.tolerance} MB)  {result}")
+    return 0 if result == "PASS" else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
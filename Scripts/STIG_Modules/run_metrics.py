@@ -0,0 +1,284 @@
+"""
+TITLE:           run_metrics.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) Writes the numbers of a Batch Mode run to a metrics file in the
+                Prometheus text format, for the node_exporter textfile collector (point
+                'run_metrics_path' at its --collector.textfile.directory). Scheduled runs
+                can then be graphed and alerted on without reading their logs:
+                - configs generated per deviceType/networkType, failures per reason,
+                - render and write time per device (histograms), bytes written and
+                  devices per second,
+                - cache hits and misses (site contexts, secret hashes, content store,
+                  inventory API, reference data cache),
+                - the reference data version (SHA-256 of its source files),
+                - run start, last update and duration, and the exit code once finished.
+                2) The file is written when the run starts, again every 'interval'
+                seconds while it runs (checked between devices), and at the end. Every
+                write goes to a .part file that then replaces the metrics file, so the
+                collector never reads half of it.
+                3) A stuck run stops updating the file: while
+                stig_builder_run_in_progress is 1, the age of
+                stig_builder_last_update_timestamp_seconds shows how long it has made no
+                progress, e.g.
+                    stig_builder_run_in_progress == 1
+                      and time() - stig_builder_last_update_timestamp_seconds > 300
+
+USAGE:          From the ./Scripts directory:
+                python STIG_config_builder.py --csv fleet.csv --metrics
+                python STIG_config_builder.py --csv fleet.csv --metrics-file /var/lib/node_exporter/stig.prom
+                python -m STIG_Modules.run_metrics status                <--- state of the last run
+
+NOTE:           Batch Mode only. The counters start from 0 in every run; give runs that
+                can overlap (shards, several schedules) their own --metrics-file.
+"""
+
+import bisect, os, sys, time
+
+
+DEFAULT_RUN_METRICS_PATH = "./Generated_Configs/stig_builder.prom"
+PREFIX = "stig_builder_"
+
+# Histogram buckets in seconds (the 'le' values).
+RENDER_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+WRITE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels) + "}"
+
+def format_value(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """
+    NOTE: A fixed-bucket histogram. observe() is one bisect, so it costs next to
+    nothing per device.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def samples(self):
+        """
+        NOTE: [(suffix, labels, value), ...] with cumulative bucket counts.
+        """
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            samples.append(("_bucket", (("le", repr(bound)),), cumulative))
+        samples.append(("_bucket", (("le", "+Inf"),), self.count))
+        samples.append(("_sum", (), self.sum))
+        samples.append(("_count", (), self.count))
+        return samples
+
+
+class RunMetrics:
+    """
+    NOTE: Collects the metrics of one run. The counts come from the objects the run
+    already keeps (the batch stats, the OutputWriter, ReferenceData, ...), which are
+    only read when the file is written; the timings come from run_batch(), through
+    device_done(). 'reference', 'client' and 'hasher' are set by the caller once they
+    are open.
+    """
+
+    def __init__(self, path, stats, writer, interval=0):
+        self.path = path
+        self.stats = stats
+        self.writer = writer
+        self.interval = interval
+        self.reference = None
+        self.client = None
+        self.hasher = None
+        self.render_time = Histogram(RENDER_BUCKETS)
+        self.write_time = Histogram(WRITE_BUCKETS)
+        self.exit_code = None
+        self.updates = 0
+        self.error = None
+        self.next_update = time.monotonic() + interval if interval else None
+        self.update()
+
+    def device_done(self, render_seconds, write_seconds):
+        self.render_time.observe(render_seconds)
+        self.write_time.observe(write_seconds)
+
+    def tick(self):
+        """
+        NOTE: Called between devices; rewrites the file once 'interval' has passed.
+        """
+        if self.next_update is not None and time.monotonic() >= self.next_update:
+            self.update()
+            self.next_update = time.monotonic() + self.interval
+
+    def close(self, exit_code):
+        self.exit_code = exit_code
+        self.update()
+
+    # ====================================================================================
+    # The metrics file.
+    # ====================================================================================
+
+    def cache_counts(self):
+        """
+        NOTE: {cache: (hits, misses)} of the caches in use.
+        """
+        caches = {}
+        reference = self.reference
+        if reference is not None:
+            caches["reference_data"] = (1, 0) if reference.store.from_cache else (0, 1)
+            caches["site_context"] = (reference.site_context_hits, len(reference.site_contexts))
+        if self.hasher is not None:
+            caches["secret_hash"] = (self.hasher.reused, self.hasher.computed)
+        content_store = self.writer.content_store
+        if content_store is not None:
+            caches["content_store"] = (content_store.blobs_reused, content_store.blobs_written)
+        if self.client is not None:
+            caches["inventory_api"] = (self.client.not_modified, self.client.requests - self.client.not_modified)
+        return caches
+
+    def families(self, now):
+        """
+        NOTE: [(name, type, help, [(suffix, labels, value), ...]), ...]
+        """
+        stats = self.stats
+        finished = stats["finished"] if self.exit_code is not None and stats["finished"] else now
+        elapsed = max(finished - stats["started"], 0.0)
+        families = [
+            ("run_start_timestamp_seconds", "gauge", "When the run started.", [("", (), stats["started"])]),
+            ("last_update_timestamp_seconds", "gauge", "When this file was last written.", [("", (), now)]),
+            ("run_in_progress", "gauge", "1 while the run is going, 0 once it has ended.",
+             [("", (), 0 if self.exit_code is not None else 1)]),
+            ("run_duration_seconds", "gauge", "Run time so far, or of the whole run once it has ended.",
+             [("", (), round(elapsed, 3))]),
+            ("devices_read_total", "counter", "Devices read from the source.", [("", (), stats["devices"])]),
+            ("devices_skipped_total", "counter", "Devices skipped because a resumed job already finished them.",
+             [("", (), stats["skipped"])]),
+            ("devices_rendered_total", "counter", "Configs generated, per platform and network type.",
+             [("", (("device_type", deviceType), ("network_type", networkType)), count)
+              for (deviceType, networkType), count in sorted(stats["per_platform"].items())]),
+            ("devices_failed_total", "counter", "Devices that failed, per reason.",
+             [("", (("reason", reason),), count) for reason, count in sorted(stats["failures"].items())]),
+            ("devices_per_second", "gauge", "Configs generated per second of run time.",
+             [("", (), round(stats["rendered"] / elapsed, 3) if elapsed else 0.0)]),
+            ("render_duration_seconds", "histogram",
+             "Time per generated config spent resolving, rendering and checking it.", self.render_time.samples()),
+            ("write_duration_seconds", "histogram", "Time per generated config spent writing it to disk.",
+             self.write_time.samples()),
+            ("bytes_written_total", "counter", "Bytes of config written.", [("", (), self.writer.bytes_written)]),
+        ]
+        caches = self.cache_counts()
+        families.append(("cache_requests_total", "counter", "Cache hits and misses, per cache.",
+                         [("", (("cache", cache), ("result", result)), count)
+                          for cache, counts in sorted(caches.items())
+                          for result, count in zip(("hit", "miss"), counts)]))
+        families.append(("cache_hit_ratio", "gauge", "Share of cache requests that were hits, per cache.",
+                         [("", (("cache", cache),), round(hits / (hits + misses), 4))
+                          for cache, (hits, misses) in sorted(caches.items()) if hits + misses]))
+        if self.reference is not None:
+            families.append(("reference_data_info", "gauge", "Version (source SHA-256) of the reference data.",
+                             [("", (("version", self.reference.store.source_hash),), 1)]))
+        if self.exit_code is not None:
+            families.append(("run_exit_code", "gauge", "Exit code of the run (0 ok, 2 devices failed, 1 aborted).",
+                             [("", (), self.exit_code)]))
+        return families
+
+    def render(self):
+        lines = []
+        for name, kind, help_text, samples in self.families(time.time()):
+            name = PREFIX + name
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{name}{suffix}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def update(self):
+        """
+        NOTE: Rewrites the metrics file. A file that cannot be written never stops the
+        run; the error is shown in the summary.
+        """
+        part_path = self.path + ".part"
+        try:
+            with open(part_path, "w") as metricsFile:
+                metricsFile.write(self.render())
+            os.replace(part_path, self.path)
+        except OSError as err:
+            self.error = err
+            return
+        self.updates += 1
+
+    def summary_lines(self):
+        lines = ["\n" + "#"*21 + "\n## METRICS SUMMARY ##\n" + "#"*21,
+                 f"  Metrics file:              {self.path}",
+                 f"  Updates written:           {self.updates}"]
+        if self.error is not None:
+            lines.append(f"  Last write failed:         {self.error}")
+        return lines
+
+
+# ========================================================================================
+# Reading a metrics file back.
+# ========================================================================================
+
+def read_metrics(path):
+    """
+    NOTE: {sample name with labels: value} of a metrics file.
+    """
+    samples = {}
+    with open(path) as metricsFile:
+        for line in metricsFile:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            name, _, value = line.rpartition(" ")
+            samples[name] = float(value)
+    return samples
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m STIG_Modules.run_metrics",
+                                     description="Show the state of the run that last wrote a metrics file.")
+    parser.add_argument("command", choices=("status",))
+    parser.add_argument("path", nargs="?", default=DEFAULT_RUN_METRICS_PATH,
+                        help="metrics file (default: %(default)s)")
+    args = parser.parse_args(argv)
+    try:
+        samples = read_metrics(args.path)
+    except (OSError, ValueError) as err:
+        print(f"ERROR:\n   The metrics file could not be read: {err}\n")
+        return 1
+    started = samples.get(PREFIX + "run_start_timestamp_seconds", 0.0)
+    updated = samples.get(PREFIX + "last_update_timestamp_seconds", 0.0)
+    exit_code = samples.get(PREFIX + "run_exit_code")
+    rendered = sum(value for name, value in samples.items() if name.startswith(PREFIX + "devices_rendered_total"))
+    failed = sum(value for name, value in samples.items() if name.startswith(PREFIX + "devices_failed_total"))
+    print(f"  Run started:               {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started))}")
+    if exit_code is None:
+        print(f"  State:                     running, last update {time.time() - updated:.0f}s ago")
+    else:
+        print(f"  State:                     ended with exit code {int(exit_code)}")
+    print(f"  Run time:                  {samples.get(PREFIX + 'run_duration_seconds', 0.0):.2f}s")
+    print(f"  Configs generated:         {int(rendered)}")
+    print(f"  Devices failed:            {int(failed)}")
+    print(f"  Devices per second:        {samples.get(PREFIX + 'devices_per_second', 0.0):.1f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""
+TITLE:           secret_hashing.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) Derives device-ready hashes of the site password at render time, so no
+                one has to hash credentials by hand:
+                - IOS/IOS-XE:  type 9 (scrypt) or type 8 (PBKDF2-SHA256), used for the
+                               local username and the enable secret.
+                - NX-OS:       'password 5' (SHA-512 crypt), used for the local username.
+                2) These hashes are slow on purpose (tens of ms each), so SecretHasher
+                computes them in a process pool and memoizes every result per site and
+                algorithm. Batch Mode submits the hashes of every site in its input up
+                front; a 10k-device run then hashes each site password once, not once per
+                device.
+
+USAGE:          Batch Mode:  python STIG_config_builder.py --csv devices.csv --hash-secrets
+                One hash:    python -m STIG_Modules.secret_hashing type9 'Password123'
+
+NOTE:           Every hash gets a fresh random salt, so the hashes (and the configs
+                holding them) differ from one run to the next, exactly as they would if
+                the device hashed the password itself. Within one run every device of a
+                site gets the same hash.
+"""
+
+import base64, hashlib, os, sys, time
+
+
+# Cisco's base64 alphabet (also the crypt(3) alphabet), in place of A-Za-z0-9+/.
+CISCO_B64 = "./0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+STANDARD_B64 = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+TO_CISCO_B64 = str.maketrans(STANDARD_B64, CISCO_B64)
+
+SALT_LENGTH = {"type8": 14, "type9": 14, "nxos": 16}
+TYPE8_ITERATIONS = 20000
+TYPE9_N, TYPE9_R, TYPE9_P = 2 ** 14, 1, 1
+SHA512_CRYPT_ROUNDS = 5000
+
+# IOS secret types the builder can emit (see hashed_secret_IOS_type).
+IOS_TYPES = {8: "type8", 9: "type9"}
+
+# Output byte order of SHA-512 crypt, three bytes per four characters.
+SHA512_CRYPT_ORDER = ((0, 21, 42), (22, 43, 1), (44, 2, 23), (3, 24, 45), (25, 46, 4), (47, 5, 26), (6, 27, 48),
+                      (28, 49, 7), (50, 8, 29), (9, 30, 51), (31, 52, 10), (53, 11, 32), (12, 33, 54), (34, 55, 13),
+                      (56, 14, 35), (15, 36, 57), (37, 58, 16), (59, 17, 38), (18, 39, 60), (40, 61, 19), (62, 20, 41))
+
+
+def random_salt(length):
+    return "".join(CISCO_B64[byte % 64] for byte in os.urandom(length))
+
+def cisco_b64(data):
+    return base64.b64encode(data).decode("ascii").translate(TO_CISCO_B64).rstrip("=")
+
+def crypt_b64(value, length):
+    chars = []
+    for _ in range(length):
+        chars.append(CISCO_B64[value & 0x3f])
+        value >>= 6
+    return "".join(chars)
+
+
+# ========================================================================================
+# The algorithms.
+# ========================================================================================
+
+def type8_hash(password, salt):
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt.encode("ascii"), TYPE8_ITERATIONS, 32)
+    return f"$8${salt}${cisco_b64(digest)}"
+
+def type9_hash(password, salt):
+    digest = hashlib.scrypt(password.encode("utf-8"), salt=salt.encode("ascii"), n=TYPE9_N, r=TYPE9_R, p=TYPE9_P, dklen=32)
+    return f"$9${salt}${cisco_b64(digest)}"
+
+def sha512_crypt(password, salt, rounds=SHA512_CRYPT_ROUNDS):
+    """
+    NOTE: SHA-512 crypt ($6$), as specified by Ulrich Drepper. Only the default
+    number of rounds is supported, which is what NX-OS expects.
+    """
+    key, salt_bytes = password.encode("utf-8"), salt.encode("ascii")[:16]
+
+    def repeat(digest, length):
+        return digest * (length // 64) + digest[:length % 64]
+
+    alternate = hashlib.sha512(key + salt_bytes + key).digest()
+    start = hashlib.sha512(key + salt_bytes + repeat(alternate, len(key)))
+    length = len(key)
+    while length:
+        start.update(alternate if length & 1 else key)
+        length >>= 1
+    current = start.digest()
+    key_sequence = repeat(hashlib.sha512(key * len(key)).digest(), len(key))
+    salt_sequence = repeat(hashlib.sha512(salt_bytes * (16 + current[0])).digest(), len(salt_bytes))
+    for index in range(rounds):
+        step = hashlib.sha512(key_sequence if index & 1 else current)
+        if index % 3:
+            step.update(salt_sequence)
+        if index % 7:
+            step.update(key_sequence)
+        step.update(current if index & 1 else key_sequence)
+        current = step.digest()
+
+    encoded = "".join(crypt_b64((current[a] << 16) | (current[b] << 8) | current[c], 4) for a, b, c in SHA512_CRYPT_ORDER)
+    return f"$6${salt_bytes.decode('ascii')}${encoded}{crypt_b64(current[63], 2)}"
+
+ALGORITHMS = {"type8": type8_hash, "type9": type9_hash, "nxos": sha512_crypt}
+
+def compute_hash(algorithm, password):
+    """
+    NOTE: Runs in the worker processes.
+    """
+    return ALGORITHMS[algorithm](password, random_salt(SALT_LENGTH[algorithm]))
+
+
+# ========================================================================================
+# The memoizing process pool used by Batch Mode.
+# ========================================================================================
+
+class SecretHasher:
+    """
+    NOTE: Holds one result (or pending Future) per (site_id, algorithm, password).
+    submit() queues a hash without waiting for it; render_kwargs() waits only for the
+    hashes its device needs.
+    """
+
+    def __init__(self, ios_type=9, workers=None):
+        if ios_type not in IOS_TYPES:
+            raise ValueError(f"IOS secrets can be hashed as type {' or '.join(map(str, IOS_TYPES))}, not type {ios_type}.")
+        self.ios_type = ios_type
+        self.workers = workers
+        self.pool = None
+        self.results = {}
+        self.computed = 0
+        self.reused = 0
+        self.wait_time = 0.0
+
+    def algorithm_for(self, deviceType):
+        from STIG_Modules.reference_data import IOS_DEVICE_TYPES, NEXUS_DEVICE_TYPES
+        if deviceType in IOS_DEVICE_TYPES:
+            return IOS_TYPES[self.ios_type]
+        if deviceType in NEXUS_DEVICE_TYPES:
+            return "nxos"
+        return None
+
+    def submit(self, site_id, algorithm, password):
+        key = (site_id, algorithm, password)
+        if key not in self.results:
+            if self.pool is None:
+                from concurrent.futures import ProcessPoolExecutor
+                self.pool = ProcessPoolExecutor(self.workers)
+            self.results[key] = self.pool.submit(compute_hash, algorithm, password)
+            self.computed += 1
+        return key
+
+    def prefetch(self, records):
+        """
+        NOTE: Submits the hash every record will need, so the pool works through all
+        of them while Batch Mode renders. 'records' must already be resolved.
+        """
+        for record in records:
+            algorithm = self.algorithm_for(record.deviceType)
+            if algorithm is not None and record.site_password:
+                self.submit(getattr(record.extras, "site_id", "") or "", algorithm, record.site_password)
+
+    def get(self, site_id, algorithm, password):
+        key = (site_id, algorithm, password)
+        result = self.results.get(key)
+        if result is None:
+            key = self.submit(site_id, algorithm, password)
+            result = self.results[key]
+        else:
+            self.reused += 1
+        if not isinstance(result, str):
+            started = time.perf_counter()
+            result = self.results[key] = result.result()
+            self.wait_time += time.perf_counter() - started
+        return result
+
+    def render_kwargs(self, record):
+        """
+        NOTE: The extra template variables for a device: sitePass_type and
+        sitePass_hash for IOS, sitePass_NXOS_hash for NX-OS.
+        """
+        algorithm = self.algorithm_for(record.deviceType)
+        if algorithm is None or not record.site_password:
+            return {}
+        hashed = self.get(getattr(record.extras, "site_id", "") or "", algorithm, record.site_password)
+        if algorithm == "nxos":
+            return {"sitePass_NXOS_hash": hashed}
+        return {"sitePass_type": str(self.ios_type), "sitePass_hash": hashed}
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    def summary_lines(self):
+        return ["\n" + "#"*27 + "\n## SECRET HASHES SUMMARY ##\n" + "#"*27,
+                f"  IOS secret type:           {self.ios_type}",
+                f"  Hashes computed:           {self.computed}",
+                f"  Hashes reused:             {self.reused}",
+                f"  Time waiting on hashes:    {self.wait_time:.2f}s"]
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m STIG_Modules.secret_hashing",
+                                     description="Hash one password the way Batch Mode does with --hash-secrets.")
+    parser.add_argument("algorithm", choices=sorted(ALGORITHMS))
+    parser.add_argument("password")
+    args = parser.parse_args(argv)
+    print(compute_hash(args.algorithm, args.password))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""
+TITLE:           secret_vault.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) Keeps the site enable secrets (site_passwords.csv) and the SNMP auth/priv
+                passwords (snmp_users_*.csv) in one encrypted vault file instead of
+                plaintext csv files:
+                    ./STIG_Templates/stig_secrets.vault
+                The vault is encrypted with AES-256-GCM under a key derived from a
+                passphrase with scrypt.
+                2) SecretProvider decrypts the vault ONE time per run and keeps the
+                secrets in a memory-only cache keyed by site ID and platform. Batch Mode
+                prefetches the secrets of every site in its input up front, keeps only
+                those, and wipes everything at exit (zeroise()).
+                3) Once the vault is created, the secret columns of site_passwords.csv and
+                snmp_users_*.csv can be blanked; Batch Mode reads them from the vault when
+                ENABLE_secret_vault (or --secret-vault) is set.
+
+USAGE:          From the ./Scripts directory:
+                python -m STIG_Modules.secret_vault create
+                python -m STIG_Modules.secret_vault info
+                python STIG_config_builder.py --csv devices.csv --secret-vault
+
+NOTE:           Requires the cryptography package (pip install cryptography). The
+                passphrase is read from the STIG_VAULT_PASSPHRASE environment variable,
+                or prompted for when it is not set.
+                The decrypted vault and cached secrets are held in bytearrays that
+                zeroise() overwrites. A secret handed to a template becomes an ordinary
+                Python string, which cannot be wiped; it is dropped once its config is
+                written.
+"""
+
+import atexit, hashlib, os, sys
+
+from STIG_Modules.reference_store import DEFAULT_STIG_TEMPLATES_PATH, SNMP_PLATFORMS
+
+
+VAULT_FILE = "stig_secrets.vault"
+VAULT_MAGIC = b"STIGVAULT1"
+SALT_SIZE = 16
+NONCE_SIZE = 12
+PASSPHRASE_ENV = "STIG_VAULT_PASSPHRASE"
+
+# scrypt cost: about 0.1s and 32 MB, paid once per run.
+SCRYPT_N = 2 ** 15
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+# Vault records are "dataset<US>key<US>value..." lines. The unit separator never
+# appears in a password, so no quoting is needed and every value can be sliced out
+# of the decrypted buffer as a bytearray.
+FIELD_SEPARATOR = b"\x1f"
+
+
+class VaultError(ValueError):
+    pass
+
+
+def load_aesgcm():
+    try:
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    except ImportError:
+        raise VaultError("The secret vault requires the cryptography package:  pip install cryptography") from None
+    return AESGCM
+
+def derive_key(passphrase, salt):
+    return bytearray(hashlib.scrypt(bytes(passphrase), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P,
+                                    maxmem=64 * 1024 * 1024, dklen=32))
+
+def wipe(buffer):
+    buffer[:] = bytes(len(buffer))
+
+def read_passphrase(prompt="Secret vault passphrase: "):
+    """
+    NOTE: Returns the passphrase as a bytearray, from STIG_VAULT_PASSPHRASE or a prompt.
+    """
+    passphrase = os.environ.get(PASSPHRASE_ENV)
+    if passphrase is None:
+        if not sys.stdin.isatty():
+            raise VaultError(f"No passphrase: set {PASSPHRASE_ENV} when running without a terminal.")
+        import getpass
+        passphrase = getpass.getpass(prompt)
+    return bytearray(passphrase.encode("utf-8"))
+
+
+# ========================================================================================
+# Writing a vault.
+# ========================================================================================
+
+def vault_records(data):
+    """
+    NOTE: The secret rows of already-parsed reference data (see reference_store.py).
+    """
+    for site_id, row in data["site_passwords"].items():
+        yield ("site_password", site_id) + tuple(row[1:3])
+    for platform, table in data["snmp_users"].items():
+        for condition, row in table.items():
+            if condition != "DETERMINING_CONDITION":
+                yield ("snmp_user", f"{platform}:{condition}") + tuple(row[1:])
+
+def write_vault(vault_path, records, passphrase):
+    AESGCM = load_aesgcm()
+    plaintext = bytearray()
+    for record in records:
+        fields = [value.encode("utf-8") for value in record]
+        if any(FIELD_SEPARATOR in field or b"\n" in field for field in fields):
+            raise VaultError(f"The {record[0]} entry [{record[1]}] holds a control character and cannot be stored.")
+        plaintext += FIELD_SEPARATOR.join(fields) + b"\n"
+    salt, nonce = os.urandom(SALT_SIZE), os.urandom(NONCE_SIZE)
+    key = derive_key(passphrase, salt)
+    try:
+        ciphertext = AESGCM(bytes(key)).encrypt(nonce, bytes(plaintext), VAULT_MAGIC)
+    finally:
+        wipe(key)
+        wipe(plaintext)
+    with open(vault_path + ".part", "wb") as vaultFile:
+        vaultFile.write(VAULT_MAGIC + salt + nonce + ciphertext)
+    os.replace(vault_path + ".part", vault_path)
+
+def decrypt_vault(vault_path, passphrase):
+    """
+    NOTE: Returns the decrypted records as one bytearray; the caller wipes it.
+    """
+    AESGCM = load_aesgcm()
+    from cryptography.exceptions import InvalidTag
+    try:
+        with open(vault_path, "rb") as vaultFile:
+            blob = vaultFile.read()
+    except OSError as err:
+        raise VaultError(f"The secret vault [{vault_path}] could not be read: {err}") from None
+    header = len(VAULT_MAGIC)
+    if not blob.startswith(VAULT_MAGIC) or len(blob) < header + SALT_SIZE + NONCE_SIZE:
+        raise VaultError(f"[{vault_path}] is not a STIG secret vault.")
+    salt = blob[header:header + SALT_SIZE]
+    nonce = blob[header + SALT_SIZE:header + SALT_SIZE + NONCE_SIZE]
+    key = derive_key(passphrase, salt)
+    try:
+        return bytearray(AESGCM(bytes(key)).decrypt(nonce, blob[header + SALT_SIZE + NONCE_SIZE:], VAULT_MAGIC))
+    except InvalidTag:
+        raise VaultError(f"The secret vault [{vault_path}] could not be decrypted (wrong passphrase, or the file was altered).") from None
+    finally:
+        wipe(key)
+
+
+# ========================================================================================
+# The provider used by ReferenceData.
+# ========================================================================================
+
+class SecretProvider:
+    """
+    NOTE: Answers site_secret() and snmp_users() from the vault. The vault is
+    decrypted on the first request (or by prefetch()); only a request for a site
+    that an earlier prefetch() left out decrypts it again.
+    """
+
+    def __init__(self, vault_path, passphrase):
+        self.vault_path = vault_path
+        self.passphrase = passphrase
+        # site_id -> [enable_secret, enable_secret_md5], as bytearrays
+        self.sites = {}
+        # platform -> {condition: [user, role, authPW, privPW, userACL]}, as bytearrays
+        self.platforms = {}
+        self.complete = False
+        # Site IDs the vault was found to have no entry for.
+        self.absent = set()
+        self.decrypts = 0
+        self.lookups = 0
+        self.prefetched = 0
+        atexit.register(self.zeroise)
+
+    def load(self, site_ids=None):
+        """
+        NOTE: Decrypts the vault and caches every SNMP user plus the sites in
+        'site_ids' (every site when None). Everything else is wiped straight away.
+        """
+        self.clear()
+        plaintext = decrypt_vault(self.vault_path, self.passphrase)
+        self.decrypts += 1
+        try:
+            for line in plaintext.split(b"\n"):
+                fields = line.split(FIELD_SEPARATOR)
+                if len(fields) < 3:
+                    wipe(line)
+                    continue
+                dataset, key = fields[0].decode("utf-8"), fields[1].decode("utf-8")
+                if dataset == "site_password" and (site_ids is None or key in site_ids):
+                    self.sites[key] = (fields[2:4] + [bytearray()] * 2)[:2]
+                elif dataset == "snmp_user":
+                    platform, _, condition = key.partition(":")
+                    self.platforms.setdefault(platform, {})[condition] = fields[2:7]
+                else:
+                    for field in fields:
+                        wipe(field)
+                wipe(line)
+        finally:
+            wipe(plaintext)
+        self.complete = site_ids is None
+
+    def prefetch(self, site_ids):
+        """
+        NOTE: Batch Mode calls this with the site IDs of every device in its input
+        (or None when they are not known up front, e.g. for a NetBox URL).
+        """
+        self.load(None if site_ids is None else set(site_ids))
+        self.prefetched = len(self.sites)
+        return self.prefetched
+
+    def site_secret(self, site_id):
+        """
+        NOTE: Returns (enable_secret, enable_secret_md5), or None when the vault has no
+        entry for the site.
+        """
+        self.lookups += 1
+        if site_id not in self.sites and not self.complete and site_id not in self.absent:
+            self.load(set(self.sites) | {site_id})
+            if site_id not in self.sites:
+                self.absent.add(site_id)
+        secrets = self.sites.get(site_id)
+        if secrets is None or not secrets[0]:
+            return None
+        return tuple(secret.decode("utf-8") for secret in secrets)
+
+    def snmp_users(self, platform, vdc_type=None):
+        """
+        NOTE: Same result as ReferenceStore.snmp_users(): the (READ, WRITE) rows, each
+        as (condition, user, role, authPW, privPW, userACL), or None.
+        """
+        self.lookups += 1
+        if not self.platforms and not self.decrypts:
+            self.load(set(self.sites))
+        table = self.platforms.get(platform, {})
+        if platform == "NEXUS" and vdc_type == "admin":
+            conditions = ("READuser_admin", "WRITEuser_admin")
+        else:
+            conditions = ("READuser", "WRITEuser")
+        if conditions[0] not in table or conditions[1] not in table:
+            return None
+        return tuple((condition,) + tuple(value.decode("utf-8") for value in table[condition])
+                     for condition in conditions)
+
+    def clear(self):
+        for secrets in self.sites.values():
+            for secret in secrets:
+                wipe(secret)
+        for table in self.platforms.values():
+            for values in table.values():
+                for value in values:
+                    wipe(value)
+        self.sites = {}
+        self.platforms = {}
+        self.complete = False
+
+    def zeroise(self):
+        """
+        NOTE: Overwrites every cached secret and the passphrase. Registered with
+        atexit, and safe to call more than once.
+        """
+        self.clear()
+        if self.passphrase:
+            wipe(self.passphrase)
+            self.passphrase = bytearray()
+
+    def summary_lines(self):
+        return ["\n" + "#"*26 + "\n## SECRET VAULT SUMMARY ##\n" + "#"*26,
+                f"  Vault:                     {self.vault_path}",
+                f"  Times decrypted:           {self.decrypts}",
+                f"  Sites prefetched:          {self.prefetched}",
+                f"  Secret lookups:            {self.lookups}"]
+
+
+# ========================================================================================
+# Command line.
+# ========================================================================================
+
+def main(argv=None):
+    import argparse
+    from STIG_Modules.reference_store import ReferenceStore
+    parser = argparse.ArgumentParser(prog="python -m STIG_Modules.secret_vault",
+                                     description="Create or inspect the encrypted STIG secret vault.")
+    parser.add_argument("--templates", default=DEFAULT_STIG_TEMPLATES_PATH,
+                        help="the STIG_Templates directory (default: %(default)s)")
+    parser.add_argument("--vault", help=f"the vault file (default: <templates>/{VAULT_FILE})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    create_cmd = commands.add_parser("create", help="encrypt the secrets of the current reference data into the vault")
+    create_cmd.add_argument("--force", action="store_true", help="overwrite an existing vault")
+    commands.add_parser("info", help="decrypt the vault and list what it holds (no secrets are shown)")
+    args = parser.parse_args(argv)
+    vault_path = args.vault or os.path.join(args.templates, VAULT_FILE)
+
+    try:
+        if args.command == "create":
+            if os.path.exists(vault_path) and not args.force:
+                print(f"ERROR:\n   [{vault_path}] already exists. Use --force to overwrite it.\n")
+                return 1
+            data = ReferenceStore.open(args.templates).data
+            passphrase = read_passphrase("New secret vault passphrase: ")
+            if PASSPHRASE_ENV not in os.environ and read_passphrase("Repeat the passphrase: ") != passphrase:
+                print("ERROR:\n   The passphrases do not match.\n")
+                return 1
+            write_vault(vault_path, vault_records(data), passphrase)
+            wipe(passphrase)
+            print(f"Wrote {vault_path}:  {len(data['site_passwords'])} site secrets, "
+                  f"{sum(len(table) for table in data['snmp_users'].values())} SNMP user rows "
+                  f"for {', '.join(SNMP_PLATFORMS)}.")
+            print("The secret columns of site_passwords.csv and snmp_users_*.csv can now be blanked.")
+            return 0
+        provider = SecretProvider(vault_path, read_passphrase())
+        provider.prefetch(None)
+        print(f"Vault:        {vault_path}")
+        print(f"Sites:        {len(provider.sites)}")
+        for platform in sorted(provider.platforms):
+            print(f"SNMP users:   {platform}: {', '.join(sorted(provider.platforms[platform]))}")
+        provider.zeroise()
+    except VaultError as err:
+        print(f"ERROR:\n   {err}\n")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""
+TITLE:           server_latency.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) Picks and orders the AAA servers (AAA_PRI, AAA_SEC) and NTP servers
+                (NTP_1 - NTP_4) of each site by measured round-trip time, instead of the
+                static REGION_A - REGION_D rows of aaa_servers*.csv / ntp_servers*.csv.
+                2) The measurements are an offline site x server matrix
+                (STIG_Templates/server_latency.csv by default), read ONE time per run:
+                    site_id,192.168.0.110,192.168.0.111,10.20.0.5,...
+                    ID001,12.5,48.0,,...
+                    ID002,95.1,timeout,7.3,...
+                Each cell is the RTT in milliseconds; an empty cell, '-', 'timeout' or
+                'unreachable' means the server could not be reached from that site.
+                3) Every site's row is ranked ONE time when the matrix is read (reachable
+                servers, fastest first). A device then gets the fastest reachable servers
+                that its network's aaa/ntp file lists for ANY region. When fewer than
+                needed are reachable, the rest come from the static region row. Sites
+                that are not in the matrix keep the static region lookup.
+
+USAGE:          From the ./Scripts directory:
+                python STIG_config_builder.py --csv fleet.csv --server-latency
+                python -m STIG_Modules.server_latency ID001 ID002       <--- show the ranking
+
+NOTE:           Batch Mode only (the 'site_id' column selects the matrix row).
+"""
+
+import csv, math, sys
+
+from STIG_Modules.reference_store import DEFAULT_STIG_TEMPLATES_PATH
+
+
+DEFAULT_SERVER_LATENCY = DEFAULT_STIG_TEMPLATES_PATH + "server_latency.csv"
+UNREACHABLE = ("", "-", "timeout", "unreachable", "down")
+
+
+class ServerLatencyError(ValueError):
+    pass
+
+
+def parse_rtt(cell):
+    """
+    NOTE: RTT in ms, or math.inf for an unreachable server.
+    """
+    cell = cell.strip()
+    if cell.lower() in UNREACHABLE:
+        return math.inf
+    rtt = float(cell)
+    if rtt < 0 or math.isnan(rtt):
+        raise ValueError(f"[{cell}] is not a round-trip time")
+    return rtt
+
+def read_latency_matrix(path):
+    """
+    NOTE: ({site_id: ((server, rtt), ...) reachable, fastest first}, number of servers).
+    Ties keep the column order of the file.
+    """
+    rankings = {}
+    try:
+        with open(path, newline="") as latencyFile:
+            rows = csv.reader(latencyFile)
+            header = next(rows, None)
+            if not header or len(header) < 2:
+                raise ServerLatencyError(f"[{path}] needs a header row:  site_id,<server>,<server>,...")
+            servers = [server.strip() for server in header[1:]]
+            for line_number, row in enumerate(rows, start=2):
+                if not row or not "".join(row).strip():
+                    continue
+                if len(row) != len(header):
+                    raise ServerLatencyError(f"[{path}] line {line_number}: expected {len(header)} values "
+                                             f"but found {len(row)}.")
+                try:
+                    rtts = [parse_rtt(cell) for cell in row[1:]]
+                except ValueError as err:
+                    raise ServerLatencyError(f"[{path}] line {line_number}: {err}") from None
+                ranked = sorted(zip(rtts, range(len(servers))))
+                rankings[row[0].strip()] = tuple((servers[column], rtt) for rtt, column in ranked if rtt != math.inf)
+    except OSError as err:
+        raise ServerLatencyError(f"The server latency data could not be read: {err}") from None
+    return rankings, len(servers)
+
+
+class ServerLatency:
+    """
+    NOTE: Hands ReferenceData the latency-ordered servers of a site (order()).
+    """
+
+    def __init__(self, path=DEFAULT_SERVER_LATENCY):
+        self.path = path
+        self.rankings, self.server_count = read_latency_matrix(path)
+        self.ordered = 0
+        self.topped_up = 0
+        self.not_measured = 0
+
+    def order(self, site_id, candidates, static, count):
+        """
+        NOTE: The 'count' fastest reachable servers of 'candidates' for a site, topped up
+        from 'static' (the region row) when too few are reachable. None when the site
+        was not measured.
+        """
+        ranking = self.rankings.get(site_id)
+        if ranking is None:
+            self.not_measured += 1
+            return None
+        candidates = set(candidates)
+        chosen = [server for server, _ in ranking if server in candidates][:count]
+        if len(chosen) < count:
+            self.topped_up += 1
+            chosen += [server for server in static if server not in chosen][:count - len(chosen)]
+        if len(chosen) < count:
+            return None
+        self.ordered += 1
+        return tuple(chosen)
+
+    def summary_lines(self):
+        return ["\n" + "#"*28 + "\n## SERVER LATENCY SUMMARY ##\n" + "#"*28,
+                f"  Latency data:              {self.path}",
+                f"  Sites measured:            {len(self.rankings)} (x {self.server_count} servers)",
+                f"  Server lists by latency:   {self.ordered}",
+                f"      topped up by region    {self.topped_up}",
+                f"  By region (not measured):  {self.not_measured}"]
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m STIG_Modules.server_latency",
+                                     description="Show the servers of each site ranked by measured RTT.")
+    parser.add_argument("site_ids", nargs="*", help="sites to show (default: all)")
+    parser.add_argument("--data", default=DEFAULT_SERVER_LATENCY, help="latency matrix (default: %(default)s)")
+    args = parser.parse_args(argv)
+    try:
+        latency = ServerLatency(args.data)
+    except ServerLatencyError as err:
+        print(f"ERROR:\n   {err}\n")
+        return 1
+    for site_id in args.site_ids or sorted(latency.rankings):
+        ranking = latency.rankings.get(site_id)
+        if ranking is None:
+            print(f"\n{site_id}:  not measured")
+            continue
+        print(f"\n{site_id}:")
+        for server, rtt in ranking:
+            print(f"   {server:<18} {rtt:>8.1f} ms")
+        if not ranking:
+            print("   (no server reachable)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+"""
+TITLE:           shards.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) Splits one large Batch Mode run across several runner machines with no
+                coordinator. Every runner reads the SAME source with '--shard i/N' and
+                only generates the devices whose hostname hashes to shard i:
+                    runner 1:  python STIG_config_builder.py --csv fleet.csv --shard 1/3
+                    runner 2:  python STIG_config_builder.py --csv fleet.csv --shard 2/3
+                    runner 3:  python STIG_config_builder.py --csv fleet.csv --shard 3/3
+                The hash is SHA-256 of the hostname, so the split is the same on every
+                machine and every Python version.
+                2) Each shard writes a manifest (one line per device: status, SHA-256
+                of its config, mgmt_ipaddr and deviceType) and an archive of its
+                configs plus that manifest:
+                    <output_dir>/STIG_shard_<i>_of_<N>.tar.gz
+                3) 'merge' checks that every shard 1..N of the same source is present and
+                complete, verifies each config against its manifest, and combines them
+                into one fleet-wide archive (or directory) with a single manifest.
+
+USAGE:          From the ./Scripts directory:
+                python -m STIG_Modules.shards merge STIG_shard_*_of_3.tar.gz --output fleet.tar.gz
+                python -m STIG_Modules.shards merge STIG_shard_*_of_3.tar.gz --extract ./Generated_Configs/
+
+NOTE:           Rendering a device only depends on that device's row and the reference
+                data, so a shard generates exactly what a single run would for its rows,
+                provided every runner uses the same STIG_Templates and Jinja_Templates.
+"""
+
+import hashlib, io, json, os, sys, tarfile, time
+
+
+MANIFEST_NAME = "manifest.jsonl"
+CONFIGS_DIR = "configs/"
+MANIFEST_FORMAT = 1
+
+
+class ShardError(ValueError):
+    pass
+
+
+def parse_shard(text):
+    """
+    NOTE: '2/4' -> (2, 4). Shards are numbered from 1.
+    """
+    index, separator, count = text.partition("/")
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise ShardError(f"--shard expects i/N (for example 2/4), got: {text}") from None
+    if not separator or count < 1 or not 1 <= index <= count:
+        raise ShardError(f"--shard expects i/N with 1 <= i <= N, got: {text}")
+    return index, count
+
+def shard_of(devName, count):
+    digest = hashlib.sha256(devName.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count + 1
+
+def select_shard(records, index, count, stats):
+    """
+    NOTE: Passes on only the records of shard 'index'; the rest are counted in
+    stats["other_shards"].
+    """
+    stats["other_shards"] = 0
+    for record in records:
+        if shard_of(record.devName, count) == index:
+            yield record
+        else:
+            stats["other_shards"] += 1
+
+def source_fingerprint(argv, paths):
+    """
+    NOTE: Identifies the input of a sharded run: the command line without --shard,
+    plus the content of every input file, so shards of different inputs are never
+    merged by mistake.
+    """
+    digest = hashlib.sha256()
+    skip_next = False
+    for arg in argv:
+        if skip_next:
+            skip_next = False
+            continue
+        if arg == "--shard":
+            skip_next = True
+            continue
+        if arg.startswith("--shard="):
+            continue
+        digest.update(arg.encode("utf-8") + b"\0")
+    for path in paths:
+        with open(path, "rb") as sourceFile:
+            for block in iter(lambda: sourceFile.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class ShardManifest:
+    """
+    NOTE: Written line by line as the shard runs, so memory stays flat for any
+    number of devices. The closing line marks the shard as complete.
+    """
+
+    def __init__(self, path, index, count, source, argv):
+        self.path = path
+        self.index = index
+        self.count = count
+        self.manifestFile = open(path, "w")
+        self.write({"format": MANIFEST_FORMAT, "shard": index, "of": count, "source": source,
+                    "argv": list(argv), "started": time.time()})
+
+    def write(self, entry):
+        self.manifestFile.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def device_done(self, record, config_name, output_sha):
+        self.write({"devName": record.devName, "status": "done", "file": config_name, "sha256": output_sha,
+                    "mgmt_ipaddr": record.mgmt_ipaddr, "deviceType": record.deviceType})
+
+    def device_failed(self, record, reason):
+        self.write({"devName": record.devName, "status": "failed", "reason": reason})
+
+    def close(self, stats):
+        self.write({"complete": True, "finished": time.time(), "devices": stats["rendered"] + stats["failed"],
+                    "rendered": stats["rendered"], "failed": stats["failed"]})
+        self.manifestFile.close()
+
+    def archive_path(self, output_dir):
+        return os.path.join(output_dir, f"STIG_shard_{self.index}_of_{self.count}.tar.gz")
+
+    def write_archive(self, output_dir):
+        """
+        NOTE: Packs the manifest and every config this shard generated. A hostname
+        listed twice in the source is packed once (its file holds the later config).
+        """
+        archive_path = self.archive_path(output_dir)
+        packed = set()
+        with tarfile.open(archive_path + ".part", "w:gz") as archive:
+            archive.add(self.path, arcname=MANIFEST_NAME)
+            for entry in read_manifest_lines(self.path):
+                if entry.get("status") == "done" and entry["file"] not in packed:
+                    archive.add(os.path.join(output_dir, entry["file"]), arcname=CONFIGS_DIR + entry["file"])
+                    packed.add(entry["file"])
+        os.replace(archive_path + ".part", archive_path)
+        return archive_path
+
+
+def read_manifest_lines(path_or_file):
+    manifestFile = open(path_or_file) if isinstance(path_or_file, str) else path_or_file
+    with manifestFile:
+        for line in manifestFile:
+            if line.strip():
+                yield json.loads(line)
+
+
+# ========================================================================================
+# Merge.
+# ========================================================================================
+
+def load_shard(archive_path):
+    """
+    NOTE: Returns (header, devices, footer) from a shard archive's manifest.
+    """
+    with tarfile.open(archive_path, "r:gz") as archive:
+        try:
+            member = archive.getmember(MANIFEST_NAME)
+        except KeyError:
+            raise ShardError(f"{archive_path} has no {MANIFEST_NAME}; it is not a shard archive.") from None
+        lines = list(read_manifest_lines(io.TextIOWrapper(archive.extractfile(member), encoding="utf-8")))
+    if not lines or lines[0].get("format") != MANIFEST_FORMAT:
+        raise ShardError(f"{archive_path} has an unreadable manifest.")
+    if not lines[-1].get("complete"):
+        raise ShardError(f"{archive_path} is from a shard run that did not finish.")
+    return lines[0], lines[1:-1], lines[-1]
+
+def merge_shards(archive_paths, output_path=None, extract_dir=None, report=print):
+    """
+    NOTE: Validates and combines shard archives. Configs are streamed from archive to
+    archive (or to extract_dir) one at a time and checked against their SHA-256.
+    """
+    shards = {}
+    for archive_path in archive_paths:
+        header, devices, footer = load_shard(archive_path)
+        if header["shard"] in shards:
+            raise ShardError(f"Shard {header['shard']} was given twice ({shards[header['shard']][0]} and {archive_path}).")
+        shards[header["shard"]] = (archive_path, header, devices, footer)
+
+    first = next(iter(shards.values()))[1]
+    count, source = first["of"], first["source"]
+    for archive_path, header, devices, footer in shards.values():
+        if header["of"] != count:
+            raise ShardError(f"{archive_path} is shard {header['shard']}/{header['of']}, but other shards are of {count}.")
+        if header["source"] != source:
+            raise ShardError(f"{archive_path} was generated from a different source or command line than the other shards.")
+    missing = sorted(set(range(1, count + 1)) - set(shards))
+    if missing:
+        raise ShardError("Missing shard(s): " + ", ".join(f"{index}/{count}" for index in missing))
+
+    fleet_devices = []
+    out_archive = tarfile.open(output_path + ".part", "w:gz") if output_path else None
+    try:
+        for index in sorted(shards):
+            archive_path, header, devices, footer = shards[index]
+            expected = {entry["file"]: entry["sha256"] for entry in devices if entry["status"] == "done"}
+            with tarfile.open(archive_path, "r:gz") as archive:
+                for member in archive:
+                    if not member.name.startswith(CONFIGS_DIR):
+                        continue
+                    config_name = member.name[len(CONFIGS_DIR):]
+                    data = archive.extractfile(member).read()
+                    if hashlib.sha256(data).hexdigest() != expected.pop(config_name, None):
+                        raise ShardError(f"{archive_path}: {config_name} does not match its manifest entry.")
+                    if out_archive is not None:
+                        info = tarfile.TarInfo(CONFIGS_DIR + config_name)
+                        info.size, info.mtime, info.mode = len(data), member.mtime, member.mode
+                        out_archive.addfile(info, io.BytesIO(data))
+                    if extract_dir is not None:
+                        with open(os.path.join(extract_dir, os.path.basename(config_name)), "wb") as configFile:
+                            configFile.write(data)
+            if expected:
+                raise ShardError(f"{archive_path} is missing configs listed in its manifest: " + ", ".join(sorted(expected)[:5]))
+            fleet_devices.extend(dict(entry, shard=index) for entry in devices)
+            report(f"   MERGED:     shard {index}/{count}  ({footer['rendered']} configs, {footer['failed']} failed)")
+
+        fleet_devices.sort(key=lambda entry: entry["devName"])
+        manifest = io.StringIO()
+        manifest.write(json.dumps({"format": MANIFEST_FORMAT, "shards": count, "source": source,
+                                   "argv": first["argv"], "merged": time.time()}) + "\n")
+        for entry in fleet_devices:
+            manifest.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        manifest_bytes = manifest.getvalue().encode("utf-8")
+        if out_archive is not None:
+            info = tarfile.TarInfo(MANIFEST_NAME)
+            info.size, info.mtime = len(manifest_bytes), int(time.time())
+            out_archive.addfile(info, io.BytesIO(manifest_bytes))
+        if extract_dir is not None:
+            with open(os.path.join(extract_dir, "STIG_fleet_" + MANIFEST_NAME), "wb") as manifestFile:
+                manifestFile.write(manifest_bytes)
+    finally:
+        if out_archive is not None:
+            out_archive.close()
+    if output_path:
+        os.replace(output_path + ".part", output_path)
+    return fleet_devices
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m STIG_Modules.shards",
+                                     description="Combine the results of a sharded Batch Mode run.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_merge = sub.add_parser("merge", help="combine every shard archive of one run")
+    p_merge.add_argument("archives", nargs="+", help="the STIG_shard_<i>_of_<N>.tar.gz files")
+    p_merge.add_argument("--output", help="write one fleet-wide archive here")
+    p_merge.add_argument("--extract", metavar="DIR", help="write the configs and fleet manifest into this directory")
+    args = parser.parse_args(argv)
+    if not args.output and not args.extract:
+        parser.error("give --output and/or --extract")
+    if args.extract and not os.path.isdir(args.extract):
+        print(f"ERROR:\n   The directory [{args.extract}] does not exist.\n")
+        return 1
+    try:
+        fleet_devices = merge_shards(args.archives, args.output, args.extract)
+    except (ShardError, OSError, tarfile.TarError) as err:
+        print(f"\nERROR:\n   The shards could not be merged. {err}\n")
+        if args.output and os.path.exists(args.output + ".part"):
+            os.remove(args.output + ".part")
+        return 1
+    failed = sum(1 for entry in fleet_devices if entry["status"] == "failed")
+    print("\n" + "#"*22 + "\n## SHARD MERGE DONE ##\n" + "#"*22)
+    print(f"  Shards merged:             {len(args.archives)}")
+    print(f"  Devices:                   {len(fleet_devices)}")
+    print(f"  Configs:                   {len(fleet_devices) - failed}")
+    print(f"  Devices failed:            {failed}")
+    if args.output:
+        print(f"  Fleet archive:             {args.output}")
+    if args.extract:
+        print(f"  Extracted to:              {args.extract}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+"""
+TITLE:           snmp_collectors.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) Builds the SNMP READ/WRITE ACLs (SECTION_11 of platform_IOS.j2,
+                SECTION_12 of platform_NEXUS.j2) from lists of the SNMP collectors that
+                poll each network, instead of the [ReplaceThisValueWith:x.x.x.x] host
+                lines.
+                2) The lists are read ONE time per run, from ./STIG_Templates:
+                snmp_collectors_<networkType>.csv for a network, or snmp_collectors.csv for
+                every network without its own file. Each row is:  "READ","10.1.2.3"  or
+                "WRITE","10.1.8.0/24"  (a host address or a prefix).
+                3) Every list is collapsed into the fewest prefixes that cover exactly the
+                same addresses (adjacent and overlapping entries merged), and written as
+                ACL entries for each platform once:
+                - IOS/IOS-XE:  permit host 10.1.2.3  /  permit 10.1.8.0 0.0.0.255
+                - NX-OS:       permit ip 10.1.8.0/24 any
+                Every device of the network then shares those entries.
+
+USAGE:          From the ./Scripts directory:
+                python STIG_config_builder.py --csv fleet.csv --snmp-collectors
+                python -m STIG_Modules.snmp_collectors            <--- show the aggregated ACLs
+
+NOTE:           Standard IPv4 ACLs only. Networks without a collector file (and no
+                snmp_collectors.csv) keep the template's placeholder lines.
+"""
+
+import csv, ipaddress, os, sys
+from collections import namedtuple
+
+from STIG_Modules.reference_store import DEFAULT_STIG_TEMPLATES_PATH
+
+
+COLLECTOR_FILE_PREFIX = "snmp_collectors"
+ACCESS_TYPES = ("READ", "WRITE")
+
+# The template keeps the old entries of an ACL from sequence number 50 on (resequence 50
+# 10) while the new entries are added from 1; a longer list moves the old ones further up.
+FIRST_OLD_SEQUENCE = 50
+
+# entries:           ACL entry text after 'permit' (the template adds ' log' for WRITE)
+# resequence_start:  where the old entries are moved to, clear of the new ones
+AclEntries = namedtuple("AclEntries", ("entries", "resequence_start"))
+
+
+class SnmpCollectorsError(ValueError):
+    pass
+
+
+def read_collector_file(path):
+    """
+    NOTE: {"READ": [IPv4Network, ...], "WRITE": [...]} from one collector file.
+    """
+    networks = {access: [] for access in ACCESS_TYPES}
+    try:
+        with open(path, newline="") as collectorFile:
+            for line_number, row in enumerate(csv.reader(collectorFile), start=1):
+                if not row or not "".join(row).strip():
+                    continue
+                if len(row) != 2 or row[0].strip().upper() not in ACCESS_TYPES:
+                    raise SnmpCollectorsError(f"[{path}] line {line_number}: expected \"READ\" or \"WRITE\" "
+                                              f"and an address, e.g. \"READ\",\"10.1.2.3\".")
+                try:
+                    network = ipaddress.IPv4Network(row[1].strip())
+                except ValueError as err:
+                    raise SnmpCollectorsError(f"[{path}] line {line_number}: {err}") from None
+                networks[row[0].strip().upper()].append(network)
+    except OSError as err:
+        raise SnmpCollectorsError(f"The SNMP collector file could not be read: {err}") from None
+    return networks
+
+def aggregate(networks):
+    return list(ipaddress.collapse_addresses(networks))
+
+def ios_entry(network):
+    if network.prefixlen == 32:
+        return f"host {network.network_address}"
+    return f"{network.network_address} {network.hostmask}"
+
+def nexus_entry(network):
+    return f"ip {network} any"
+
+def acl_entries(networks, entry_format):
+    entries = [entry_format(network) for network in networks]
+    resequence_start = max(FIRST_OLD_SEQUENCE, (len(entries) // 10 + 1) * 10)
+    return AclEntries(entries, resequence_start)
+
+
+class SnmpCollectors:
+    """
+    NOTE: Loads every collector file once, and hands the template the aggregated ACL
+    entries for a device's networkType and platform (render_kwargs()).
+    """
+
+    def __init__(self, stig_templates_path=DEFAULT_STIG_TEMPLATES_PATH):
+        self.stig_templates_path = stig_templates_path
+        self.networks = {}
+        self.addresses_read = 0
+        for name in sorted(os.listdir(stig_templates_path)):
+            stem, extension = os.path.splitext(name)
+            if extension != ".csv" or not (stem == COLLECTOR_FILE_PREFIX or stem.startswith(COLLECTOR_FILE_PREFIX + "_")):
+                continue
+            networkType = stem[len(COLLECTOR_FILE_PREFIX) + 1:] or None
+            collectors = read_collector_file(os.path.join(stig_templates_path, name))
+            self.addresses_read += sum(len(networks) for networks in collectors.values())
+            self.networks[networkType] = {access: aggregate(networks) for access, networks in collectors.items()}
+        self.acls = {}
+
+    def networks_for(self, networkType):
+        """
+        NOTE: The aggregated networks of a networkType (or the default file), or None.
+        """
+        return self.networks.get(networkType, self.networks.get(None))
+
+    def render_kwargs(self, record):
+        """
+        NOTE: The extra template variable 'snmp_collectors' ({"READ": AclEntries,
+        "WRITE": AclEntries}) for IOS and NX-OS devices of a network with collectors.
+        """
+        from STIG_Modules.reference_data import IOS_DEVICE_TYPES, NEXUS_DEVICE_TYPES
+        if record.deviceType in IOS_DEVICE_TYPES:
+            platform, entry_format = "IOS", ios_entry
+        elif record.deviceType in NEXUS_DEVICE_TYPES:
+            platform, entry_format = "NEXUS", nexus_entry
+        else:
+            return {}
+        key = (record.networkType, platform)
+        acls = self.acls.get(key)
+        if acls is None:
+            networks = self.networks_for(record.networkType)
+            acls = self.acls[key] = {} if networks is None else {
+                access: acl_entries(networks[access], entry_format) for access in ACCESS_TYPES}
+        return {"snmp_collectors": acls} if acls else {}
+
+    def entry_count(self):
+        return sum(len(networks) for collectors in self.networks.values() for networks in collectors.values())
+
+    def summary_lines(self):
+        return ["\n" + "#"*29 + "\n## SNMP COLLECTORS SUMMARY ##\n" + "#"*29,
+                f"  Collector lists:           {len(self.networks)}",
+                f"  Addresses read:            {self.addresses_read}",
+                f"  ACL entries after merge:   {self.entry_count()}"]
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m STIG_Modules.snmp_collectors",
+                                     description="Show the SNMP ACL entries built from the collector files.")
+    parser.add_argument("--templates", default=DEFAULT_STIG_TEMPLATES_PATH,
+                        help="STIG_Templates directory (default: %(default)s)")
+    parser.add_argument("--platform", choices=("IOS", "NEXUS"), default="IOS")
+    args = parser.parse_args(argv)
+    try:
+        collectors = SnmpCollectors(args.templates)
+    except (SnmpCollectorsError, OSError) as err:
+        print(f"ERROR:\n   {err}\n")
+        return 1
+    entry_format = ios_entry if args.platform == "IOS" else nexus_entry
+    for networkType, networks in sorted(collectors.networks.items(), key=lambda item: item[0] or ""):
+        for access in ACCESS_TYPES:
+            print(f"\n{COLLECTOR_FILE_PREFIX}{'_' + networkType if networkType else ''}.csv  {access}")
+            for number, entry in enumerate(acl_entries(networks[access], entry_format).entries, start=1):
+                print(f"   {number} permit {entry}")
+    for line in collectors.summary_lines():
+        print(line)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,308 @@
+"""
+TITLE:           ssh_standin.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) A local stand-in for a fleet of Cisco devices reached over SSH, used to
+                try out config_delivery.py without real hardware. One server answers for
+                every device: a device is told apart by the loopback address it was
+                reached at (127.b.c.d for mgmt_ipaddr a.b.c.d, see --loopback in
+                config_delivery.py), and keeps its own running config while the stand-in
+                runs.
+                2) It speaks enough of the IOS/NX-OS CLI for delivery: prompts, 'terminal
+                length 0', 'configure terminal' (with sub-mode prompts and banner
+                blocks), 'end', 'write memory', 'copy running-config startup-config'
+                and 'show running-config'. Lines the device could not take (unreplaced
+                [ReplaceThisValueWith:...] values) get '% Invalid input'.
+                Every device starts with the factory accounts admin, cisco and webadmin,
+                and 'no username <name>' for an account that exists asks "[confirm]"
+                the way IOS-XE does: the next line is the answer (empty or 'y' removes
+                the account, anything else cancels), and no prompt comes until then.
+                3) Like a real device it has a small input buffer: data that arrives
+                faster than it is processed and overruns --input-buffer bytes is dropped.
+                --line-delay, --fail-rate and --max-sessions make it slow or flaky on
+                purpose.
+
+USAGE:          From the ./Scripts directory:
+                python -m STIG_Modules.ssh_standin --port 2222
+                python -m STIG_Modules.config_delivery push --manifest ... --port 2222 --loopback --no-host-key-check
+
+NOTE:           Requires the asyncssh package (pip install asyncssh). It listens on all
+                addresses (so it can answer at any 127.x.y.z) but refuses every
+                connection that does not come from the loopback network. Any username
+                is accepted with the --password password.
+"""
+
+import argparse, asyncio, collections, ipaddress, random, re, time
+
+from STIG_Modules.device_ssh import DeviceSSHError, load_asyncssh
+
+
+FACTORY_USERS = ("admin", "cisco", "webadmin")
+REMOVE_USER_QUESTION = ("This operation will remove all username related configurations with same name."
+                        "Do you want to continue? [confirm]")
+SUB_MODES = (("interface ", "config-if"), ("line ", "config-line"), ("router ", "config-router"),
+             ("ip access-list ", "config-acl"), ("vlan ", "config-vlan"), ("aaa group ", "config-sg"))
+INVALID = "% Invalid input detected at '^' marker."
+
+
+class StandinDevice:
+
+    def __init__(self, address, config_lines):
+        self.address = address
+        self.hostname = "standin-" + address.replace(".", "-")
+        self.running = ["!", "version 15.2", f"hostname {self.hostname}", "!"]
+        self.running += [f"username {name} privilege 15 secret 9 $9$standin" for name in FACTORY_USERS] + ["!"]
+        self.running += [f"interface GigabitEthernet1/0/{number}\n description standin port {number}\n shutdown\n!"
+                         for number in range(1, config_lines // 4 + 1)]
+        self.saved = False
+        self.config_sessions = 0
+
+
+class StandinState:
+
+    def __init__(self, args):
+        self.args = args
+        self.devices = {}
+        self.stats = collections.Counter()
+        self.open_sessions = 0
+
+    def device(self, address):
+        if address not in self.devices:
+            self.devices[address] = StandinDevice(address, self.args.config_lines)
+        return self.devices[address]
+
+
+class StandinCLI:
+    """
+    NOTE: One interactive session on one stand-in device.
+    """
+
+    def __init__(self, state, device, process):
+        self.state = state
+        self.device = device
+        self.process = process
+        self.mode = "exec"
+        self.banner_delimiter = None
+        self.confirm = None
+        self.lines = asyncio.Queue()
+        self.queued_bytes = 0
+        self.partial = ""
+
+    def prompt(self):
+        if self.banner_delimiter is not None or self.confirm is not None:
+            return ""
+        if self.mode == "exec":
+            return self.device.hostname + "#"
+        return f"{self.device.hostname}({self.mode})#"
+
+    def write(self, text):
+        self.process.stdout.write(text.replace("\n", "\r\n"))
+
+    async def receive(self):
+        """
+        NOTE: Moves input into the line queue, dropping what overruns the input buffer.
+        """
+        while True:
+            data = await self.process.stdin.read(4096)
+            if not data:
+                self.lines.put_nowait(None)
+                return
+            if self.queued_bytes + len(data) > self.state.args.input_buffer:
+                self.state.stats["overruns"] += 1
+                self.state.stats["bytes dropped"] += len(data)
+                continue
+            self.queued_bytes += len(data)
+            self.partial += data.replace("\r\n", "\n").replace("\r", "\n")
+            *complete, self.partial = self.partial.split("\n")
+            for line in complete:
+                self.lines.put_nowait(line)
+
+    async def run(self):
+        receiver = asyncio.ensure_future(self.receive())
+        try:
+            self.write(f"\n{self.prompt()}")
+            while True:
+                line = await self.lines.get()
+                if line is None:
+                    break
+                self.queued_bytes = max(0, self.queued_bytes - len(line) - 1)
+                if self.state.args.line_delay:
+                    await asyncio.sleep(self.state.args.line_delay / 1000)
+                self.write(line + "\n")
+                if not self.handle(line):
+                    break
+                self.write(self.prompt())
+        finally:
+            receiver.cancel()
+            self.process.exit(0)
+
+    def handle(self, line):
+        """
+        NOTE: Returns False when the session ends.
+        """
+        self.state.stats["lines"] += 1
+        text = line.strip()
+        if self.confirm is not None:
+            action, self.confirm = self.confirm, None
+            if text.lower() in ("", "y", "yes"):
+                action()
+            else:
+                self.state.stats["confirmations refused"] += 1
+            return True
+        if self.banner_delimiter is not None:
+            self.device.running.append(line)
+            if self.banner_delimiter in line:
+                self.banner_delimiter = None
+            return True
+        if self.mode == "exec":
+            return self.exec_command(text)
+        if text in ("end", "\x1a"):
+            self.mode = "exec"
+        elif text == "exit":
+            self.mode = "exec" if self.mode == "config" else "config"
+        elif not text or text == "!":
+            pass
+        elif text.startswith("no username "):
+            self.remove_user(text.split()[2])
+        elif "[ReplaceThisValueWith:" in text:
+            self.state.stats["rejected lines"] += 1
+            self.write(" " * (line.find("[") + len(self.prompt())) + "^\n" + INVALID + "\n\n")
+        else:
+            self.device.running.append(line)
+            match = re.match(r"banner\s+\S+\s+(\S)(.*)$", text)
+            if match and match.group(1) not in match.group(2):
+                self.banner_delimiter = match.group(1)
+                self.write(f"Enter TEXT message.  End with the character '{match.group(1)}'.\n")
+            elif text.startswith("hostname "):
+                self.device.hostname = text.split()[1]
+            elif not line.startswith(" "):
+                self.mode = next((mode for prefix, mode in SUB_MODES if text.startswith(prefix)), "config")
+        return True
+
+    def remove_user(self, name):
+        """
+        NOTE: Asks for confirmation when the account exists; the removal happens once
+        the next line confirms it.
+        """
+        user_lines = [line for line in self.device.running if line.startswith(f"username {name} ")]
+        if not user_lines:
+            return
+
+        def remove():
+            self.state.stats["accounts removed"] += 1
+            self.device.running = [line for line in self.device.running if line not in user_lines]
+        self.state.stats["confirmations asked"] += 1
+        self.confirm = remove
+        self.write(REMOVE_USER_QUESTION)
+
+    def exec_command(self, text):
+        if text in ("exit", "logout", "quit"):
+            return False
+        if text.startswith("terminal ") or not text:
+            pass
+        elif text in ("configure terminal", "conf t"):
+            self.mode = "config"
+            self.device.config_sessions += 1
+            self.state.stats["config sessions"] += 1
+            self.write("Enter configuration commands, one per line.  End with CNTL/Z.\n")
+        elif text in ("write memory", "copy running-config startup-config"):
+            self.device.saved = True
+            self.write("Building configuration...\n[OK]\n")
+        elif text == "show running-config":
+            self.state.stats["running-configs shown"] += 1
+            body = "\n".join(self.device.running) + "\nend\n"
+            self.write(f"Building configuration...\n\nCurrent configuration : {len(body)} bytes\n{body}\n")
+        else:
+            self.write(" " * len(self.prompt()) + "^\n" + INVALID + "\n\n")
+        return True
+
+
+def make_server_class(asyncssh, state):
+
+    class StandinServer(asyncssh.SSHServer):
+
+        def connection_made(self, connection):
+            self.connection = connection
+            peer = connection.get_extra_info("peername")[0]
+            if not ipaddress.ip_address(peer).is_loopback:
+                state.stats["refused (not loopback)"] += 1
+                connection.close()
+
+        def begin_auth(self, username):
+            return True
+
+        def password_auth_supported(self):
+            return True
+
+        def validate_password(self, username, password):
+            if state.args.fail_rate and random.random() < state.args.fail_rate:
+                state.stats["logins failed on purpose"] += 1
+                return False
+            state.stats["logins"] += 1
+            return password == state.args.password
+
+    return StandinServer
+
+
+async def serve(args):
+    asyncssh = load_asyncssh()
+    state = StandinState(args)
+
+    async def handle_process(process):
+        address = process.channel.get_extra_info("sockname")[0]
+        if state.open_sessions >= args.max_sessions:
+            state.stats["sessions refused (busy)"] += 1
+            process.stdout.write("% No free VTY lines\r\n")
+            process.exit(1)
+            return
+        state.open_sessions += 1
+        state.stats["sessions"] += 1
+        try:
+            await StandinCLI(state, state.device(address), process).run()
+        finally:
+            state.open_sessions -= 1
+
+    server = await asyncssh.listen(args.host, args.port, server_factory=make_server_class(asyncssh, state),
+                                   server_host_keys=[asyncssh.generate_private_key("ssh-ed25519")],
+                                   process_factory=handle_process, line_editor=False, encoding="utf-8")
+    print(f"SSH stand-in listening on port {args.port} (loopback clients only).  Ctrl+C to stop")
+    started = time.time()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        server.close()
+        print(f"\n{len(state.devices)} devices, {time.time() - started:.0f}s")
+        for name, count in sorted(state.stats.items()):
+            print(f"  {name + ':':<27}{count}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m STIG_Modules.ssh_standin",
+                                     description="Answer SSH logins as a fleet of Cisco devices, for config_delivery.py.")
+    parser.add_argument("--host", default="", help="address to listen on (default: all; only loopback clients are served)")
+    parser.add_argument("--port", type=int, default=2222)
+    parser.add_argument("--password", default="stig", help="the password every device accepts (default: %(default)s)")
+    parser.add_argument("--config-lines", type=int, default=200,
+                        help="size of each device's starting running config, in lines (default: %(default)s)")
+    parser.add_argument("--input-buffer", type=int, default=4096,
+                        help="bytes a device buffers before it drops input (default: %(default)s)")
+    parser.add_argument("--line-delay", type=float, default=0.0, metavar="MS",
+                        help="time a device takes per command line (default: %(default)s)")
+    parser.add_argument("--fail-rate", type=float, default=0.0,
+                        help="fraction of logins to fail on purpose, to exercise retries (default: %(default)s)")
+    parser.add_argument("--max-sessions", type=int, default=10000,
+                        help="sessions served at once before new ones are refused (default: %(default)s)")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    except DeviceSSHError as err:
+        print(f"ERROR:\n   {err}\n")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,127 @@
+"""
+TITLE:           startup_bench.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) Measures how long STIG_config_builder.py takes to start for the
+                commands that should return almost immediately (--help, --validate), and
+                which modules each one imports (a 'python -X importtime' report).
+                2) Every measurement is appended to a history csv, so startup time can be
+                tracked from one change to the next, and the run fails (exit code 1)
+                when a command goes over its time budget or loads a module it should
+                not (e.g. Jinja2 for --help).
+
+USAGE:          From the ./Scripts directory:
+                python -m STIG_Modules.startup_bench
+                python -m STIG_Modules.startup_bench --runs 20 --top 15
+                python -m STIG_Modules.startup_bench --history ../startup_history.csv
+"""
+
+import csv, os, statistics, subprocess, sys, time
+
+
+SCRIPT = "STIG_config_builder.py"
+DEFAULT_HISTORY = "./Generated_Configs/.stig_startup_history.csv"
+HISTORY_FIELDS = ("timestamp", "commit", "command", "runs", "min_ms", "median_ms", "modules", "budget_ms", "result")
+
+# (command line, time budget in ms, modules that must NOT be imported)
+BENCH_COMMANDS = (
+    (("--help",), 100, ("jinja2", "readline", "sqlite3", "yaml")),
+    (("--csv", "File_Mode/multidevice_example.csv", "--validate", "--quiet"), 100, ("jinja2", "readline")),
+)
+
+
+def time_command(args, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, SCRIPT, *args], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+def import_report(args):
+    """
+    NOTE: Returns [(module, self_us, cumulative_us), ...] from 'python -X importtime'.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", SCRIPT, *args],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+def git_commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return ""
+    return result.stdout.strip()
+
+def previous_medians(history_path):
+    medians = {}
+    if os.path.isfile(history_path):
+        with open(history_path, newline='') as historyFile:
+            for row in csv.DictReader(historyFile):
+                medians[row["command"]] = float(row["median_ms"])
+    return medians
+
+def append_history(history_path, rows):
+    new_file = not os.path.isfile(history_path)
+    with open(history_path, "a", newline='') as historyFile:
+        writer = csv.DictWriter(historyFile, fieldnames=HISTORY_FIELDS)
+        if new_file:
+            writer.writeheader()
+        writer.writerows(rows)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m STIG_Modules.startup_bench",
+                                     description="Benchmark and track the startup time of STIG_config_builder.py.")
+    parser.add_argument("--runs", type=int, default=10, help="timed runs per command (default: %(default)s)")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list per command (default: %(default)s)")
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="history csv to append to (default: %(default)s)")
+    parser.add_argument("--no-history", action="store_const", const=None, dest="history", help="do not record this run")
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(SCRIPT):
+        print(f"ERROR:\n   Run this from the ./Scripts directory (where {SCRIPT} is).\n")
+        return 1
+    previous = previous_medians(args.history) if args.history else {}
+    commit = git_commit()
+    history_rows = []
+    failed = False
+    for command, budget_ms, forbidden in BENCH_COMMANDS:
+        label = " ".join(command)
+        time_command(command, 1)                    # warm the OS file cache and .pyc files
+        timings = time_command(command, args.runs)
+        modules = import_report(command)
+        median_ms = statistics.median(timings)
+        loaded_forbidden = sorted({name for name, _, _ in modules if name.split(".")[0] in forbidden})
+        result = "PASS" if median_ms <= budget_ms and not loaded_forbidden else "FAIL"
+        failed = failed or result == "FAIL"
+
+        title = f"## {label} ##"
+        print("\n" + "#"*len(title) + "\n" + title + "\n" + "#"*len(title))
+        print(f"  Median:                    {median_ms:.1f} ms   (min {min(timings):.1f} ms, budget {budget_ms} ms)  {result}")
+        if label in previous:
+            print(f"  Previous median:           {previous[label]:.1f} ms   ({median_ms - previous[label]:+.1f} ms)")
+        print(f"  Modules imported:          {len(modules)}")
+        if loaded_forbidden:
+            print(f"  Should not be imported:    {', '.join(loaded_forbidden)}")
+        print("  Slowest imports (cumulative):")
+        for name, self_us, cumulative_us in sorted(modules, key=lambda module: module[2], reverse=True)[:args.top]:
+            print(f"      {cumulative_us / 1000:>7.1f} ms  {name}")
+        history_rows.append({"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": commit, "command": label,
+                             "runs": args.runs, "min_ms": f"{min(timings):.1f}", "median_ms": f"{median_ms:.1f}",
+                             "modules": len(modules), "budget_ms": budget_ms, "result": result})
+    if args.history:
+        append_history(args.history, history_rows)
+        print(f"\nRecorded in {args.history}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
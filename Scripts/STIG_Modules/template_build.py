@@ -0,0 +1,134 @@
+"""
+TITLE:           template_build.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) Compiles the Jinja2 platform templates in ./Jinja_Templates ahead of time
+                into plain Python modules (Jinja's Environment.compile_templates()), kept
+                in ./Jinja_Templates/.compiled/ next to a manifest of the SHA-256 of each
+                .j2 source.
+                2) load_environment() hands out a Jinja Environment that loads those
+                precompiled render functions through a ModuleLoader, so no template is
+                lexed, parsed or compiled at runtime. If any .j2 file was added, removed
+                or edited since the last build (or Jinja was upgraded), the templates are
+                rebuilt first, so a stale module is never used.
+
+USAGE:          From the ./Scripts directory:
+                python -m STIG_Modules.template_build build
+                python -m STIG_Modules.template_build check
+
+NOTE:           Both loaders use a default Environment(), so the precompiled templates
+                render exactly what the .j2 sources do. If you ever give the Environment
+                options (trim_blocks, filters, ...), give them to build_templates() too.
+"""
+
+import hashlib, json, os, shutil, sys
+
+
+DEFAULT_JINJA_TEMPLATES_PATH = "./Jinja_Templates"
+COMPILED_DIR = ".compiled"
+MANIFEST_FILE = "sources.json"
+TEMPLATE_SUFFIX = ".j2"
+
+
+def compiled_path(jinja_templates_path):
+    return os.path.join(jinja_templates_path, COMPILED_DIR)
+
+def source_hashes(jinja_templates_path):
+    hashes = {}
+    for name in sorted(os.listdir(jinja_templates_path)):
+        if name.endswith(TEMPLATE_SUFFIX):
+            with open(os.path.join(jinja_templates_path, name), "rb") as sourceFile:
+                hashes[name] = hashlib.sha256(sourceFile.read()).hexdigest()
+    return hashes
+
+def jinja_version():
+    import jinja2
+    return getattr(jinja2, "__version__", "")
+
+def stale_reason(jinja_templates_path):
+    """
+    NOTE: Returns None when the precompiled modules match the .j2 sources, otherwise
+    a short description of why they do not.
+    """
+    manifest_path = os.path.join(compiled_path(jinja_templates_path), MANIFEST_FILE)
+    try:
+        with open(manifest_path) as manifestFile:
+            manifest = json.load(manifestFile)
+    except (OSError, ValueError):
+        return "not built yet"
+    if manifest.get("jinja") != jinja_version():
+        return f"built with Jinja2 {manifest.get('jinja')}"
+    built = manifest.get("sources", {})
+    current = source_hashes(jinja_templates_path)
+    changed = sorted(name for name in set(built) | set(current) if built.get(name) != current.get(name))
+    if changed:
+        return "changed: " + ", ".join(changed)
+    return None
+
+def build_templates(jinja_templates_path=DEFAULT_JINJA_TEMPLATES_PATH):
+    """
+    NOTE: Builds into a temporary directory and swaps it into place, so another run
+    never loads a half-written set of modules.
+    """
+    import tempfile
+    from jinja2 import Environment, FileSystemLoader
+    target = compiled_path(jinja_templates_path)
+    hashes = source_hashes(jinja_templates_path)
+    build_dir = tempfile.mkdtemp(dir=jinja_templates_path, prefix=COMPILED_DIR + ".build-")
+    try:
+        os.chmod(build_dir, 0o755)
+        environ = Environment(loader=FileSystemLoader(jinja_templates_path))
+        environ.compile_templates(build_dir, zip=None, ignore_errors=False,
+                                  filter_func=lambda name: name.endswith(TEMPLATE_SUFFIX), log_function=None)
+        with open(os.path.join(build_dir, MANIFEST_FILE), "w") as manifestFile:
+            json.dump({"jinja": jinja_version(), "sources": hashes}, manifestFile, indent=1)
+        old_dir = None
+        if os.path.isdir(target):
+            old_dir = tempfile.mkdtemp(dir=jinja_templates_path, prefix=COMPILED_DIR + ".old-")
+            os.rmdir(old_dir)
+            os.rename(target, old_dir)
+        os.rename(build_dir, target)
+        if old_dir:
+            shutil.rmtree(old_dir, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+    return sorted(hashes)
+
+def load_environment(jinja_templates_path=DEFAULT_JINJA_TEMPLATES_PATH):
+    """
+    NOTE: Returns a Jinja Environment for the templates. It uses the precompiled
+    modules (rebuilding them first when stale), and falls back to the .j2 sources if
+    they cannot be built (e.g. a read-only checkout).
+    """
+    from jinja2 import Environment, FileSystemLoader, ModuleLoader
+    if stale_reason(jinja_templates_path) is not None:
+        try:
+            build_templates(jinja_templates_path)
+        except OSError:
+            return Environment(loader=FileSystemLoader(jinja_templates_path))
+    return Environment(loader=ModuleLoader(compiled_path(jinja_templates_path)))
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m STIG_Modules.template_build",
+                                     description="Precompile the Jinja2 platform templates into Python modules.")
+    parser.add_argument("--templates", default=DEFAULT_JINJA_TEMPLATES_PATH,
+                        help="the Jinja_Templates directory (default: %(default)s)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("build", help="(re)build the precompiled templates")
+    sub.add_parser("check", help="report whether the precompiled templates are up to date")
+    args = parser.parse_args(argv)
+
+    if args.command == "check":
+        reason = stale_reason(args.templates)
+        print("Precompiled templates are up to date." if reason is None else f"Precompiled templates are stale ({reason}).")
+        return 0 if reason is None else 1
+    names = build_templates(args.templates)
+    print(f"Compiled {len(names)} templates into {compiled_path(args.templates)}:  {', '.join(names)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
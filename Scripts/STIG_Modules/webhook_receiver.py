@@ -0,0 +1,488 @@
+"""
+TITLE:           webhook_receiver.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) A small local HTTP receiver for NetBox/Nautobot device webhooks, so a
+                device's STIG config is regenerated as soon as the device is created or
+                changed in the DCIM, with no one running the script.
+                2) Each event is checked and queued by the HTTP thread (202 Accepted) and
+                nothing else, so a sender is never kept waiting on a render. Events for
+                the same device are coalesced: a burst of updates to one device (a bulk
+                import, a script editing several fields) renders it once, with the data
+                of the latest event, once the device has been quiet for 'debounce'
+                seconds (or 'max_wait' seconds after its first event at the latest).
+                3) One render thread keeps the templates, the reference data and the
+                site contexts of earlier events warm for the life of the receiver, and
+                renders the affected devices only, through the same run_batch() as
+                every other batch source.
+                4) Every outcome is appended to a status record (JSON lines, one per
+                device rendered), and the latest status of a device is served at
+                GET /status/<devName>. GET /status answers 503 (and events are refused
+                with 503) if the render thread has stopped.
+
+USAGE:          From the ./Scripts directory:
+                python STIG_config_builder.py --webhook --webhook-port 8081
+                python -m STIG_Modules.webhook_standin netbox_devices.json --url http://127.0.0.1:8081/webhook
+
+WEBHOOK:        Point a NetBox/Nautobot webhook for dcim | device (created, updated) at
+                http://<host>:<port>/webhook with the default body. With a secret set
+                (--webhook-secret or STIG_WEBHOOK_SECRET), the X-Hook-Signature header
+                (HMAC-SHA512 of the body) is required and checked. A secret is required
+                unless the receiver listens on a loopback address (127.0.0.1, ::1).
+
+NOTE:           Deleted devices keep their last config; delete events are counted and
+                otherwise ignored. Changes to the STIG_Templates reference files are
+                picked up when the receiver is restarted. With --history, every render
+                batch is recorded as a run of its own (<RUN_ID>.<batch>), so each update
+                of a device is kept as a generation.
+"""
+
+import hashlib, hmac, http.server, json, os, threading, time
+
+from STIG_Modules.inventory_adapters import InventoryError, build_record, dcim_device_values
+
+
+DEFAULT_DEBOUNCE = 0.5
+DEFAULT_MAX_WAIT = 5.0
+DEFAULT_WEBHOOK_STATUS = "./Generated_Configs/.stig_webhook_status.jsonl"
+
+SECRET_ENV = "STIG_WEBHOOK_SECRET"
+SIGNATURE_HEADER = "X-Hook-Signature"
+DEVICE_MODELS = ("device", "dcim.device")
+RENDER_EVENTS = ("created", "updated")
+MAX_BODY_SIZE = 1024 * 1024
+
+# Ready devices are rendered in runs of at most this many, oldest event first, so the
+# first configs of a bulk import are written while its later events are still arriving.
+RENDER_BATCH = 64
+
+
+class WebhookError(ValueError):
+    """
+    NOTE: A rejected event. 'status' is the HTTP status code it is answered with.
+    """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def is_loopback(host):
+    """
+    NOTE: True if 'host' only takes connections from this machine.
+    """
+    import ipaddress
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def signature_ok(secret, body, signature):
+    expected = hmac.new(secret.encode("utf-8"), body, hashlib.sha512).hexdigest()
+    return hmac.compare_digest(expected, (signature or "").strip().lower())
+
+def parse_event(body, source, defaults):
+    """
+    NOTE: Returns (event, device key, DeviceRecord or None) for a webhook body. The
+    record is only built for the events that render.
+    """
+    try:
+        payload = json.loads(body)
+    except ValueError as err:
+        raise WebhookError(400, f"The body is not JSON: {err}") from None
+    if not isinstance(payload, dict) or not isinstance(payload.get("data"), dict):
+        raise WebhookError(400, "The body has no 'data' object.")
+    model = str(payload.get("model") or "device").lower()
+    if model not in DEVICE_MODELS:
+        raise WebhookError(422, f"Only device events are handled, not [{model}].")
+    event = str(payload.get("event") or "updated").lower()
+    device = payload["data"]
+    key = device.get("id") or device.get("name")
+    if event not in RENDER_EVENTS:
+        return event, key, None
+    try:
+        record = build_record(dcim_device_values(device, source), defaults)
+    except InventoryError as err:
+        raise WebhookError(422, str(err)) from None
+    return event, key or record.devName, record
+
+
+class EventCoalescer:
+    """
+    NOTE: The queue between the HTTP threads and the render thread. Holds the latest
+    record of each device with an event waiting, keyed by device ID.
+    """
+
+    def __init__(self, debounce=DEFAULT_DEBOUNCE, max_wait=DEFAULT_MAX_WAIT):
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self.condition = threading.Condition()
+        # key: [record, first event, last event, events]
+        self.pending = {}
+        self.events = 0
+        self.coalesced = 0
+        self.stopping = False
+
+    def add(self, key, record):
+        now = time.monotonic()
+        with self.condition:
+            self.events += 1
+            entry = self.pending.get(key)
+            if entry is None:
+                # A waiting render thread already wakes up before any new device is due,
+                # unless nothing was pending at all.
+                if not self.pending:
+                    self.condition.notify()
+                self.pending[key] = [record, now, now, 1]
+            else:
+                self.coalesced += 1
+                entry[0], entry[2], entry[3] = record, now, entry[3] + 1
+
+    def take_ready(self):
+        """
+        NOTE: Blocks until at least one device is ready, and returns up to RENDER_BATCH
+        ready ones as [(record, last event, events)]. Returns [] once stop() was called and nothing
+        is left.
+        """
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                ready, wake = [], None
+                for key, (record, first, last, events) in self.pending.items():
+                    due = min(last + self.debounce, first + self.max_wait)
+                    if due <= now or self.stopping:
+                        ready.append(key)
+                        if len(ready) == RENDER_BATCH:
+                            break
+                    elif wake is None or due < wake:
+                        wake = due
+                if ready:
+                    return [(record, last, events) for record, _, last, events in map(self.pending.pop, ready)]
+                if self.stopping:
+                    return []
+                self.condition.wait(None if wake is None else wake - now)
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+
+
+class StatusLog:
+    """
+    NOTE: Handed to run_batch() in place of a shard manifest: appends one JSON line per
+    device rendered, and keeps the latest line of each device for GET /status/.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.statusFile = open(path, "a")
+        self.latest = {}
+        self.batch = {}
+        self.written = set()
+        self.lock = threading.Lock()
+
+    def begin(self, batch):
+        """
+        NOTE: 'batch' is {devName: (last event, events)} for the next run_batch().
+        """
+        self.batch = batch
+        self.written = set()
+
+    def write(self, entry):
+        last, events = self.batch.get(entry["devName"], (None, 0))
+        entry["events"] = events
+        entry["time"] = time.time()
+        if last is not None:
+            entry["latency_ms"] = round((time.monotonic() - last) * 1000, 1)
+        self.statusFile.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        self.written.add(entry["devName"])
+        with self.lock:
+            self.latest[entry["devName"]] = entry
+
+    def device_done(self, record, config_name, output_sha):
+        self.write({"devName": record.devName, "status": "done", "file": config_name, "sha256": output_sha,
+                    "mgmt_ipaddr": record.mgmt_ipaddr, "deviceType": record.deviceType})
+
+    def device_failed(self, record, reason):
+        self.write({"devName": record.devName, "status": "failed", "reason": reason})
+
+    def flush(self):
+        self.statusFile.flush()
+
+    def status_of(self, devName):
+        with self.lock:
+            return self.latest.get(devName)
+
+    def close(self):
+        self.statusFile.close()
+
+
+class WebhookHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"       # keep-alive
+    # The headers and the body go out in two writes; without this, every response on a
+    # keep-alive connection waits ~40ms for the sender's delayed ACK.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        receiver = self.server.receiver
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_SIZE:
+            self.send_json(413, {"detail": "The body is too large."}, close=True)
+            return
+        body = self.rfile.read(length)
+        if self.path.split("?")[0].rstrip("/") not in ("", "/webhook"):
+            self.send_json(404, {"detail": "Not found."})
+            return
+        try:
+            if receiver.secret and not signature_ok(receiver.secret, body, self.headers.get(SIGNATURE_HEADER)):
+                raise WebhookError(403, f"The {SIGNATURE_HEADER} header does not match the body.")
+            event, key, record = parse_event(body, receiver.source, receiver.defaults)
+        except WebhookError as err:
+            receiver.rejected += 1
+            self.send_json(err.status, {"detail": str(err)})
+            return
+        if not receiver.thread.is_alive():
+            self.send_json(503, {"detail": f"The render thread has stopped. {receiver.error}"})
+            return
+        if record is None:
+            receiver.ignored += 1
+            self.send_json(202, {"event": event, "queued": False})
+            return
+        receiver.coalescer.add(key, record)
+        self.send_json(202, {"event": event, "queued": record.devName})
+
+    def do_GET(self):
+        receiver = self.server.receiver
+        path = self.path.split("?")[0].rstrip("/")
+        if path.startswith("/status/"):
+            status = receiver.status.status_of(path[len("/status/"):])
+            if status is None:
+                self.send_json(404, {"detail": "No status for this device."})
+            else:
+                self.send_json(200, status)
+        elif path == "/status":
+            self.send_json(200 if receiver.thread.is_alive() else 503, receiver.counters())
+        else:
+            self.send_json(404, {"detail": "Not found."})
+
+    def send_json(self, status, body, close=False):
+        body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if close:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class WebhookReceiver:
+    """
+    NOTE: The HTTP server and the render thread. The renderer, reference data and
+    optional stages are the same objects batch_cli builds for a run, kept for the life
+    of the receiver. The OutputWriter is made by 'open_writer' on the render thread,
+    the only thread that uses it (the config history's SQLite connection cannot be
+    shared between threads).
+    """
+
+    def __init__(self, renderer, open_writer, reference, status, source="nautobot", defaults=None, secret=None,
+                 debounce=DEFAULT_DEBOUNCE, max_wait=DEFAULT_MAX_WAIT, linter=None, placeholders=None, report=print):
+        from STIG_Modules.batch_render import new_batch_stats
+        self.renderer = renderer
+        self.open_writer = open_writer
+        self.writer_lines = []
+        self.reference = reference
+        self.status = status
+        self.source = source
+        self.defaults = defaults or {}
+        self.secret = secret
+        self.linter = linter
+        self.placeholders = placeholders
+        self.report = report
+        self.coalescer = EventCoalescer(debounce, max_wait)
+        self.stats = new_batch_stats()
+        self.rejected = 0
+        self.ignored = 0
+        self.batches = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.render_errors = 0
+        self.error = None
+        self.thread = threading.Thread(target=self.render_loop, name="webhook-render", daemon=True)
+
+    def render_loop(self):
+        """
+        NOTE: An unexpected error in a batch is reported, the devices of the batch that
+        have no outcome yet are recorded as failed ('error'), and the loop carries on.
+        If the thread itself stops, GET /status answers 503 and events are refused.
+        """
+        from STIG_Modules.batch_render import run_batch
+        writer = None
+        try:
+            writer = self.open_writer()
+            first_run_id = writer.run_id
+            while True:
+                ready = self.coalescer.take_ready()
+                if not ready:
+                    return
+                if self.batches and first_run_id is not None:
+                    # One run per batch, so every update of a device gets its own generation.
+                    writer.new_run(f"{first_run_id}.{self.batches + 1:06d}")
+                self.status.begin({record.devName: (last, events) for record, last, events in ready})
+                try:
+                    run_batch((record for record, _, _ in ready), self.renderer, writer, self.reference, self.report,
+                              self.stats, manifest=self.status, linter=self.linter, placeholders=self.placeholders)
+                except Exception as err:
+                    self.batch_error(ready, err)
+                self.status.flush()
+                now = time.monotonic()
+                self.batches += 1
+                for _, last, _ in ready:
+                    self.latency_total += now - last
+                    self.latency_max = max(self.latency_max, now - last)
+        except Exception as err:
+            self.error = f"{type(err).__name__}: {err}"
+            self.report(f"   FAILED:     The render thread has stopped. {self.error}")
+        finally:
+            if writer is not None:
+                self.writer_lines = writer.summary_lines()
+                writer.close()
+
+    def batch_error(self, ready, err):
+        self.render_errors += 1
+        self.error = f"{type(err).__name__}: {err}"
+        self.report(f"   FAILED:     A render batch of {len(ready)} devices stopped. {self.error}")
+        for record, _, _ in ready:
+            if record.devName not in self.status.written:
+                self.stats["failed"] += 1
+                self.stats["failures"]["error"] = self.stats["failures"].get("error", 0) + 1
+                self.status.device_failed(record, "error")
+
+    def counters(self):
+        return {"events": self.coalescer.events, "coalesced": self.coalescer.coalesced, "ignored": self.ignored,
+                "rejected": self.rejected, "pending": len(self.coalescer.pending), "rendered": self.stats["rendered"],
+                "failed": self.stats["failed"], "batches": self.batches, "render_errors": self.render_errors,
+                "render_thread": "running" if self.thread.is_alive() else "stopped", "last_error": self.error}
+
+    def serve(self, host, port):
+        """
+        NOTE: Serves until interrupted (Ctrl+C), then renders what is still queued.
+        """
+        server = http.server.ThreadingHTTPServer((host, port), WebhookHandler)
+        server.daemon_threads = True
+        server.receiver = self
+        self.thread.start()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.coalescer.stop()
+            self.thread.join()
+
+    def summary_lines(self):
+        devices = self.stats["rendered"] + self.stats["failed"]
+        lines = ["\n" + "#"*21 + "\n## WEBHOOK SUMMARY ##\n" + "#"*21,
+                 f"  Events received:           {self.coalescer.events}",
+                 f"      {'coalesced':<22} {self.coalescer.coalesced}",
+                 f"      {'ignored':<22} {self.ignored}",
+                 f"      {'rejected':<22} {self.rejected}",
+                 f"  Render batches:            {self.batches}",
+                 f"  Configs generated:         {self.stats['rendered']}",
+                 f"  Devices failed:            {self.stats['failed']}"]
+        for reason, count in sorted(self.stats["failures"].items()):
+            lines.append(f"      {reason:<22} {count}")
+        if self.error is not None:
+            lines.append(f"  Last render error:         {self.error}")
+        if devices:
+            lines.append(f"  Last event to config:      {self.latency_total / devices * 1000:.0f} ms average, "
+                         f"{self.latency_max * 1000:.0f} ms max")
+        lines.append(f"  Status record:             {self.status.path}")
+        return lines
+
+
+def serve(args, defaults, settings):
+    """
+    NOTE: The --webhook entry point of batch_cli. Everything a run would load up front
+    (secret vault, RTT matrix, collector lists, value map, templates) is loaded once
+    here; site password hashes are computed the first time a site is seen.
+    """
+    from STIG_Modules.batch_cli import open_latency, reporter
+    from STIG_Modules.batch_render import OutputWriter, TemplateRenderer
+    from STIG_Modules.placeholder_values import PlaceholderValues, PlaceholderValuesError
+    from STIG_Modules.reference_data import ReferenceData
+    from STIG_Modules.secret_vault import VaultError
+    from STIG_Modules.server_latency import ServerLatencyError
+    from STIG_Modules.snmp_collectors import SnmpCollectors, SnmpCollectorsError
+    if not args.webhook_secret and not is_loopback(args.webhook_host):
+        print(f"ERROR:\n   Listening on [{args.webhook_host}] needs a webhook secret (--webhook-secret or "
+              f"{SECRET_ENV}),\n   otherwise anyone who can reach the port can have configs generated."
+              "\n\nEXITING SCRIPT...\n")
+        return 1
+    if not os.path.isdir(args.output_dir):
+        print(f"ERROR:\n   The output directory [{args.output_dir}] does not exist.\n\nEXITING SCRIPT...\n")
+        return 1
+    secrets = None
+    hasher = None
+    try:
+        if args.secret_vault:
+            from STIG_Modules.secret_vault import SecretProvider, read_passphrase
+            secrets = SecretProvider(settings["secret_vault_path"], read_passphrase())
+            secrets.prefetch(None)
+        reference = ReferenceData(settings["stig_templates_path"], secrets, open_latency(args))
+        collectors = SnmpCollectors(settings["stig_templates_path"]) if args.snmp_collectors else None
+        placeholders = PlaceholderValues(args.placeholder_values) if args.fill_placeholders else None
+    except (VaultError, PlaceholderValuesError, SnmpCollectorsError, ServerLatencyError, OSError) as err:
+        print(f"\nERROR:\n   {err}\n\nEXITING SCRIPT...\n")
+        if secrets is not None:
+            secrets.zeroise()
+        return 1
+    if args.hash_secrets:
+        from STIG_Modules.secret_hashing import SecretHasher
+        hasher = SecretHasher(args.ios_secret_type, args.hash_workers)
+    renderer = TemplateRenderer(settings["jinja_templates_path"], hasher, collectors)
+
+    def open_writer():
+        return OutputWriter(args.output_dir, settings["stig_config_file_PREFIX"],
+                            content_store_path=settings["content_store_path"] if args.content_store else None,
+                            history_db=settings["config_history_db"] if args.history else None)
+    linter = None
+    if args.lint:
+        from STIG_Modules.config_lint import ConfigLinter
+        linter = ConfigLinter(args.lint_strict)
+    status = StatusLog(settings["webhook_status_path"])
+    receiver = WebhookReceiver(renderer, open_writer, reference, status, args.webhook_source, defaults,
+                               args.webhook_secret, args.webhook_debounce, settings["webhook_max_wait"],
+                               linter, placeholders, reporter(args.quiet))
+    print("\n___BATCH MODE (WEBHOOK)___\n")
+    print(f"Listening for {args.webhook_source} device webhooks at "
+          f"http://{args.webhook_host}:{args.webhook_port}/webhook  (Ctrl+C to stop)\n")
+    if not args.webhook_secret:
+        print(f"WARNING: No webhook secret is set (--webhook-secret or {SECRET_ENV}); events are accepted "
+              "without a signature.\n")
+    try:
+        receiver.serve(args.webhook_host, args.webhook_port)
+    finally:
+        status.close()
+        if secrets is not None:
+            secrets.zeroise()
+        if hasher is not None:
+            hasher.close()
+    for line in (receiver.summary_lines() + receiver.writer_lines
+                 + (hasher.summary_lines() if hasher is not None else [])
+                 + (reference.latency.summary_lines() if reference.latency is not None else [])
+                 + (collectors.summary_lines() if collectors is not None else [])
+                 + (placeholders.summary_lines() if placeholders is not None else [])
+                 + (receiver.linter.summary_lines() if receiver.linter is not None else [])):
+        print(line)
+    return 0
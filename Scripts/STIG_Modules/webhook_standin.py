@@ -0,0 +1,94 @@
+"""
+TITLE:           webhook_standin.py
+LICENSE:         Apache-2.0 License
+CONTACT:         https://github.com/EndlessDynamics/Stig_Config_Builder_CISCO
+
+PURPOSE:        1) A small local stand-in for NetBox/Nautobot webhooks, used to try out the
+                webhook receiver (webhook_receiver.py) without a real DCIM. It sends every
+                device of a device export file (JSON) to the receiver as a dcim.device
+                'updated' event, in the same body a NetBox/Nautobot webhook sends.
+                2) '--repeat N' sends each device N times (as a bulk import or a script
+                editing several fields would), to see the events coalesced.
+                '--connections N' sends from N keep-alive connections at once.
+                3) With '--secret', every body is signed in the X-Hook-Signature header.
+
+USAGE:          From the ./Scripts directory:
+                python -m STIG_Modules.webhook_standin netbox_devices.json
+                python -m STIG_Modules.webhook_standin netbox_devices.json --repeat 3 --connections 8
+"""
+
+import argparse, hashlib, hmac, http.client, json, os, sys, threading, time
+from urllib.parse import urlsplit
+
+from STIG_Modules.inventory_adapters import iter_json_array
+from STIG_Modules.webhook_receiver import SECRET_ENV, SIGNATURE_HEADER
+
+
+def event_body(device, event, source):
+    return json.dumps({"event": event, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "model": "device" if source == "netbox" else "dcim.device", "username": "webhook_standin",
+                       "request_id": None, "data": device}).encode("utf-8")
+
+def send_events(url, bodies, secret, results):
+    """
+    NOTE: Sends the bodies in order over one keep-alive connection. Appends
+    (HTTP status, seconds) per event to 'results'.
+    """
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    path = parts.path or "/webhook"
+    try:
+        for body in bodies:
+            headers = {"Content-Type": "application/json"}
+            if secret:
+                headers[SIGNATURE_HEADER] = hmac.new(secret.encode("utf-8"), body, hashlib.sha512).hexdigest()
+            started = time.perf_counter()
+            connection.request("POST", path, body, headers)
+            response = connection.getresponse()
+            response.read()
+            results.append((response.status, time.perf_counter() - started))
+    finally:
+        connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m STIG_Modules.webhook_standin",
+                                     description="Send the devices of an export file to the webhook receiver.")
+    parser.add_argument("export", help="device export file (JSON)")
+    parser.add_argument("--url", default="http://127.0.0.1:8081/webhook")
+    parser.add_argument("--source", choices=("netbox", "nautobot"), default="nautobot")
+    parser.add_argument("--event", choices=("created", "updated", "deleted"), default="updated")
+    parser.add_argument("--repeat", type=int, default=1, help="events sent per device (default: %(default)s)")
+    parser.add_argument("--connections", type=int, default=1, help="connections sending at once (default: %(default)s)")
+    parser.add_argument("--secret", default=os.environ.get(SECRET_ENV), help=f"signing secret (default: ${SECRET_ENV})")
+    args = parser.parse_args(argv)
+
+    with open(args.export) as jsonFile:
+        devices = list(iter_json_array(jsonFile))
+    bodies = [event_body(device, args.event, args.source) for _ in range(args.repeat) for device in devices]
+    results = []
+    started = time.perf_counter()
+    threads = [threading.Thread(target=send_events, args=(args.url, bodies[number::args.connections], args.secret,
+                                                          results))
+               for number in range(args.connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    timings = sorted(seconds for _, seconds in results)
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    print(f"  Events sent:               {len(results)} of {len(bodies)}  ({len(devices)} devices x {args.repeat})")
+    for status, count in sorted(statuses.items()):
+        print(f"      HTTP {status:<17} {count}")
+    if timings:
+        print(f"  Response time:             {sum(timings) / len(timings) * 1000:.2f} ms average, "
+              f"{timings[int(len(timings) * 0.99) - 1 if len(timings) > 1 else 0] * 1000:.2f} ms p99")
+    print(f"  Elapsed:                   {elapsed:.2f}s")
+    return 0 if len(results) == len(bodies) and set(statuses) <= {202} else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
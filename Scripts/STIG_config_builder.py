@@ -30,6 +30,7 @@ LIMITATIONS:    1) This 1.x version can only be used for Cisco network devices r
 REQUIREMENTS:   1) The below files and directories must exist RELATIVE to this script:
                 - ./File_Mode/multidevice_instructions.txt
                 - ./File_Mode/multidevice_example.csv
+                - ./File_Mode/multidevice_example_header.csv
                 - ./Generated_Configs/
                 - ./STIG_Templates/aaa_servers.csv
                 - ./STIG_Templates/aaa_servers_OOB.csv
@@ -78,8 +79,7 @@ CAVEATS:        1) At runtime, you will have the option to provide your own csv
                 in a single csv file.
 """
 
-import csv, sys, readline, os
-from jinja2 import Environment, FileSystemLoader
+import sys, os
 
 # ========================================================================================
 # List script variables.
@@ -106,6 +106,157 @@ stig_templates_path = "STIG_Templates/"         # To STIG template files contain
 file_mode_path = "File_Mode/"                   # To files used in 'File Mode'
 stig_config_file_path = "./Generated_Configs/"  # To new STIG configuration files
 
+"""
+IMPORTANT_NOTE:
+[OPTIONAL] Content-addressed output store. When enabled, each generated config is stored
+once under 'content_store_path' (named by its SHA-256), indexed by hostname per run, and
+the usual STIG_Config_<devName> file is created as a hardlink to it. Identical configs,
+including identical configs from earlier runs, then share a single copy on disk.
+See ./STIG_Modules/output_store.py for the details.
+"""
+ENABLE_content_store = False
+content_store_path = stig_config_file_path + ".stig_store/"
+
+"""
+IMPORTANT_NOTE:
+[OPTIONAL] Config history. When enabled, every generation of every generated config is
+kept in 'config_history_db' as a compressed delta against the generation before it, so
+nothing pushed in an earlier run is lost when STIG_Config_<devName> gets overwritten.
+Query it with:  python -m STIG_Modules.config_history --help
+"""
+ENABLE_config_history = False
+config_history_db = stig_config_file_path + ".stig_history.sqlite3"
+
+"""
+IMPORTANT_NOTE:
+Batch Mode only. Devices pulled from a NetBox/Nautobot URL are cached in
+'inventory_cache_db'. Within 'inventory_cache_ttl' seconds of the last pull the cache is
+used as-is; after that, only the devices changed since the last pull are requested.
+Set inventory_cache_db = None (or use --no-inventory-cache) to always pull everything.
+"""
+inventory_cache_db = stig_config_file_path + ".stig_inventory_cache.sqlite3"
+inventory_cache_ttl = 300
+
+"""
+IMPORTANT_NOTE:
+Batch Mode only. When enabled (or with --job-store), the progress of every run is kept in
+'job_store_db', and an interrupted run can be continued with:  --resume <JOB_ID>
+Check on a job, also while it is running, with:  python -m STIG_Modules.job_store --help
+"""
+ENABLE_job_store = False
+job_store_db = stig_config_file_path + ".stig_jobs.sqlite3"
+
+"""
+IMPORTANT_NOTE:
+Batch Mode only. When enabled (or with --secret-vault), the site passwords and SNMP users
+are read from the encrypted 'secret_vault_path' instead of site_passwords.csv and
+snmp_users_*.csv. The vault is decrypted once per run with the passphrase in the
+STIG_VAULT_PASSPHRASE environment variable (or a prompt). Requires: pip install cryptography
+Create it with:  python -m STIG_Modules.secret_vault create
+"""
+ENABLE_secret_vault = False
+secret_vault_path = stig_templates_path + "stig_secrets.vault"
+
+"""
+IMPORTANT_NOTE:
+Batch Mode only. When enabled (or with --hash-secrets), the site password is put in the
+configs as a hash instead of cleartext: IOS/IOS-XE as type 9 (scrypt) or type 8
+(PBKDF2-SHA256) per 'hashed_secret_IOS_type', and NX-OS as 'password 5' (SHA-512 crypt).
+Every site password is hashed once per run, in parallel. See STIG_Modules/secret_hashing.py
+"""
+ENABLE_hashed_secrets = False
+hashed_secret_IOS_type = 9
+
+"""
+IMPORTANT_NOTE:
+Batch Mode only. Every generated config is linted as it is written, for leftover
+[ReplaceThisValueWith:...] values, x.x.x.x addresses, empty template values and commands
+that must not reach a device (see STIG_Modules/config_lint.py). Findings are reported per
+device; with config_lint_strict (or --lint-strict) such a config is not saved at all.
+"""
+ENABLE_config_lint = True
+config_lint_strict = False
+
+"""
+IMPORTANT_NOTE:
+Batch Mode only. When enabled (or with --fill-placeholders), the [ReplaceThisValueWith:KEY]
+values the templates leave for operators are filled in from 'placeholder_values_path'.
+Each row is "site_id","networkType","KEY","VALUE" ("*" for any); the most specific row
+for a device's site and networkType wins. Keys with no value are reported per device.
+"""
+ENABLE_placeholder_values = False
+placeholder_values_path = stig_templates_path + "placeholder_values.csv"
+
+"""
+IMPORTANT_NOTE:
+Batch Mode only. When enabled (or with --snmp-collectors), the SNMP READ/WRITE ACLs of
+IOS and NX-OS configs list the collectors in snmp_collectors_<networkType>.csv (or
+snmp_collectors.csv) in 'stig_templates_path', merged into the fewest prefixes, instead
+of the placeholder host lines. Rows are "READ","10.1.2.3" or "WRITE","10.1.8.0/24".
+"""
+ENABLE_snmp_collectors = False
+
+"""
+IMPORTANT_NOTE:
+Batch Mode only. When enabled (or with --server-latency), the AAA and NTP servers of every
+site found in 'server_latency_path' (a site x server matrix of measured RTTs in ms) are
+the fastest reachable servers of the device's network, fastest first, instead of the
+servers of its REGION. See STIG_Modules/server_latency.py for the file format.
+"""
+ENABLE_server_latency = False
+server_latency_path = stig_templates_path + "server_latency.csv"
+
+"""
+IMPORTANT_NOTE:
+Batch Mode only. With --watch, the script keeps running and generates the configs of every
+csv file uploaded into 'file_mode_path' (or --watch-dir) seconds after the upload is
+complete: unchanged for 'drop_watch_settle' seconds, looked at every 'drop_watch_interval'.
+Uploads are told apart by content, so a file already processed is not generated again.
+Each drop's output is logged in 'drop_log_path'. See STIG_Modules/drop_watch.py
+"""
+drop_watch_interval = 1.0
+drop_watch_settle = 2.0
+drop_watch_db = stig_config_file_path + ".stig_drops.sqlite3"
+drop_log_path = stig_config_file_path + "Drop_Logs/"
+
+"""
+IMPORTANT_NOTE:
+Batch Mode only. With --webhook, the script listens for NetBox/Nautobot device webhooks
+(created/updated) on 'webhook_host':'webhook_port' and regenerates the config of every
+device they name. Bursts of events for one device are rendered once, after
+'webhook_debounce' seconds without a new event (at most 'webhook_max_wait' seconds after
+the first). Each outcome is appended to 'webhook_status_path'. Unless 'webhook_host' is a
+loopback address, a secret is required (--webhook-secret or STIG_WEBHOOK_SECRET). See
+STIG_Modules/webhook_receiver.py
+"""
+webhook_host = "127.0.0.1"
+webhook_port = 8081
+webhook_debounce = 0.5
+webhook_max_wait = 5.0
+webhook_status_path = stig_config_file_path + ".stig_webhook_status.jsonl"
+
+"""
+IMPORTANT_NOTE:
+Batch Mode only. A --csv file of 'csv_parallel_min_size' bytes or more (full-estate CMDB
+exports) is memory-mapped, split into chunks on record boundaries and parsed by
+'csv_parse_workers' processes (None = one per CPU, 1 = no parser processes) while the
+batch loop renders. Smaller files are read as before. See STIG_Modules/csv_chunks.py
+"""
+csv_parse_workers = None
+csv_parallel_min_size = 64 * 1024 * 1024
+
+"""
+IMPORTANT_NOTE:
+Batch Mode only. With ENABLE_run_metrics (or --metrics), every run writes its metrics
+(configs per platform, failures per reason, render/write times, bytes written, cache hits,
+reference data version) to 'run_metrics_path' in the Prometheus text format, at the start,
+every 'run_metrics_interval' seconds (0 = never) and at the end. Point it at the
+node_exporter textfile collector directory. See STIG_Modules/run_metrics.py
+"""
+ENABLE_run_metrics = False
+run_metrics_path = stig_config_file_path + "stig_builder.prom"
+run_metrics_interval = 15.0
+
 # STIG Reference (SNMP): user and device location data
 FILE_snmp_locations = stig_templates_path + "snmp_locations.csv"
 FILE_snmp_users_IOS = stig_templates_path + "snmp_users_IOS.csv"
@@ -265,6 +416,116 @@ def contact_support(cisco_platform):
     print(f"\nIf you need help generating configs for a(n) {cisco_platform} system, please contact:")
     print("Corporate HQ Network Department at: CorporateEmail@domain.com\n")
 
+output_writer = None
+
+def save_stig_config(STIG_config_abs_path, devName, output):
+    """
+    NOTE: Writes the rendered config to its STIG_Config_<devName> file. If the optional
+    content-addressed store is enabled (see ENABLE_content_store at the top of this
+    script), the file becomes a hardlink into the store rather than a full copy. If the
+    optional config history is enabled, this generation is also added to the history.
+    """
+    global output_writer
+    if output_writer is None:
+        from STIG_Modules.batch_render import OutputWriter
+        output_writer = OutputWriter(stig_config_file_path, stig_config_file_PREFIX,
+                                     content_store_path=content_store_path if ENABLE_content_store else None,
+                                     history_db=config_history_db if ENABLE_config_history else None)
+    output_writer.save(STIG_config_abs_path, devName, output)
+
+reference_data = None
+
+def file_mode_records(inputFile):
+    """
+    NOTE: File Mode reads its csv through the schema mapper in ./STIG_Modules, which
+    accepts both the legacy layout (no header row) and the header-driven layout. See
+    ./File_Mode/multidevice_instructions.txt for both formats. Any reference column
+    left empty in a header-layout file is looked up in the STIG_Templates files.
+    """
+    global reference_data
+    from STIG_Modules.device_schema import read_device_file, DeviceFileError
+    from STIG_Modules.batch_render import needs_resolution, resolve_record, BatchError
+    try:
+        for record in read_device_file(inputFile):
+            if needs_resolution(record):
+                if reference_data is None:
+                    from STIG_Modules.reference_data import ReferenceData
+                    reference_data = ReferenceData(stig_templates_path)
+                record = resolve_record(record, reference_data)
+            yield record
+    except (DeviceFileError, BatchError) as err:
+        print(f"\nERROR:\n   Your file could not be read. {err}")
+        print("Review the format requirements in:  " + example_instructions)
+        print("\n\nEXITING SCRIPT...\n")
+        sys.exit()
+
+def output_summary():
+    if output_writer is None:
+        return
+    for line in output_writer.summary_lines():
+        print(line)
+    output_writer.close()
+
+def batch_settings():
+    """
+    NOTE: The settings from the top of this script that Batch Mode needs.
+    """
+    return {"stig_templates_path": stig_templates_path,
+            "jinja_templates_path": "./Jinja_Templates",
+            "stig_config_file_path": stig_config_file_path,
+            "stig_config_file_PREFIX": stig_config_file_PREFIX,
+            "ENABLE_content_store": ENABLE_content_store,
+            "content_store_path": content_store_path,
+            "ENABLE_config_history": ENABLE_config_history,
+            "config_history_db": config_history_db,
+            "inventory_cache_db": inventory_cache_db,
+            "inventory_cache_ttl": inventory_cache_ttl,
+            "ENABLE_job_store": ENABLE_job_store,
+            "job_store_db": job_store_db,
+            "ENABLE_secret_vault": ENABLE_secret_vault,
+            "secret_vault_path": secret_vault_path,
+            "ENABLE_hashed_secrets": ENABLE_hashed_secrets,
+            "hashed_secret_IOS_type": hashed_secret_IOS_type,
+            "ENABLE_config_lint": ENABLE_config_lint,
+            "config_lint_strict": config_lint_strict,
+            "ENABLE_placeholder_values": ENABLE_placeholder_values,
+            "placeholder_values_path": placeholder_values_path,
+            "ENABLE_snmp_collectors": ENABLE_snmp_collectors,
+            "ENABLE_server_latency": ENABLE_server_latency,
+            "server_latency_path": server_latency_path,
+            "file_mode_path": file_mode_path,
+            "drop_watch_interval": drop_watch_interval,
+            "drop_watch_settle": drop_watch_settle,
+            "drop_watch_db": drop_watch_db,
+            "drop_log_path": drop_log_path,
+            "webhook_host": webhook_host,
+            "webhook_port": webhook_port,
+            "webhook_debounce": webhook_debounce,
+            "webhook_max_wait": webhook_max_wait,
+            "webhook_status_path": webhook_status_path,
+            "csv_parse_workers": csv_parse_workers,
+            "csv_parallel_min_size": csv_parallel_min_size,
+            "ENABLE_run_metrics": ENABLE_run_metrics,
+            "run_metrics_path": run_metrics_path,
+            "run_metrics_interval": run_metrics_interval}
+
+# =======================================================================================
+# =======================================================================================
+# Batch Mode: runs without any prompts when command line arguments are given.
+# =======================================================================================
+# =======================================================================================
+"""
+NOTE: Run 'python STIG_config_builder.py --help' for the available options. Without any
+arguments, the script starts the interactive menu below exactly as before.
+"""
+if len(sys.argv) > 1:
+    from STIG_Modules.batch_cli import main as batch_main
+    sys.exit(batch_main(sys.argv[1:], batch_settings()))
+
+# Only the prompts below need these; Batch Mode (and --help) starts without loading them.
+# readline gives every input() prompt line editing and history.
+import csv, readline
+
 # =======================================================================================
 # =======================================================================================
 # Prompt for Interactive or File mode.
@@ -1022,11 +1283,10 @@ if mode_prompt == "1":
     '''
     print("\n"*3 + "#"*35 + "\n## SELECTING THE PROPER TEMPLATE ##\n" + "#"*35 + "\n"*3)
 
-    # Identify and load the Jinja2 template directory.
-    file_loader = FileSystemLoader('./Jinja_Templates')
-
-    # Load the appropriate Jinja environment.
-    environ = Environment(loader=file_loader)
+    # Load the Jinja environment. The templates are precompiled into Python modules
+    # (rebuilt automatically whenever a .j2 file changes); see STIG_Modules/template_build.py.
+    from STIG_Modules.template_build import load_environment
+    environ = load_environment('./Jinja_Templates')
 
     # Assign the correct STIG template.
     if (("Router" in input_results[0]) or ("Switch_NON_NEXUS" in input_results[0])):
@@ -1122,8 +1382,7 @@ if mode_prompt == "1":
 
     # Save the rendored config as an exportable file.
     print("\n"*3 + "#"*34 + "\n## SAVING STIG CONFIG AS A FILE ##\n" + "#"*34 + "\n"*3)
-    with open(STIG_config_abs_path,"w") as genFile:
-        genFile.write(output)
+    save_stig_config(STIG_config_abs_path, devName, output)
     print("\n   SAVE SUCCESSFUL")
 
     # [OPTIONAL] Display the config in the terminal.
@@ -1163,43 +1422,41 @@ elif mode_prompt == "2":
     if not os.path.isfile(filemode_source):
         print("Your entry is NOT a file!")
         sys.exit()
-    with open (filemode_source) as inputFile:
-#
-#    with open (filemode_source, newline='') as inputFile:
-#
-        csv_data = csv.reader(inputFile)
-        for row in csv_data:
+    with open (filemode_source, newline='') as inputFile:
+        for record in file_mode_records(inputFile):
             print("\n"*3 + "#"*39 + "\n### NEW ROW IN FILE: REVIEWING DATA ###\n" + "#"*39)
-            networkType = row[0]
-            deviceType = row[1]
-            devName = row[2]
-            mgmt_ipaddr = row[3]
-            mgmt_interf = row[4]
-            vrf_exists = row[5]
-            vrf_name = row[6]
-            aaaServer_PRI = row[9]
-            aaaServer_SEC = row[10]
-            ntpServer_Prefer = row[11]
-            ntpServer_SEC = row[12]
-            ntpServer_TER = row[13]
-            ntpServer_ALT = row[14]
-            snmp_loc = row[15]
-            snmp_contact = row[16]
-            snmp_contact_phone = row[17]
-            site_password = row[18]
-            loggingSyntax = row[19]
-            snmp_READuser = row[20]
-            snmp_READrole = row[21]
-            snmp_READauthPW = row[22]
-            snmp_READprivPW = row[23]
-            snmp_READuserACL = row[24]
-            snmp_WRITEuser = row[25]
-            snmp_WRITErole = row[26]
-            snmp_WRITEauthPW = row[27]
-            snmp_WRITEprivPW = row[28]
-            snmp_WRITEuserACL = row[29]
+            networkType = record.networkType
+            deviceType = record.deviceType
+            devName = record.devName
+            mgmt_ipaddr = record.mgmt_ipaddr
+            mgmt_interf = record.mgmt_interf
+            vrf_exists = record.vrf_exists
+            vrf_name = record.vrf_name
+            geo_region = record.geo_region
+            ise_region = record.ise_region
+            aaaServer_PRI = record.aaaServer_PRI
+            aaaServer_SEC = record.aaaServer_SEC
+            ntpServer_Prefer = record.ntpServer_Prefer
+            ntpServer_SEC = record.ntpServer_SEC
+            ntpServer_TER = record.ntpServer_TER
+            ntpServer_ALT = record.ntpServer_ALT
+            snmp_loc = record.snmp_loc
+            snmp_contact = record.snmp_contact
+            snmp_contact_phone = record.snmp_contact_phone
+            site_password = record.site_password
+            loggingSyntax = record.loggingSyntax
+            snmp_READuser = record.snmp_READuser
+            snmp_READrole = record.snmp_READrole
+            snmp_READauthPW = record.snmp_READauthPW
+            snmp_READprivPW = record.snmp_READprivPW
+            snmp_READuserACL = record.snmp_READuserACL
+            snmp_WRITEuser = record.snmp_WRITEuser
+            snmp_WRITErole = record.snmp_WRITErole
+            snmp_WRITEauthPW = record.snmp_WRITEauthPW
+            snmp_WRITEprivPW = record.snmp_WRITEprivPW
+            snmp_WRITEuserACL = record.snmp_WRITEuserACL
             input_results.clear()
-            input_results.append([networkType,deviceType,devName,mgmt_ipaddr,mgmt_interf,vrf_exists,vrf_name,aaaServer_PRI,aaaServer_SEC,ntpServer_Prefer,ntpServer_SEC,ntpServer_TER,ntpServer_ALT,snmp_loc,snmp_contact,snmp_contact_phone,site_password,loggingSyntax,snmp_READuser,snmp_READrole,snmp_READauthPW,snmp_READprivPW,snmp_READuserACL,snmp_WRITEuser,snmp_WRITErole,snmp_WRITEauthPW,snmp_WRITEprivPW,snmp_WRITEuserACL])
+            input_results.append([networkType,deviceType,devName,mgmt_ipaddr,mgmt_interf,vrf_exists,vrf_name,geo_region,ise_region,aaaServer_PRI,aaaServer_SEC,ntpServer_Prefer,ntpServer_SEC,ntpServer_TER,ntpServer_ALT,snmp_loc,snmp_contact,snmp_contact_phone,site_password,loggingSyntax,snmp_READuser,snmp_READrole,snmp_READauthPW,snmp_READprivPW,snmp_READuserACL,snmp_WRITEuser,snmp_WRITErole,snmp_WRITEauthPW,snmp_WRITEprivPW,snmp_WRITEuserACL])
             print("\n\n\n   COMPLETED\n")
 
             # Create file and file location VARS.
@@ -1209,11 +1466,9 @@ elif mode_prompt == "2":
             # Prepare and load the appropriate Jinja2 templating environment.
             print("\n"*2 + "#"*35 + "\n## SELECTING THE PROPER TEMPLATE ##\n" + "#"*35 + "\n"*2)
 
-            # Identify and load the Jinja2 template directory.
-            file_loader = FileSystemLoader('./Jinja_Templates')
-
-            # Load the appropriate Jinja environment.
-            environ = Environment(loader=file_loader)
+            # Load the Jinja environment (precompiled templates; see STIG_Modules/template_build.py).
+            from STIG_Modules.template_build import load_environment
+            environ = load_environment('./Jinja_Templates')
 
             # Assign the correct STIG template.
             if (("Router" in input_results[0][1]) or ("Switch_NON_NEXUS" in input_results[0][1])):
@@ -1301,13 +1556,13 @@ elif mode_prompt == "2":
                             snmp_WRITErole = snmp_WRITErole,
                             snmp_WRITEauthPW = snmp_WRITEauthPW,
                             snmp_WRITEprivPW = snmp_WRITEprivPW,
-                            snmp_WRITEuserACL = snmp_WRITEuserACL)
+                            snmp_WRITEuserACL = snmp_WRITEuserACL,
+                            extras = record.extras._asdict())
             print("   COMPLETED")
 
             # Save the rendored config as an exportable file.
             print("\n"*3 + "#"*34 + "\n## SAVING STIG CONFIG AS A FILE ##\n" + "#"*34 + "\n"*3)
-            with open(STIG_config_abs_path,"w") as genFile:
-                genFile.write(output)
+            save_stig_config(STIG_config_abs_path, devName, output)
             print("   SAVE SUCCESSFUL")
 
             # [OPTIONAL] Display the config in the terminal.
@@ -1342,5 +1597,6 @@ else:
 # Exit Program.
 # ========================================================================================
 
+output_summary()
 print("\n"*3 + "#"*23 + "\n### Exiting Program ###\n" + "#"*23 + "\n"*3)
 sys.exit()